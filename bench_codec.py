@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Microbenchmark for the text codec
+
+Compares the throughput of parsing and formatting each type of text
+message with the table-driven codec (codec.py) against the original
+implementation, which is copied here (as legacy_*) for comparison.
+"""
+
+import argparse
+import sys
+import timeit
+import uuid
+
+from codec import format_text
+from codec import parse_text
+from codec import escape_str
+from codec import unescape_str
+
+
+LEGACY_CHAR2ESC = {
+        '<': '&lt;',
+        '>': '&gt;',
+        '\n': '&nl;',
+        '\t': '&tab;',
+        '/': '&fs;',
+        '&': '&amp;'
+        }
+
+
+def legacy_escape_str(text):
+    return ''.join(LEGACY_CHAR2ESC.get(char, char) for char in text)
+
+
+def legacy_unescape_str(text):
+    for char, e_echar in LEGACY_CHAR2ESC.items():
+        text = text.replace(e_echar, char)
+    return text
+
+
+def legacy_parse_msg(text):
+
+    msg = dict()
+    fields = [s.decode('utf-8') for s in text.split(b'/')]
+
+    if fields[0] == '<colupd':
+        msg['command'] = fields[0]
+        msg['viob_id'] = fields[1]
+        msg['color'] = fields[2]
+
+    elif fields[0] == '<posupd':
+        msg['command'] = fields[0]
+        msg['viob_id'] = fields[1]
+        msg['ll_x'] = fields[2]
+        msg['ll_y'] = fields[3]
+        msg['ur_x'] = fields[4]
+        msg['ur_y'] = fields[5]
+
+    elif fields[0] == '<newrec':
+        msg['command'] = fields[0]
+        msg['viob_id'] = fields[1]
+        msg['ll_x'] = fields[2]
+        msg['ll_y'] = fields[3]
+        msg['ur_x'] = fields[4]
+        msg['ur_y'] = fields[5]
+        msg['color'] = legacy_unescape_str(fields[6])
+
+    elif fields[0] == '<newtxt':
+        msg['command'] = fields[0]
+        msg['viob_id'] = fields[1]
+        msg['ll_x'] = fields[2]
+        msg['ll_y'] = fields[3]
+        msg['text'] = legacy_unescape_str(fields[4])
+        msg['color'] = legacy_unescape_str(fields[5])
+        msg['font'] = legacy_unescape_str(fields[6])
+        msg['size'] = legacy_unescape_str(fields[7])
+        msg['weight'] = legacy_unescape_str(fields[8])
+
+    elif fields[0] == '<newfre':
+        msg['command'] = fields[0]
+        msg['viob_id'] = fields[1]
+        msg['color'] = legacy_unescape_str(fields[2])
+        msg['lwidth'] = fields[3]
+        msg['point_str'] = fields[4]
+
+    elif fields[0] == '<erase':
+        msg['command'] = fields[0]
+        msg['viob_id'] = fields[1]
+
+    elif fields[0] == '<join':
+        msg['command'] = fields[0]
+        msg['board_id'] = legacy_unescape_str(fields[1])
+
+    return msg
+
+
+def legacy_format_msg(cmd, values):
+    """
+    Format a message the way the original push_ methods did
+    """
+
+    esc = legacy_escape_str
+
+    if cmd == '<colupd':
+        viob_id, color = values
+        msg = '<colupd/%s/%s' % (esc(str(viob_id)), esc(color))
+    elif cmd == '<posupd':
+        viob_id, ll_x, ll_y, ur_x, ur_y = values
+        msg = '<posupd/%s/%d/%d/%d/%d' % (
+                esc(str(viob_id)), ll_x, ll_y, ur_x, ur_y)
+    elif cmd == '<newrec':
+        viob_id, ll_x, ll_y, ur_x, ur_y, color = values
+        msg = '<newrec/%s/%d/%d/%d/%d/%s' % (
+                esc(str(viob_id)), ll_x, ll_y, ur_x, ur_y, esc(color))
+    elif cmd == '<newtxt':
+        viob_id, ll_x, ll_y, text, color, font, size, weight = values
+        msg = '<newtxt/%s/%d/%d/%s/%s/%s/%s/%s' % (
+                esc(str(viob_id)), ll_x, ll_y, esc(text),
+                esc(color), esc(font), esc(str(size)), esc(weight))
+    elif cmd == '<newfre':
+        viob_id, color, lwidth, points = values
+        point_str = ' '.join(['%x,%x' % (p[0], p[1]) for p in points])
+        msg = '<newfre/%s/%s/%d/%s' % (
+                esc(str(viob_id)), esc(color), lwidth, point_str)
+    elif cmd == '<erase':
+        msg = '<erase/%s' % esc(str(values[0]))
+    elif cmd == '<join':
+        msg = '<join/%s' % esc(str(values[0]))
+
+    return msg.encode('utf-8')
+
+
+def sample_cmds():
+    """
+    Return a list of (cmd, values) for a typical message
+    of each type
+    """
+
+    viob_id = str(uuid.uuid4())
+    stroke = [(200 + ind, 300 + (ind * 7) % 13) for ind in range(100)]
+
+    return [
+            ('<colupd', (viob_id, 'red')),
+            ('<posupd', (viob_id, 120, 340, 220, 380)),
+            ('<newrec', (viob_id, 120, 340, 220, 380, 'blue')),
+            ('<newtxt', (viob_id, 120, 340,
+                         'Some text, with a / and a <tag> in it',
+                         'black', 'Helvetica', 15, 'normal')),
+            ('<newfre', (viob_id, 'black', 4, stroke)),
+            ('<erase', (viob_id,)),
+            ('<join', ('default',))
+            ]
+
+
+def rate(func, iters):
+    """
+    Return the number of calls to func per second
+    """
+
+    return iters / timeit.timeit(func, number=iters)
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(
+            description='Compare the text codec against the original')
+    parser.add_argument(
+            '-n', '--iters', default=50000, type=int,
+            help='Number of iterations of each timing '
+            '[default=%(default)d]')
+    args = parser.parse_args(argv[1:])
+
+    print('thousands of messages per second')
+    print('%8s %10s %10s %10s %10s' % (
+            'msg', 'old parse', 'new parse', 'old format', 'new format'))
+
+    for cmd, values in sample_cmds():
+        # The freehand points have a new (more compact) form,
+        # (see stroke.py) so those messages are expected to differ
+        #
+        text_msg = format_text(cmd, values)
+        if cmd != '<newfre' and text_msg != legacy_format_msg(cmd, values):
+            print('ERROR: %s is formatted differently' % cmd)
+            return 1
+
+        rates = [
+                rate(lambda: legacy_parse_msg(text_msg), args.iters),
+                rate(lambda: parse_text(text_msg), args.iters),
+                rate(lambda: legacy_format_msg(cmd, values), args.iters),
+                rate(lambda: format_text(cmd, values), args.iters)]
+
+        print('%8s %10.0f %10.0f %10.0f %10.0f' % tuple(
+                [cmd] + [val / 1000 for val in rates]))
+
+    text = 'Some text, with a / and a <tag> in it' * 10
+    escaped = escape_str(text)
+    print('')
+    print('%8s %10s %10s' % ('', 'old', 'new'))
+    print('%8s %10.0f %10.0f' % (
+            'escape',
+            rate(lambda: legacy_escape_str(text), args.iters) / 1000,
+            rate(lambda: escape_str(text), args.iters) / 1000))
+    print('%8s %10.0f %10.0f' % (
+            'unescape',
+            rate(lambda: legacy_unescape_str(escaped), args.iters) / 1000,
+            rate(lambda: unescape_str(escaped), args.iters) / 1000))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
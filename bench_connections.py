@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Benchmark for how the server scales with the number of connected
+clients
+
+For each number of clients N, the benchmark connects N idle clients
+(each to its own board, so that they receive no traffic), and then
+measures the round-trip time for messages relayed between a pair
+of clients on another board.  Since the idle clients never have
+anything to read, the relay latency should not depend on N.
+"""
+
+import argparse
+import sys
+import time
+
+from bench_util import connect
+from bench_util import percentile
+from bench_util import raise_fd_limit
+from bench_util import spawn_server
+from bench_util import stop_server
+
+
+def recv_line(sock, buf):
+    """
+    Read from sock until buf contains a complete message, and
+    return the message and the rest of the buffer
+    """
+
+    while b'\n' not in buf:
+        data = sock.recv(65536)
+        if not data:
+            raise ConnectionError('server closed the connection')
+        buf += data
+
+    msg, buf = buf.split(b'\n', 1)
+    return msg, buf
+
+
+def wait_for(sock, buf, want):
+    """
+    Read messages from sock until the message want arrives,
+    and return the rest of the buffer
+    """
+
+    while True:
+        msg, buf = recv_line(sock, buf)
+        if msg == want:
+            return buf
+
+
+def bench(port, n_clients, n_msgs):
+    """
+    Connect n_clients idle clients, then time n_msgs round trips,
+    and return the time to connect the clients and the sorted
+    list of round-trip times
+    """
+
+    idle = list()
+    start = time.perf_counter()
+    for ind in range(n_clients):
+        idle.append(connect(port, 'idle-%d' % ind))
+
+    # Make sure that the server has processed all of the joins
+    # before starting the measurement
+    #
+    sender = connect(port, 'bench')
+    receiver = connect(port, 'bench')
+    rbuf = wait_for(receiver, b'', b'<join/bench')
+    connect_time = time.perf_counter() - start
+
+    sender.sendall(b'<newrec/bench-obj/0/0/10/10/red\n')
+    rbuf = wait_for(receiver, rbuf, b'<newrec/bench-obj/0/0/10/10/red')
+
+    rtts = list()
+    for ind in range(n_msgs):
+        msg = b'<posupd/bench-obj/%d/0/10/10' % ind
+        start = time.perf_counter()
+        sender.sendall(msg + b'\n')
+        rbuf = wait_for(receiver, rbuf, msg)
+        rtts.append(time.perf_counter() - start)
+
+    for sock in idle + [sender, receiver]:
+        sock.close()
+
+    return connect_time, sorted(rtts)
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(
+            description='Measure relay latency against number of clients')
+    parser.add_argument(
+            '-c', '--clients', default='10,100,1000,4000',
+            help='Comma-separated list of numbers of idle clients '
+            '[default=%(default)s]')
+    parser.add_argument(
+            '-n', '--msgs', default=1000, type=int,
+            help='Number of messages to time [default=%(default)d]')
+    args = parser.parse_args(argv[1:])
+
+    counts = [int(count) for count in args.clients.split(',')]
+
+    fd_limit = raise_fd_limit()
+    if max(counts) * 2 + 16 > fd_limit:
+        print('WARNING: the open file limit (%d) is too low' % fd_limit)
+
+    print('%8s %12s %10s %10s %10s' % (
+            'clients', 'connect (s)', 'p50 (us)', 'p99 (us)', 'max (us)'))
+
+    for count in counts:
+        proc, port = spawn_server()
+        connect_time, rtts = bench(port, count, args.msgs)
+        stop_server(proc)
+
+        print('%8d %12.2f %10.0f %10.0f %10.0f' % (
+                count, connect_time,
+                percentile(rtts, 50) * 1e6, percentile(rtts, 99) * 1e6,
+                rtts[-1] * 1e6))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
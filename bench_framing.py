@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Microbenchmark for splitting the input from a socket into messages
+
+Compares the SnoodsFramer (both SnoodsFramer.msgs, which copies the
+messages in one batch, and iterating over the memoryview slices)
+with the way that the input was split before: appending each recv
+to a bytes buffer and splitting the whole buffer with
+SnoodsProtocol.split_buf.  The input is fed to each
+method in fixed-size chunks (as if each chunk were the result of a
+recv), for several kinds of traffic:
+
+ - many small messages (such as position updates)
+ - the replay of a large board (many messages of different sizes)
+ - a single very long message (such as a long freehand stroke)
+"""
+
+import argparse
+import sys
+import time
+
+from framing import SnoodsFramer
+from protocol import SnoodsProtocol
+
+
+def split_buf_method(chunks):
+    """
+    Split the chunks the old way, and return the number of messages
+    """
+
+    inbuf = b''
+    n_msgs = 0
+    for chunk in chunks:
+        inbuf += chunk
+        msgs, inbuf = SnoodsProtocol.split_buf(inbuf)
+        n_msgs += len(msgs)
+
+    return n_msgs
+
+
+def framer_method(chunks):
+    """
+    Split the chunks into slices with a SnoodsFramer, and return
+    the number of messages
+    """
+
+    framer = SnoodsFramer(
+            SnoodsProtocol.recsep, max_msg_len=sum(map(len, chunks)))
+    n_msgs = 0
+    for chunk in chunks:
+        framer.feed(chunk)
+        for _msg in framer:
+            n_msgs += 1
+
+    return n_msgs
+
+
+def make_streams(size):
+    """
+    Return a list of (name, stream) pairs, where each stream
+    is approximately size bytes of framed messages
+    """
+
+    small = b'<posupd/3f1c9a52-8a9e-4d3b-9c5e-2f0d7b1e6a44/100/200/140/260\n'
+
+    replay = list()
+    n_bytes = 0
+    ind = 0
+    while n_bytes < size:
+        if ind % 10:
+            msg = small
+        else:
+            msg = b'<newfre/obj-%d/black/2/%s\n' % (ind, b'0a0b' * (ind % 500))
+        replay.append(msg)
+        n_bytes += len(msg)
+        ind += 1
+
+    stroke = b'<newfre/obj/black/2/' + b'0a0b' * (size // 4) + b'\n'
+
+    return [
+            ('small', small * (size // len(small))),
+            ('replay', b''.join(replay)),
+            ('stroke', stroke)]
+
+
+def framer_msgs_method(chunks):
+    """
+    Split the chunks with SnoodsFramer.msgs, and return the
+    number of messages
+    """
+
+    framer = SnoodsFramer(
+            SnoodsProtocol.recsep, max_msg_len=sum(map(len, chunks)))
+    n_msgs = 0
+    for chunk in chunks:
+        framer.feed(chunk)
+        n_msgs += len(framer.msgs())
+
+    return n_msgs
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(
+            description='Compare SnoodsFramer against split_buf')
+    parser.add_argument(
+            '-s', '--size', default=4 << 20, type=int,
+            help='Approximate bytes in each stream [default=%(default)d]')
+    parser.add_argument(
+            '-c', '--chunk', default=8192, type=int,
+            help='Bytes per recv [default=%(default)d]')
+    args = parser.parse_args(argv[1:])
+
+    methods = (split_buf_method, framer_msgs_method, framer_method)
+
+    print('%8s %10s %14s %14s %14s' % (
+            'stream', 'msgs', 'split_buf MB/s', 'msgs() MB/s', 'slices MB/s'))
+
+    for name, stream in make_streams(args.size):
+        chunks = [stream[ind:ind + args.chunk]
+                  for ind in range(0, len(stream), args.chunk)]
+
+        rates = list()
+        for method in methods:
+            start = time.perf_counter()
+            n_msgs = method(chunks)
+            elapsed = time.perf_counter() - start
+            rates.append(len(stream) / elapsed / (1 << 20))
+
+        print('%8s %10d %14.1f %14.1f %14.1f' % (
+                name, n_msgs, rates[0], rates[1], rates[2]))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
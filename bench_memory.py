@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Benchmark for the memory used by the server and the client
+
+Measures, for boards and connections generated the same way as
+in bench_render.py:
+
+  server_state     bytes per message folded into the state of a
+                   board (SnoodsBoardState, in msg_history)
+  server_catchup   bytes per message of the catch-up buffer that
+                   is shared by the clients that join the board
+  server_binary    bytes per message of the translation of the
+                   catch-up buffer for clients of the binary protocol
+  server_client    bytes per idle connection (the SnoodsConnection,
+                   its buffers, and the server's maps)
+  model_object     bytes per object in a SnoodsBoardModel
+                   (including its spatial index)
+  drawable_object  bytes per object in a SnoodsDrawableTk, with
+                   the whole board drawn on the canvas (the model,
+                   the drawable's maps, and the canvas items)
+
+By default the memory is measured with tracemalloc, which counts
+exactly what is allocated by Python code, but doesn't see memory
+allocated by Tk for the canvas items.  With --rss, the resident
+set size of the process is sampled instead, which includes the
+canvas, but is less precise (and includes memory that has been
+freed but not returned to the system).  The drawable is measured
+only if there is an X display (or Xvfb; see bench_render.py).
+
+The server state is measured after a mix of new objects, position
+and color updates, and erases, so the number of messages per object
+depends on the mix; the number of objects is reported too.
+
+With --budget, the exit status is 1 if any of the given measurements
+exceeds its budget, so this can be used to catch regressions in the
+memory used per object.
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import resource
+import socket
+import sys
+import tkinter as tk
+import tracemalloc
+
+from bench_render import BoardGen
+from bench_render import start_xvfb
+from bench_util import raise_fd_limit
+from board_state import SnoodsBoardState
+from drawable_tk import SnoodsDrawableTk
+from model import SnoodsBoardModel
+from protocol import SnoodsProtocol
+from server import SnoodsServer
+
+
+METRICS = (
+        'server_state', 'server_catchup', 'server_binary',
+        'server_client', 'model_object', 'drawable_object')
+
+
+def current_bytes(use_rss):
+    """
+    Return the number of bytes currently in use: the resident
+    set size of the process if use_rss is True, or else the
+    number of bytes traced by tracemalloc
+    """
+
+    if not use_rss:
+        return tracemalloc.get_traced_memory()[0]
+
+    try:
+        with open('/proc/self/statm') as fin:
+            return int(fin.read().split()[1]) * resource.getpagesize()
+    except OSError as _exc:
+        # The peak RSS is the best we can do without /proc;
+        # it's in kilobytes on Linux and bytes on macOS
+        #
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def measure(func, use_rss):
+    """
+    Call func, and return the number of bytes that were
+    allocated by the call and are still in use afterward,
+    and the return value of func (which must be kept in order
+    to keep what it allocated alive)
+    """
+
+    gc.collect()
+    before = current_bytes(use_rss)
+    value = func()
+    gc.collect()
+
+    return current_bytes(use_rss) - before, value
+
+
+def gen_changes(gen, n_msgs):
+    """
+    Return a list of n_msgs text messages that create objects and
+    change them: about half create new objects, and the rest are
+    position updates, color updates, and erases of those objects
+    """
+
+    rand = gen.rand
+    viob_ids = list()
+    msgs = list()
+
+    for _ind in range(n_msgs):
+        choice = rand.random()
+        if choice < 0.5 or not viob_ids:
+            msg = gen.new_object()
+            viob_ids.append(SnoodsProtocol.parse_msg(msg)['viob_id'])
+        elif choice < 0.8:
+            msg = gen.change('posupd', rand.choice(viob_ids))
+        elif choice < 0.95:
+            msg = gen.change('colupd', rand.choice(viob_ids))
+        else:
+            viob_id = viob_ids.pop(rand.randrange(len(viob_ids)))
+            msg = gen.change('erase', viob_id)
+        msgs.append(msg)
+
+    return msgs
+
+
+def measure_server(args, results):
+    """
+    Measure the memory used by the server for the state of a
+    board and for each connection, and add the results
+    """
+
+    use_rss = args.rss
+    server = SnoodsServer(None)
+    gen = BoardGen(
+            random.Random(args.seed), args.board_size, args.stroke_points)
+
+    def build_state():
+        # The messages are created here, rather than passed in,
+        # because the state keeps the messages it is given
+        #
+        state = SnoodsBoardState()
+        msgs = gen_changes(gen, args.messages)
+        for start in range(0, len(msgs), 100):
+            state.extend(msgs[start:start + 100])
+        return state
+
+    n_bytes, state = measure(build_state, use_rss)
+    server.msg_history['mem'] = state
+    results['server_state'] = n_bytes / args.messages
+    results['server_objects'] = state.num_objects()
+
+    n_bytes, _catchup = measure(state.catchup, use_rss)
+    results['server_catchup'] = n_bytes / args.messages
+
+    n_bytes, _binary = measure(
+            lambda: state.catchup(binary=True), use_rss)
+    results['server_binary'] = n_bytes / args.messages
+
+    # The sockets are created before measuring, because the other
+    # end of each connection would be counted too.  The clients
+    # join an empty board, so that the catch-up is sent right away.
+    #
+    pairs = [socket.socketpair() for _ind in range(args.clients)]
+
+    def add_clients():
+        for server_sock, _client_sock in pairs:
+            conn = server.add_client(server_sock)
+            server.join_board(conn, 'mem-clients')
+            server.flush_client(conn)
+
+    n_bytes, _ = measure(add_clients, use_rss)
+    results['server_client'] = n_bytes / args.clients
+
+    for server_sock, client_sock in pairs:
+        server_sock.close()
+        client_sock.close()
+
+
+def measure_model(args, results):
+    """
+    Measure the memory used by the client model for each
+    object, and add the results
+    """
+
+    gen = BoardGen(
+            random.Random(args.seed), args.board_size, args.stroke_points)
+
+    def build_model():
+        model = SnoodsBoardModel()
+        for _ind in range(args.objects):
+            model.apply_msg(SnoodsProtocol.parse_msg(gen.new_object()))
+        return model
+
+    n_bytes, model = measure(build_model, args.rss)
+    results['model_object'] = n_bytes / len(model.objects)
+
+
+def measure_drawable(args, results):
+    """
+    Measure the memory used by the drawable (with every object
+    drawn on the canvas) for each object, and add the results
+    """
+
+    gen = BoardGen(
+            random.Random(args.seed), args.board_size, args.stroke_points)
+    msgs = [SnoodsProtocol.format_msg('<join', ('mem',))]
+
+    drawable = SnoodsDrawableTk()
+
+    # Zoom out until the whole board fits in the window
+    #
+    drawable.zoom = min(
+            1.0, drawable.canvas_width / float(2 * args.board_size),
+            drawable.canvas_height / float(2 * args.board_size))
+
+    def load_board():
+        drawable.apply_msg(SnoodsProtocol.parse_msg(msgs[0]))
+        for _ind in range(args.objects):
+            drawable.post_msg(SnoodsProtocol.parse_msg(gen.new_object()))
+        while drawable.pending_ops:
+            drawable.drain_ops()
+        drawable.win.update()
+
+    try:
+        n_bytes, _ = measure(load_board, args.rss)
+        results['drawable_object'] = n_bytes / len(drawable.model.objects)
+        results['canvas_items'] = len(drawable.canvas.find_all())
+    finally:
+        drawable.win.destroy()
+
+
+def parse_budget(budget_str):
+    """
+    Parse a budget of the form metric=bytes,metric=bytes,...
+    and return a map from each metric to its budget
+    """
+
+    budget = dict()
+    for term in budget_str.split(','):
+        metric, n_bytes = term.split('=')
+        if metric not in METRICS:
+            raise ValueError('unknown measurement [%s]' % metric)
+        budget[metric] = float(n_bytes)
+
+    return budget
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(
+            description='Measure the memory used by the server and '
+            'the client')
+    parser.add_argument(
+            '-m', '--messages', default=50000, type=int,
+            help='Number of messages to fold into the state of the '
+            'board on the server [default=%(default)d]')
+    parser.add_argument(
+            '-c', '--clients', default=500, type=int,
+            help='Number of connections to the server '
+            '[default=%(default)d]')
+    parser.add_argument(
+            '-n', '--objects', default=20000, type=int,
+            help='Number of objects on the board in the client '
+            '[default=%(default)d]')
+    parser.add_argument(
+            '--board_size', default=4000, type=int,
+            help='Width and height of the area that the objects are '
+            'scattered over [default=%(default)d]')
+    parser.add_argument(
+            '--stroke_points', default=30, type=int,
+            help='Number of points in each drawing [default=%(default)d]')
+    parser.add_argument(
+            '--rss', default=False, action='store_true',
+            help='Sample the resident set size instead of using '
+            'tracemalloc')
+    parser.add_argument(
+            '--no_display', default=False, action='store_true',
+            help='Don\'t measure the drawable, even if there is a display')
+    parser.add_argument(
+            '--budget', default=None,
+            help='Exit with status 1 if any measurement exceeds its '
+            'budget, given as metric=bytes,metric=bytes,... (the '
+            'metrics are %s)' % ', '.join(METRICS))
+    parser.add_argument(
+            '--seed', default=0, type=int,
+            help='Seed for the random number generator '
+            '[default=%(default)d]')
+    parser.add_argument(
+            '-o', '--output', default=None,
+            help='Write the results as JSON to this file')
+    args = parser.parse_args(argv[1:])
+
+    budget = dict()
+    if args.budget:
+        try:
+            budget = parse_budget(args.budget)
+        except ValueError as exc:
+            print('ERROR: bad budget [%s]: %s' % (args.budget, str(exc)))
+            return 1
+
+    raise_fd_limit()
+    if not args.rss:
+        tracemalloc.start()
+
+    results = dict()
+    measure_server(args, results)
+    measure_model(args, results)
+
+    xvfb = None
+    if not args.no_display:
+        if not os.environ.get('DISPLAY'):
+            xvfb = start_xvfb()
+
+        if os.environ.get('DISPLAY'):
+            try:
+                measure_drawable(args, results)
+            except tk.TclError as exc:
+                print('ERROR: cannot use the display: %s' % str(exc))
+            finally:
+                if xvfb:
+                    xvfb.kill()
+                    xvfb.wait()
+        else:
+            print('No X display, and Xvfb is not available; '
+                  'not measuring the drawable')
+
+    print('measured with %s' % ('RSS' if args.rss else 'tracemalloc'))
+    print('%-16s %12s' % ('measurement', 'bytes'))
+    for metric in METRICS:
+        if metric in results:
+            print('%-16s %12.0f' % (metric, results[metric]))
+    print('(%d messages made %d objects on the server; %d connections; '
+          '%d objects in the client)' % (
+            args.messages, results['server_objects'], args.clients,
+            args.objects))
+    if 'canvas_items' in results:
+        print('(%d canvas items)' % results['canvas_items'])
+
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump({
+                    'method': 'rss' if args.rss else 'tracemalloc',
+                    'units': 'bytes',
+                    'results': results
+                    }, fout, indent=2, sort_keys=True)
+            fout.write('\n')
+
+    status = 0
+    for metric, limit in sorted(budget.items()):
+        if metric not in results:
+            print('WARNING: %s was not measured' % metric)
+        elif results[metric] > limit:
+            print('ERROR: %s is %.0f bytes, over the budget of %.0f' % (
+                    metric, results[metric], limit))
+            status = 1
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Microbenchmark suite for the hot functions in protocol.py
+
+Times escape_str, unescape_str, split_buf, parse_msg, the binary
+decoding and translation, and every push_* method (in both the
+text and the binary protocol), each on several realistic payloads:
+short updates, long text blocks, and long freehand drawings.  No
+network or display is needed: the push_* methods send to a socket
+that discards everything.
+
+Each case is timed several times, and the best time per call is
+reported, in microseconds.  With -o, the results are also written
+as JSON, which can be given to a later run with --baseline to
+compare against.  When comparing, the exit status is 1 if any case
+is slower than the baseline by more than --threshold percent, so
+this can be used to catch regressions.  (Timings from different
+machines, or from different versions of Python, aren't comparable.)
+"""
+
+import argparse
+import json
+import platform
+import sys
+import timeit
+import uuid
+
+from protocol import SnoodsBinaryCodec
+from protocol import SnoodsProtocol
+
+
+class NullSock(object):
+    """
+    A stand-in for a socket that discards everything sent to it
+    """
+
+    def sendall(self, data):
+        pass
+
+
+def make_text(n_bytes):
+    """
+    Return a text block of about n_bytes, with some lines and
+    some characters that must be escaped
+    """
+
+    line = 'The <quick> brown fox & the lazy/sleepy dog\tjumped.\n'
+    return (line * (n_bytes // len(line) + 1))[:n_bytes]
+
+
+def make_stroke(n_points):
+    """
+    Return a freehand drawing of n_points points
+    """
+
+    return [(200 + ind % 800, 300 + (ind * 7) % 400)
+            for ind in range(n_points)]
+
+
+def make_cases():
+    """
+    Return a list of (name, func) for every case to time
+    """
+
+    viob_id = str(uuid.uuid4())
+    short_text = 'Hello, world'
+    long_text = make_text(5000)
+    short_stroke = make_stroke(50)
+    long_stroke = make_stroke(2000)
+
+    cases = list()
+
+    def add(name, func, *args):
+        cases.append((name, lambda: func(*args)))
+
+    escaped_long = SnoodsProtocol.escape_str(long_text)
+    add('escape_str/short', SnoodsProtocol.escape_str, 'red')
+    add('escape_str/text5k', SnoodsProtocol.escape_str, long_text)
+    add('unescape_str/short', SnoodsProtocol.unescape_str, 'red')
+    add('unescape_str/text5k', SnoodsProtocol.unescape_str, escaped_long)
+
+    # Typical messages, in text and binary form
+    #
+    msgs = [
+            ('colupd', '<colupd', (viob_id, 'red')),
+            ('posupd', '<posupd', (viob_id, 120, 340, 220, 380)),
+            ('newtxt5k', '<newtxt', (viob_id, 120, 340, long_text,
+                                     'black', 'Helvetica', 15, 'normal')),
+            ('newfre2k', '<newfre', (viob_id, 'black', 4, long_stroke))
+            ]
+
+    recsep = SnoodsProtocol.recsep
+    for name, cmd, values in msgs:
+        text_msg = SnoodsProtocol.format_msg(cmd, values)
+        binary_msg = SnoodsBinaryCodec.encode(cmd, values)
+
+        add('format_msg/' + name, SnoodsProtocol.format_msg, cmd, values)
+        add('parse_msg/' + name, SnoodsProtocol.parse_msg, text_msg)
+        add('decode_msg/' + name, SnoodsBinaryCodec.decode_msg, binary_msg)
+        add('to_text/' + name, SnoodsBinaryCodec.to_text, binary_msg)
+        add('from_text/' + name, SnoodsBinaryCodec.from_text, text_msg)
+
+        # A buffer of 64 KB (or at least 10 messages) of the same
+        # message, as a server might receive in one recv()
+        #
+        n_msgs = max(10, 65536 // (len(text_msg) + 1))
+        buf = (text_msg + recsep) * n_msgs + text_msg[:10]
+        add('split_buf/' + name, SnoodsProtocol.split_buf, buf)
+
+    for version_name, version in (
+            ('text', SnoodsProtocol.TEXT_VERSION),
+            ('binary', SnoodsProtocol.BINARY_VERSION)):
+        wire = SnoodsProtocol(NullSock())
+        wire.set_version(version)
+
+        def push(name, method, *args):
+            add('%s/%s' % (method.__name__, name), method, *args)
+
+        push(version_name, wire.push_join, 'default')
+        push(version_name, wire.push_erase, viob_id)
+        push(version_name, wire.push_color_update, viob_id, 'red')
+        push(version_name, wire.push_position_update,
+             viob_id, 120, 340, 220, 380)
+        push(version_name, wire.push_create_rect,
+             viob_id, 120, 340, 220, 380, 'blue')
+        push(version_name + '/short', wire.push_create_text,
+             viob_id, 120, 340, short_text, 'black', 'Helvetica', 15,
+             'normal')
+        push(version_name + '/text5k', wire.push_create_text,
+             viob_id, 120, 340, long_text, 'black', 'Helvetica', 15,
+             'normal')
+        push(version_name + '/pts50', wire.push_freehand,
+             viob_id, short_stroke, 'black', 4)
+        push(version_name + '/pts2k', wire.push_freehand,
+             viob_id, long_stroke, 'black', 4)
+        push(version_name + '/pts2k', wire.push_begin_freehand,
+             viob_id, long_stroke, 'black', 4)
+        push(version_name + '/pts50', wire.push_add_freehand,
+             viob_id, short_stroke)
+        push(version_name, wire.push_end_freehand, viob_id)
+
+    return cases
+
+
+def time_case(func, repeat, min_time):
+    """
+    Return the best time per call to func, in microseconds,
+    from repeat timings of at least min_time seconds each
+    """
+
+    timer = timeit.Timer(func)
+
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+
+    return min(timer.repeat(repeat, number)) * 1e6 / number
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(
+            description='Time the hot functions in protocol.py')
+    parser.add_argument(
+            '-k', '--filter', default=None,
+            help='Only time the cases whose names contain this string')
+    parser.add_argument(
+            '-r', '--repeat', default=5, type=int,
+            help='Number of timings of each case [default=%(default)d]')
+    parser.add_argument(
+            '--min_time', default=0.05, type=float,
+            help='Shortest duration of each timing, in seconds '
+            '[default=%(default)g]')
+    parser.add_argument(
+            '-o', '--output', default=None,
+            help='Write the results as JSON to this file')
+    parser.add_argument(
+            '-b', '--baseline', default=None,
+            help='Compare the results against a JSON file '
+            'written earlier with -o')
+    parser.add_argument(
+            '--threshold', default=20, type=float,
+            help='Percent slower than the baseline that counts as '
+            'a regression [default=%(default)g]')
+    args = parser.parse_args(argv[1:])
+
+    baseline = None
+    if args.baseline:
+        try:
+            with open(args.baseline) as fin:
+                baseline = json.load(fin)['results']
+        except (OSError, ValueError, KeyError) as exc:
+            print('ERROR: cannot read baseline [%s]: %s' % (
+                    args.baseline, str(exc)))
+            return 1
+
+    results = dict()
+    regressions = list()
+
+    if baseline is None:
+        print('%-36s %12s' % ('case', 'us/call'))
+    else:
+        print('%-36s %12s %12s %8s' % (
+                'case', 'us/call', 'baseline', 'change'))
+
+    for name, func in make_cases():
+        if args.filter and args.filter not in name:
+            continue
+
+        usecs = time_case(func, args.repeat, args.min_time)
+        results[name] = usecs
+
+        if baseline is None:
+            print('%-36s %12.3f' % (name, usecs))
+        elif name not in baseline:
+            print('%-36s %12.3f %12s %8s' % (name, usecs, '-', '-'))
+        else:
+            change = 100.0 * (usecs / baseline[name] - 1)
+            flag = ''
+            if change > args.threshold:
+                regressions.append(name)
+                flag = ' SLOWER'
+            print('%-36s %12.3f %12.3f %+7.1f%%%s' % (
+                    name, usecs, baseline[name], change, flag))
+        sys.stdout.flush()
+
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump({
+                    'python': platform.python_version(),
+                    'machine': platform.machine(),
+                    'units': 'usec/call',
+                    'results': results
+                    }, fout, indent=2, sort_keys=True)
+            fout.write('\n')
+
+    if regressions:
+        print('ERROR: %d case(s) slower than the baseline by more '
+              'than %g%%: %s' % (
+                len(regressions), args.threshold, ', '.join(regressions)))
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
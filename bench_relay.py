@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Benchmark for the relay throughput of the server
+
+For each number of clients N, the benchmark connects N receiving
+clients to a board, and then a single sender sends a stream of
+position updates to the board as fast as the server will accept
+them.  The benchmark measures how long it takes until every
+receiver has received every message, and reports the rate at
+which the server accepted messages and the rate at which it
+delivered them (i.e. the accepted rate times N).
+"""
+
+import argparse
+import selectors
+import sys
+import time
+
+from bench_util import connect
+from bench_util import raise_fd_limit
+from bench_util import spawn_server
+from bench_util import stop_server
+
+
+def wait_for_joins(socks, board_id):
+    """
+    Wait until every socket in socks has received the join
+    message for board_id
+    """
+
+    want = b'<join/%s\n' % board_id.encode('utf-8')
+    for sock in socks:
+        buf = b''
+        while not buf.endswith(want):
+            buf += sock.recv(65536)
+
+
+def bench(port, n_clients, n_msgs, batch):
+    """
+    Send n_msgs messages to a board with n_clients receivers,
+    and return the elapsed time until all of the messages
+    were received by all of the receivers
+    """
+
+    receivers = [connect(port, 'relay') for _ind in range(n_clients)]
+    sender = connect(port, 'relay')
+    wait_for_joins(receivers + [sender], 'relay')
+
+    sel = selectors.DefaultSelector()
+    remaining = dict()
+    for sock in receivers:
+        sock.setblocking(False)
+        sel.register(sock, selectors.EVENT_READ)
+        remaining[sock] = n_msgs
+
+    # The sender also receives its own messages, but it
+    # doesn't read them until the end
+    #
+    msgs = [b'<posupd/obj-%d/%d/0/10/10\n' % (ind % 100, ind)
+            for ind in range(n_msgs)]
+
+    start = time.perf_counter()
+
+    sent = 0
+    sender.setblocking(False)
+    pending = b''
+    while remaining:
+        if sent < n_msgs and not pending:
+            pending = b''.join(msgs[sent:sent + batch])
+            sent += batch
+
+        if pending:
+            try:
+                n_sent = sender.send(pending)
+                pending = pending[n_sent:]
+            except BlockingIOError as _exc:
+                pass
+
+            # drain the sender's own echoes, so that it
+            # doesn't fall behind and get resynced
+            #
+            try:
+                while sender.recv(1 << 20):
+                    pass
+            except BlockingIOError as _exc:
+                pass
+
+        for key, _mask in sel.select(0 if pending else 0.1):
+            sock = key.fileobj
+            data = sock.recv(1 << 20)
+            remaining[sock] -= data.count(b'\n')
+            if remaining[sock] <= 0:
+                sel.unregister(sock)
+                del remaining[sock]
+
+    elapsed = time.perf_counter() - start
+
+    for sock in receivers + [sender]:
+        sock.close()
+
+    return elapsed
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(
+            description='Measure relay throughput against clients per board')
+    parser.add_argument(
+            '-c', '--clients', default='10,100,1000',
+            help='Comma-separated list of numbers of clients per board '
+            '[default=%(default)s]')
+    parser.add_argument(
+            '-n', '--msgs', default=20000, type=int,
+            help='Number of messages to send [default=%(default)d]')
+    parser.add_argument(
+            '-b', '--batch', default=20, type=int,
+            help='Number of messages per send [default=%(default)d]')
+    args = parser.parse_args(argv[1:])
+
+    counts = [int(count) for count in args.clients.split(',')]
+    raise_fd_limit()
+
+    print('%8s %10s %14s %16s' % (
+            'clients', 'time (s)', 'accepted/sec', 'delivered/sec'))
+
+    for count in counts:
+        # Make the high-water mark large enough that no client
+        # is resynced during the benchmark
+        #
+        proc, port = spawn_server('--high_water', str(1 << 30))
+        elapsed = bench(port, count, args.msgs, args.batch)
+        stop_server(proc)
+
+        print('%8d %10.2f %14.0f %16.0f' % (
+                count, elapsed, args.msgs / elapsed,
+                args.msgs * count / elapsed))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
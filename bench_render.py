@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Benchmark for rendering boards in the client
+
+Generates boards of several sizes (a mix of freehand drawings,
+rectangles, and text, scattered over a board that is larger than
+the window), and for each size loads the board into a
+SnoodsDrawableTk, the way the client does when it joins a board,
+and then applies a series of new drawings, position updates, color
+updates, and erases to it.  For each size, this reports the time
+to load the board (until it is fully drawn), the number of objects
+in the model and of items on the canvas, and the time per message
+of each kind, including updating the canvas and letting Tk redraw.
+
+The updates are for random objects on the board, and --in_view
+sets the fraction of them that are for objects in the window
+(the rest are for objects elsewhere on the board, which are much
+cheaper to update, because only the objects near the window are
+drawn on the canvas).  With --zoom 0.25 (or less), the whole board
+fits in the window, so every object is drawn.
+
+This needs an X display.  If DISPLAY isn't set, then this runs
+Xvfb, if it is installed, as a virtual display; otherwise it
+says so and exits.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+import tkinter as tk
+
+from drawable_tk import SnoodsDrawableTk
+from protocol import SnoodsProtocol
+
+
+COLORS = ['black', 'red', 'blue', 'coral', 'darkgreen', 'sienna', 'purple']
+FONTS = ['Helvetica', 'Times', 'Courier']
+WORDS = ['snood', 'board', 'pen', 'text', 'draw', 'move', 'erase', 'color']
+
+KINDS = ('newfre', 'posupd', 'colupd', 'erase')
+
+
+def start_xvfb(timeout=10):
+    """
+    Start Xvfb on a free display, and point DISPLAY at it
+
+    Returns the Xvfb process, or None if Xvfb isn't installed
+    or didn't start.
+    """
+
+    xvfb = shutil.which('Xvfb')
+    if not xvfb:
+        return None
+
+    for display in range(99, 200):
+        if os.path.exists('/tmp/.X%d-lock' % display):
+            continue
+
+        proc = subprocess.Popen(
+                [xvfb, ':%d' % display, '-screen', '0', '1600x1200x24',
+                 '-nolisten', 'tcp'],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                break
+            if os.path.exists('/tmp/.X11-unix/X%d' % display):
+                os.environ['DISPLAY'] = ':%d' % display
+                return proc
+            time.sleep(0.05)
+
+        proc.kill()
+        proc.wait()
+
+    return None
+
+
+class BoardGen(object):
+    """
+    Generates the messages that create and change the objects
+    on a board, in their text form
+    """
+
+    def __init__(self, rand, board_size, stroke_points):
+        self.rand = rand
+        self.board_size = board_size
+        self.stroke_points = stroke_points
+
+    def position(self):
+        """
+        Return a random position on the board
+        """
+
+        return (self.rand.randrange(self.board_size),
+                self.rand.randrange(self.board_size))
+
+    def new_object(self):
+        """
+        Return a message that creates a new object: a freehand
+        drawing (most of the time), a rectangle, or a text block
+        """
+
+        rand = self.rand
+        viob_id = SnoodsProtocol.create_viob_id()
+        p_x, p_y = self.position()
+        choice = rand.random()
+
+        if choice < 0.1:
+            return SnoodsProtocol.format_msg('<newrec', (
+                    viob_id, p_x, p_y, p_x + rand.randint(10, 200),
+                    p_y + rand.randint(10, 200), rand.choice(COLORS)))
+        elif choice < 0.2:
+            text = ' '.join([rand.choice(WORDS)
+                             for _ind in range(rand.randint(1, 8))])
+            return SnoodsProtocol.format_msg('<newtxt', (
+                    viob_id, p_x, p_y, text, rand.choice(COLORS),
+                    rand.choice(FONTS), 15, 'normal'))
+        else:
+            return self.new_stroke(viob_id, p_x, p_y)
+
+    def new_stroke(self, viob_id, p_x, p_y):
+        """
+        Return a message that creates a freehand drawing
+        starting at (p_x, p_y)
+        """
+
+        rand = self.rand
+        points = list()
+        for _ind in range(self.stroke_points):
+            p_x = max(0, p_x + rand.randint(-5, 5))
+            p_y = max(0, p_y + rand.randint(-5, 5))
+            points.append((p_x, p_y))
+
+        return SnoodsProtocol.format_msg('<newfre', (
+                viob_id, rand.choice(COLORS), rand.randint(1, 6), points))
+
+    def change(self, kind, viob_id):
+        """
+        Return a message of the given kind for the given object
+        (or, for a newfre, a new drawing)
+        """
+
+        if kind == 'newfre':
+            p_x, p_y = self.position()
+            return self.new_stroke(
+                    SnoodsProtocol.create_viob_id(), p_x, p_y)
+        elif kind == 'posupd':
+            p_x, p_y = self.position()
+            return SnoodsProtocol.format_msg(
+                    '<posupd', (viob_id, p_x, p_y, p_x + 50, p_y + 50))
+        elif kind == 'colupd':
+            return SnoodsProtocol.format_msg(
+                    '<colupd', (viob_id, self.rand.choice(COLORS)))
+        else:
+            return SnoodsProtocol.format_msg('<erase', (viob_id,))
+
+
+def load_board(drawable, msgs):
+    """
+    Load a board into the drawable, the way the client does when
+    it joins a board, and return the time it took until the
+    board was fully drawn
+    """
+
+    start = time.perf_counter()
+
+    for msg in msgs:
+        drawable.post_msg(msg)
+    while drawable.pending_ops:
+        drawable.drain_ops()
+    drawable.win.update()
+
+    return time.perf_counter() - start
+
+
+def time_changes(drawable, gen, kind, n_ops, in_view):
+    """
+    Apply n_ops messages of the given kind to random objects,
+    and return the average time per message
+    """
+
+    rand = gen.rand
+    objects = list(drawable.model.objects.keys())
+    visible = drawable.objects_in_view()
+
+    msgs = list()
+    for _ind in range(n_ops):
+        if visible and rand.random() < in_view:
+            viob_id = rand.choice(visible)
+        else:
+            viob_id = rand.choice(objects)
+
+        # Don't erase an object twice
+        #
+        if kind == 'erase':
+            if viob_id in visible:
+                visible.remove(viob_id)
+            if viob_id in objects:
+                objects.remove(viob_id)
+
+        msgs.append(SnoodsProtocol.parse_msg(gen.change(kind, viob_id)))
+
+    start = time.perf_counter()
+    for msg in msgs:
+        drawable.apply_msg(msg)
+        drawable.win.update_idletasks()
+
+    return (time.perf_counter() - start) / n_ops
+
+
+def run_size(args, n_objects):
+    """
+    Generate a board with n_objects objects, load it, time the
+    changes to it, and return a dictionary of the results
+    """
+
+    gen = BoardGen(
+            random.Random(args.seed), args.board_size, args.stroke_points)
+    msgs = [SnoodsProtocol.format_msg('<join', ('bench',))]
+    msgs += [gen.new_object() for _ind in range(n_objects)]
+    msgs = [SnoodsProtocol.parse_msg(msg) for msg in msgs]
+
+    drawable = SnoodsDrawableTk(
+            canvas_width=args.width, canvas_height=args.height)
+    drawable.zoom = args.zoom
+
+    try:
+        result = {'objects': n_objects}
+        result['load'] = load_board(drawable, msgs)
+        result['items'] = len(drawable.canvas.find_all())
+
+        for kind in KINDS:
+            result[kind] = time_changes(
+                    drawable, gen, kind, args.ops, args.in_view)
+    finally:
+        drawable.win.destroy()
+
+    return result
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(
+            description='Measure the time to load and update boards '
+            'of several sizes in the client')
+    parser.add_argument(
+            '-n', '--sizes', default='10000,30000,100000',
+            help='Comma-separated list of numbers of objects on '
+            'the board [default=%(default)s]')
+    parser.add_argument(
+            '--ops', default=200, type=int,
+            help='Number of messages of each kind to time '
+            '[default=%(default)d]')
+    parser.add_argument(
+            '--in_view', default=0.5, type=float,
+            help='Fraction of the updates that are for objects in '
+            'the window [default=%(default)g]')
+    parser.add_argument(
+            '--board_size', default=4000, type=int,
+            help='Width and height of the area that the objects are '
+            'scattered over [default=%(default)d]')
+    parser.add_argument(
+            '--stroke_points', default=30, type=int,
+            help='Number of points in each drawing [default=%(default)d]')
+    parser.add_argument(
+            '--zoom', default=1.0, type=float,
+            help='Zoom factor of the view [default=%(default)g]')
+    parser.add_argument(
+            '--width', default=SnoodsDrawableTk.DEFAULT_CANVAS_WIDTH,
+            type=int, help='Width of the window [default=%(default)d]')
+    parser.add_argument(
+            '--height', default=SnoodsDrawableTk.DEFAULT_CANVAS_HEIGHT,
+            type=int, help='Height of the window [default=%(default)d]')
+    parser.add_argument(
+            '--seed', default=0, type=int,
+            help='Seed for the random number generator '
+            '[default=%(default)d]')
+    parser.add_argument(
+            '-o', '--output', default=None,
+            help='Write the results as JSON to this file')
+    args = parser.parse_args(argv[1:])
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    xvfb = None
+    if not os.environ.get('DISPLAY'):
+        xvfb = start_xvfb()
+        if not xvfb:
+            print('No X display, and Xvfb is not available; '
+                  'skipping the rendering benchmark')
+            return 0
+
+    results = list()
+    try:
+        print('%8s %8s %8s %8s %10s %10s %10s %10s' % (
+                'objects', 'items', 'load s', 'load/obj',
+                'newfre ms', 'posupd ms', 'colupd ms', 'erase ms'))
+
+        for size in sizes:
+            try:
+                result = run_size(args, size)
+            except tk.TclError as exc:
+                print('ERROR: cannot use the display: %s' % str(exc))
+                return 1
+
+            results.append(result)
+            print('%8d %8d %8.2f %6.1fus %10.3f %10.3f %10.3f %10.3f' % (
+                    result['objects'], result['items'], result['load'],
+                    1e6 * result['load'] / max(size, 1),
+                    1000 * result['newfre'], 1000 * result['posupd'],
+                    1000 * result['colupd'], 1000 * result['erase']))
+            sys.stdout.flush()
+    finally:
+        if xvfb:
+            xvfb.kill()
+            xvfb.wait()
+
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump({'units': 'seconds', 'results': results},
+                      fout, indent=2, sort_keys=True)
+            fout.write('\n')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
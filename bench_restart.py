@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Benchmark for the time it takes the server to recreate its boards
+from a SnoodsBoardStore after a restart, as a function of the
+number of messages that have ever been sent to the board
+
+For each board size, a board is built by sending a fixed number of
+objects and then a stream of position and color updates (with
+occasional erasures and new objects), and then the time to load the
+board from the store is measured twice: once with periodic snapshots
+and once with a log that is never compacted.
+"""
+
+import argparse
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from board_state import SnoodsBoardState
+from store import SnoodsBoardStore
+
+
+def make_board(dirname, n_msgs, n_objects, snapshot_interval, batch=100):
+    """
+    Write a board with n_msgs total messages into a store in dirname
+    """
+
+    store = SnoodsBoardStore(
+            dirname, fsync_interval=0.5,
+            snapshot_interval=snapshot_interval)
+
+    # The server keeps the state of the board in memory as well;
+    # the store needs it in order to write the snapshots
+    #
+    state = SnoodsBoardState()
+    boards = {'bench': state}
+
+    rand = random.Random(n_msgs)
+    live = list()
+    next_id = 0
+    msgs = list()
+
+    for ind in range(n_msgs):
+        if len(live) < n_objects or rand.random() < 0.001:
+            viob_id = 'obj-%d' % next_id
+            next_id += 1
+            live.append(viob_id)
+            msg = '<newrec/%s/%d/%d/%d/%d/red' % (
+                    viob_id, ind % 1000, ind % 700,
+                    ind % 1000 + 50, ind % 700 + 50)
+        else:
+            viob_id = rand.choice(live)
+            choice = rand.random()
+            if choice < 0.002:
+                live.remove(viob_id)
+                msg = '<erase/%s' % viob_id
+            elif choice < 0.1:
+                msg = '<colupd/%s/blue' % viob_id
+            else:
+                pos = rand.randrange(1000)
+                msg = '<posupd/%s/%d/%d/%d/%d' % (
+                        viob_id, pos, pos, pos + 50, pos + 50)
+
+        msgs.append(msg.encode('utf-8'))
+        if len(msgs) == batch:
+            state.extend(msgs)
+            store.append('bench', msgs)
+            store.sync(boards)
+            msgs = list()
+
+    state.extend(msgs)
+    store.append('bench', msgs)
+    store.sync(boards, force=True)
+    store.close()
+
+    return state.num_objects()
+
+
+def time_restart(dirname):
+    """
+    Return the time to load all the boards in dirname, and
+    the number of live objects found
+    """
+
+    start = time.perf_counter()
+    boards = SnoodsBoardStore(dirname).load()
+    elapsed = time.perf_counter() - start
+
+    return elapsed, boards['bench'].num_objects()
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(
+            description='Measure server restart time against board size')
+    parser.add_argument(
+            '-s', '--sizes', default='10000,100000,1000000',
+            help='Comma-separated list of board sizes, in messages '
+            '[default=%(default)s]')
+    parser.add_argument(
+            '-o', '--objects', default=1000, type=int,
+            help='Number of live objects on the board [default=%(default)d]')
+    parser.add_argument(
+            '-i', '--snapshot_interval', default=10000, type=int,
+            help='Messages between snapshots [default=%(default)d]')
+    args = parser.parse_args(argv[1:])
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    print('%10s %8s %14s %14s' % (
+            'messages', 'objects', 'snapshot (ms)', 'log only (ms)'))
+
+    for size in sizes:
+        times = list()
+        for interval in (args.snapshot_interval, size + 1):
+            dirname = tempfile.mkdtemp(prefix='snoods-bench-')
+            try:
+                n_objects = make_board(dirname, size, args.objects, interval)
+                elapsed, n_loaded = time_restart(dirname)
+                if n_loaded != n_objects:
+                    print('ERROR: loaded %d objects, expected %d' % (
+                            n_loaded, n_objects))
+                    return 1
+                times.append(elapsed)
+            finally:
+                shutil.rmtree(dirname)
+
+        print('%10d %8d %14.1f %14.1f' % (
+                size, n_objects, times[0] * 1000, times[1] * 1000))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Benchmark for the throughput of the server with several workers
+
+The benchmark connects a number of receivers to each of several
+boards, and a sender to each board, and then the senders send a
+stream of position updates to their boards as fast as the server
+will accept them.  The benchmark measures how long it takes until
+every receiver has received every message sent to its board, and
+reports the aggregate rate at which messages were delivered, for
+each number of worker processes.
+
+The boards are split between the workers by hashing their names,
+so with a small number of boards the split may be uneven.  Note
+that the benchmark clients run in a single process, so on a machine
+with few CPUs the clients themselves may be the bottleneck.
+"""
+
+import argparse
+import os
+import selectors
+import sys
+import time
+
+from bench_relay import wait_for_joins
+from bench_util import connect
+from bench_util import raise_fd_limit
+from bench_util import spawn_server
+from bench_util import stop_server
+
+
+def bench(port, n_boards, n_clients, n_msgs, batch):
+    """
+    Send n_msgs messages to each of n_boards boards, each
+    with n_clients receivers, and return the elapsed time
+    until all of the messages were received by all of the
+    receivers
+    """
+
+    board_ids = ['shard-%d' % ind for ind in range(n_boards)]
+
+    sel = selectors.DefaultSelector()
+    remaining = dict()
+    senders = list()
+
+    for board_id in board_ids:
+        receivers = [connect(port, board_id) for _ind in range(n_clients)]
+        sender = connect(port, board_id)
+        wait_for_joins(receivers + [sender], board_id)
+
+        for sock in receivers:
+            sock.setblocking(False)
+            sel.register(sock, selectors.EVENT_READ)
+            remaining[sock] = n_msgs
+
+        sender.setblocking(False)
+        senders.append([sender, 0, b''])
+
+    msgs = [b'<posupd/obj-%d/%d/0/10/10\n' % (ind % 100, ind)
+            for ind in range(n_msgs)]
+
+    start = time.perf_counter()
+
+    while remaining:
+        busy = False
+        for state in senders:
+            sender, sent, pending = state
+            if sent < n_msgs and not pending:
+                pending = b''.join(msgs[sent:sent + batch])
+                sent += batch
+
+            if pending:
+                busy = True
+                try:
+                    n_sent = sender.send(pending)
+                    pending = pending[n_sent:]
+                except BlockingIOError as _exc:
+                    pass
+
+                # drain the sender's own echoes, so that it
+                # doesn't fall behind and get resynced
+                #
+                try:
+                    while sender.recv(1 << 20):
+                        pass
+                except BlockingIOError as _exc:
+                    pass
+
+            state[1:] = [sent, pending]
+
+        for key, _mask in sel.select(0 if busy else 0.1):
+            sock = key.fileobj
+            data = sock.recv(1 << 20)
+            remaining[sock] -= data.count(b'\n')
+            if remaining[sock] <= 0:
+                sel.unregister(sock)
+                del remaining[sock]
+
+    elapsed = time.perf_counter() - start
+
+    for key in list(sel.get_map().values()):
+        key.fileobj.close()
+    for sender, _sent, _pending in senders:
+        sender.close()
+
+    return elapsed
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(
+            description='Measure aggregate throughput against workers')
+    parser.add_argument(
+            '-w', '--workers', default='1,2,4',
+            help='Comma-separated list of numbers of workers '
+            '[default=%(default)s]')
+    parser.add_argument(
+            '-B', '--boards', default=16, type=int,
+            help='Number of boards [default=%(default)d]')
+    parser.add_argument(
+            '-c', '--clients', default=20, type=int,
+            help='Number of receivers per board [default=%(default)d]')
+    parser.add_argument(
+            '-n', '--msgs', default=5000, type=int,
+            help='Number of messages to send to each board '
+            '[default=%(default)d]')
+    parser.add_argument(
+            '-b', '--batch', default=20, type=int,
+            help='Number of messages per send [default=%(default)d]')
+    args = parser.parse_args(argv[1:])
+
+    counts = [int(count) for count in args.workers.split(',')]
+    raise_fd_limit()
+
+    print('CPUs: %d' % os.cpu_count())
+    print('%8s %10s %14s %16s' % (
+            'workers', 'time (s)', 'accepted/sec', 'delivered/sec'))
+
+    for count in counts:
+        proc, port = spawn_server(
+                '--high_water', str(1 << 30), '--workers', str(count))
+        elapsed = bench(
+                port, args.boards, args.clients, args.msgs, args.batch)
+        stop_server(proc)
+
+        total = args.msgs * args.boards
+        print('%8d %10.2f %14.0f %16.0f' % (
+                count, elapsed, total / elapsed,
+                total * args.clients / elapsed))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Benchmark for the spatial index used by the client for hit-testing
+and region queries
+
+Scatters objects (mostly small rectangles and text, plus some larger
+freehand drawings) over a board, and reports the time to build the
+index, to pick the object at a point, to find the objects in a
+selection rectangle and in the window, and to move and erase objects,
+compared to scanning every bounding box (which is what the canvas
+does for find_closest and find_overlapping).  If there is a display,
+the canvas queries themselves are timed as well.
+"""
+
+import argparse
+import random
+import sys
+import timeit
+
+from spatial import SnoodsSpatialGrid
+
+
+def make_bboxes(n_objs, width, height, rand):
+    """
+    Return a dict mapping a name for each of n_objs objects
+    to a bounding box, scattered over a board of the given size
+    """
+
+    bboxes = dict()
+    for ind in range(n_objs):
+        if rand.random() < 0.1:
+            # a freehand drawing
+            obj_w = rand.uniform(50, 400)
+            obj_h = rand.uniform(50, 300)
+        else:
+            # a rectangle or a line of text
+            obj_w = rand.uniform(10, 150)
+            obj_h = rand.uniform(10, 60)
+
+        x0 = rand.uniform(0, width - obj_w)
+        y0 = rand.uniform(0, height - obj_h)
+        bboxes['obj-%d' % ind] = (x0, y0, x0 + obj_w, y0 + obj_h)
+
+    return bboxes
+
+
+def scan_point(bboxes, x_pos, y_pos):
+    """ Baseline: the topmost bbox containing the point """
+
+    found = None
+    for key, (x0, y0, x1, y1) in bboxes.items():
+        if x0 <= x_pos <= x1 and y0 <= y_pos <= y1:
+            found = key
+    return found
+
+
+def scan_rect(bboxes, qx0, qy0, qx1, qy1):
+    """ Baseline: every bbox that overlaps the rectangle """
+
+    return [key for key, (x0, y0, x1, y1) in bboxes.items()
+            if x0 <= qx1 and qx0 <= x1 and y0 <= qy1 and qy0 <= y1]
+
+
+def time_per_op(func, args_list):
+    """
+    Return the mean time (in microseconds) to call func
+    with each of the tuples in args_list
+    """
+
+    def run():
+        for args in args_list:
+            func(*args)
+
+    return 1e6 * timeit.timeit(run, number=1) / len(args_list)
+
+
+def bench_canvas(bboxes, points, rects):
+    """
+    Return the mean times (in microseconds) for the canvas to
+    find_closest and find_overlapping, or None if there's no display
+    """
+
+    try:
+        import tkinter as tk
+        win = tk.Tk()
+    except Exception as _exc:
+        return None
+
+    canvas = tk.Canvas(win)
+    for x0, y0, x1, y1 in bboxes.values():
+        canvas.create_rectangle(x0, y0, x1, y1, tags=('moveable',))
+
+    times = (time_per_op(canvas.find_closest, points),
+             time_per_op(canvas.find_overlapping, rects))
+    win.destroy()
+    return times
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(
+            description='Measure the spatial index for the client')
+    parser.add_argument(
+            '-n', '--n_objs', default='10000,100000',
+            help='Comma-separated list of the numbers of objects '
+            '[default=%(default)s]')
+    parser.add_argument(
+            '-q', '--queries', default=2000, type=int,
+            help='Number of each kind of query [default=%(default)d]')
+    parser.add_argument(
+            '-c', '--cell_size', default=SnoodsSpatialGrid.DEFAULT_CELL_SIZE,
+            type=int, help='Size of the grid cells [default=%(default)d]')
+    parser.add_argument(
+            '--no_canvas', default=False, action='store_true',
+            help='Do not time the canvas, even if there is a display')
+    args = parser.parse_args(argv[1:])
+
+    for n_objs in [int(n) for n in args.n_objs.split(',')]:
+        rand = random.Random(0)
+
+        # Scale the board with the number of objects, so that
+        # the density stays roughly the same
+        #
+        scale = (n_objs / 10000.0) ** 0.5
+        width, height = int(6000 * scale), int(4500 * scale)
+        bboxes = make_bboxes(n_objs, width, height, rand)
+
+        grid = SnoodsSpatialGrid(args.cell_size)
+
+        def build():
+            grid.clear()
+            for key, bbox in bboxes.items():
+                grid.set(key, bbox)
+
+        build_time = timeit.timeit(build, number=1)
+
+        points = [(rand.uniform(0, width), rand.uniform(0, height))
+                  for _ in range(args.queries)]
+        selections = list()
+        views = list()
+        for _ in range(args.queries):
+            x0, y0 = rand.uniform(0, width), rand.uniform(0, height)
+            selections.append((x0, y0, x0 + 300, y0 + 200))
+            views.append((x0, y0, x0 + 1200, y0 + 900))
+
+        n_scans = max(1, args.queries // 20)
+
+        print('%d objects on a %dx%d board: build %.1fms, %d cells' % (
+                n_objs, width, height, 1000 * build_time, len(grid.cells)))
+        print('    %-22s %10s %10s' % ('', 'grid (us)', 'scan (us)'))
+
+        for name, grid_func, scan_func, args_list in [
+                ('pick at a point',
+                    lambda x, y: grid.query_point(x, y, 2),
+                    lambda x, y: scan_point(bboxes, x, y),
+                    points),
+                ('select 300x200',
+                    grid.query_rect,
+                    lambda *rect: scan_rect(bboxes, *rect),
+                    selections),
+                ('window 1200x900',
+                    grid.query_rect,
+                    lambda *rect: scan_rect(bboxes, *rect),
+                    views)]:
+            print('    %-22s %10.1f %10.1f' % (
+                    name, time_per_op(grid_func, args_list),
+                    time_per_op(scan_func, args_list[:n_scans])))
+
+        # Move a sample of the objects by a small amount (the common
+        # case, when dragging), and then erase them
+        #
+        keys = rand.sample(list(bboxes), min(args.queries, n_objs))
+        moves = list()
+        for key in keys:
+            x0, y0, x1, y1 = bboxes[key]
+            d_x, d_y = rand.uniform(-40, 40), rand.uniform(-40, 40)
+            moves.append((key, (x0 + d_x, y0 + d_y, x1 + d_x, y1 + d_y)))
+
+        print('    %-22s %10.1f' % ('move', time_per_op(grid.set, moves)))
+        print('    %-22s %10.1f' % (
+                'erase', time_per_op(grid.remove, [(key,) for key in keys])))
+
+        if not args.no_canvas:
+            canvas_times = bench_canvas(bboxes, points, selections)
+            if canvas_times:
+                print('    canvas: find_closest %.1fus, '
+                      'find_overlapping 300x200 %.1fus' % canvas_times)
+            else:
+                print('    canvas: no display')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Benchmark for the encoding and simplification of freehand strokes
+
+Synthesizes strokes that resemble what the client records from the
+mouse (one point per motion event, at integer pixel positions, with
+some hand jitter) and reports, for each kind of stroke, the size of
+the points in the original hexadecimal form, in the compact form,
+and in the compact form after simplification at each tolerance,
+along with the time to decode each form.
+"""
+
+import argparse
+import math
+import random
+import sys
+import timeit
+
+from codec import format_text
+from stroke import decode_points
+from stroke import encode_points
+from stroke import simplify_points
+
+
+def legacy_encode_points(points):
+    return ' '.join(['%x,%x' % (p_x, p_y) for p_x, p_y in points])
+
+
+def sample(path, n_points, jitter, rand):
+    """
+    Sample the path (a function from [0, 1] to (x, y)) at n_points
+    points, rounded to the nearest pixel with some jitter, and drop
+    repeated points (there are no motion events without motion)
+    """
+
+    points = list()
+    for ind in range(n_points):
+        p_x, p_y = path(ind / (n_points - 1))
+        point = (int(round(p_x + rand.uniform(-jitter, jitter))),
+                 int(round(p_y + rand.uniform(-jitter, jitter))))
+        if not points or points[-1] != point:
+            points.append(point)
+
+    return points
+
+
+def make_strokes(rand):
+    """
+    Return a list of (name, points) of synthesized strokes
+    """
+
+    def line(frac):
+        return 100 + 600 * frac, 200 + 150 * frac
+
+    def circle(frac):
+        angle = 2 * math.pi * frac
+        return 400 + 120 * math.cos(angle), 300 + 120 * math.sin(angle)
+
+    def cursive(frac):
+        # a row of loops, like handwriting
+        angle = 2 * math.pi * 12 * frac
+        return (100 + 700 * frac + 25 * math.cos(angle),
+                300 + 30 * math.sin(angle))
+
+    def scribble(frac):
+        return (400 + 250 * math.sin(7 * frac) * math.cos(3 * frac),
+                300 + 200 * math.sin(11 * frac))
+
+    return [
+            ('line', sample(line, 300, 0.6, rand)),
+            ('circle', sample(circle, 400, 0.6, rand)),
+            ('cursive', sample(cursive, 2000, 0.6, rand)),
+            ('scribble', sample(scribble, 5000, 0.6, rand))]
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(
+            description='Measure the sizes of encoded strokes')
+    parser.add_argument(
+            '-t', '--tolerances', default='0.5,1,2',
+            help='Comma-separated list of simplification tolerances '
+            '[default=%(default)s]')
+    parser.add_argument(
+            '-n', '--iters', default=200, type=int,
+            help='Number of iterations of each timing '
+            '[default=%(default)d]')
+    args = parser.parse_args(argv[1:])
+
+    tolerances = [float(tol) for tol in args.tolerances.split(',')]
+    rand = random.Random(0)
+
+    for name, points in make_strokes(rand):
+        legacy = legacy_encode_points(points)
+        compact = encode_points(points)
+
+        print('%s: %d points' % (name, len(points)))
+        print('    %-16s %7d bytes' % ('hex', len(legacy)))
+        print('    %-16s %7d bytes  %5.1fx' % (
+                'compact', len(compact), len(legacy) / len(compact)))
+
+        for tolerance in tolerances:
+            simple = simplify_points(points, tolerance)
+            simple_str = encode_points(simple)
+            print('    %-16s %7d bytes  %5.1fx  (%d points)' % (
+                    'compact, tol %g' % tolerance, len(simple_str),
+                    len(legacy) / len(simple_str), len(simple)))
+
+        msg = format_text('<newfre', ('viob', 'black', 2, points))
+        scale = 1e6 / args.iters
+        print('    decode: hex %.0fus, compact %.0fus; '
+              'simplify at tol 1: %.0fus; whole message: %d bytes' % (
+                timeit.timeit(
+                    lambda: decode_points(legacy), number=args.iters) * scale,
+                timeit.timeit(
+                    lambda: decode_points(compact),
+                    number=args.iters) * scale,
+                timeit.timeit(
+                    lambda: simplify_points(points, 1.0),
+                    number=args.iters) * scale,
+                len(msg)))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,141 @@
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Utilities shared by the Snoods benchmarks
+"""
+
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+from server import SnoodsServer
+
+
+def start_server(**kwargs):
+    """
+    Start a SnoodsServer in a daemon thread, listening on an
+    ephemeral port on localhost, and return the server and
+    the port number
+
+    Any keyword arguments are passed to the SnoodsServer
+    """
+
+    server = SnoodsServer(('127.0.0.1', 0), **kwargs)
+    server.daemon = True
+    server.start()
+
+    return server, server.listener.getsockname()[1]
+
+
+def spawn_server(*args):
+    """
+    Run the snoods server in a separate process, listening on
+    a free port on localhost, and return the process and the
+    port number once the server is accepting connections
+
+    Any args are passed to the server on its commandline.
+    Running the server in its own process keeps the benchmark
+    clients from competing with the server for the GIL.
+    """
+
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+
+    snoods = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snoods')
+    proc = subprocess.Popen(
+            [sys.executable, snoods, '-S', '-p', str(port)] + list(args))
+
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return proc, port
+        except ConnectionRefusedError as _exc:
+            time.sleep(0.05)
+
+    proc.kill()
+    raise RuntimeError('server did not start')
+
+
+def stop_server(proc):
+    """
+    Stop a server started by spawn_server, and return the
+    resource usage of the server process
+    """
+
+    proc.kill()
+    _pid, _status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = -9
+
+    return rusage
+
+
+def connect(port, board_id=None):
+    """
+    Connect to the server on the given port, and join the
+    given board (if any), returning the new socket
+    """
+
+    sock = socket.create_connection(('127.0.0.1', port))
+    if board_id is not None:
+        sock.sendall(b'<join/%s\n' % board_id.encode('utf-8'))
+
+    return sock
+
+
+def raise_fd_limit():
+    """
+    Raise the soft limit on the number of open files as high
+    as it can go, and return the new limit
+    """
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY:
+        hard = 1 << 20
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def percentile(values, pct):
+    """
+    Return the pct'th percentile of a sorted list of values
+    """
+
+    if not values:
+        return 0
+
+    ind = int(round((len(values) - 1) * pct / 100.0))
+    return values[ind]
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Microbenchmark for the text and binary protocols
+
+For each type of message, reports the size of the message on the
+wire, and the time to encode it (from the field values, as the
+client does when it pushes a change) and decode it (into the
+dictionary passed to the drawable), in each protocol.
+
+Note that decoding a text <newfre leaves the points as a string,
+which the drawable parses later, while decoding a binary <newfre
+creates the list of points.
+"""
+
+import argparse
+import sys
+import timeit
+import uuid
+
+from protocol import SnoodsBinaryCodec
+from protocol import SnoodsProtocol
+
+
+def sample_cmds():
+    """
+    Return a list of (cmd, values) for a typical message
+    of each type
+    """
+
+    viob_id = str(uuid.uuid4())
+    stroke = [(200 + ind, 300 + (ind * 7) % 13) for ind in range(100)]
+
+    return [
+            ('<colupd', (viob_id, 'red')),
+            ('<posupd', (viob_id, 120, 340, 220, 380)),
+            ('<newrec', (viob_id, 120, 340, 220, 380, 'blue')),
+            ('<newtxt', (viob_id, 120, 340, 'Hello, world',
+                         'black', 'Helvetica', 15, 'normal')),
+            ('<newfre', (viob_id, 'black', 4, stroke)),
+            ('<erase', (viob_id,)),
+            ('<join', ('default',))
+            ]
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(
+            description='Compare the text and binary protocols')
+    parser.add_argument(
+            '-n', '--iters', default=20000, type=int,
+            help='Number of iterations of each timing '
+            '[default=%(default)d]')
+    args = parser.parse_args(argv[1:])
+
+    recsep_len = len(SnoodsProtocol.recsep)
+    framer = SnoodsBinaryCodec.framer
+
+    print('%8s %7s %7s %10s %10s %10s %10s' % (
+            'msg', 'text B', 'bin B', 'text enc', 'bin enc',
+            'text dec', 'bin dec'))
+
+    for cmd, values in sample_cmds():
+        text_msg = SnoodsProtocol.format_msg(cmd, values)
+        binary_msg = SnoodsBinaryCodec.encode(cmd, values)
+
+        text_len = len(text_msg) + recsep_len
+        binary_len = len(framer.frame([binary_msg]))
+
+        # the times are in microseconds per message
+        #
+        scale = 1e6 / args.iters
+        times = [
+                timeit.timeit(
+                    lambda: SnoodsProtocol.format_msg(cmd, values),
+                    number=args.iters) * scale,
+                timeit.timeit(
+                    lambda: SnoodsBinaryCodec.encode(cmd, values),
+                    number=args.iters) * scale,
+                timeit.timeit(
+                    lambda: SnoodsProtocol.parse_msg(text_msg),
+                    number=args.iters) * scale,
+                timeit.timeit(
+                    lambda: SnoodsBinaryCodec.decode_msg(binary_msg),
+                    number=args.iters) * scale]
+
+        print('%8s %7d %7d %8.2fus %8.2fus %8.2fus %8.2fus' % tuple(
+                [cmd, text_len, binary_len] + times))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
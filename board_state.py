@@ -0,0 +1,618 @@
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Materialized per-board state for the Snoods server
+
+Instead of keeping every message that has ever been sent to a
+board, the server keeps only what a new client needs in order
+to reconstruct the board: for each live object, the message
+that created it, plus the most recent color update and position
+update for that object.  Erased objects are dropped entirely.
+
+This means that the cost (in memory, and in the time it takes
+to catch up a new client) scales with the number of objects on
+the board, not with the number of edits ever made to the board.
+
+A freehand drawing that is still being drawn is sent as a <begfre,
+followed by any number of <addfre messages with more points, and
+then an <endfre.  Until the <endfre arrives, the state keeps all of
+these messages (so that a new client sees the drawing so far, and
+can extend it as the rest arrives), and then replaces them with a
+single <newfre for the whole drawing.
+
+The state also keeps a cached, pre-framed copy of the messages
+needed to catch up a new client, so that catching up a client
+(or hundreds of clients, when a class starts) doesn't require
+walking through the objects and framing each message again.
+The cached copy is a list of chunks: the board as it was when
+the copy was rebuilt from the objects, followed by the batches
+of messages that have arrived since then.  The chunks are queued
+for each new client as they are, so the board is never copied
+in order to add new messages to the end of it, and the copy is
+only rebuilt from the objects when the batches appended to it add
+up to more than the size of the rebuilt board.
+
+Once a client of the binary protocol has joined the board, the
+state keeps a binary copy of the catch-up buffer too, which is
+extended in the same way: only the batches that arrive after it
+was made are translated (or, if the batches were relayed to
+binary clients, the relayed binary batches are used as they are).
+
+Legacy clients (which never sent a <hello) don't understand the
+compact form of freehand strokes, or the messages for streaming
+strokes while they are drawn, so the state also translates the
+messages for them (see extend_legacy) and, once a legacy client has
+joined the board, keeps a translated copy of the catch-up buffer.
+"""
+
+from protocol import SnoodsBinaryCodec
+from protocol import SnoodsProtocol
+from stroke import COMPACT_PREFIX
+from stroke import decode_points
+from stroke import encode_hex_points
+from stroke import encode_points
+
+
+class SnoodsBoardState(object):
+    """
+    The live objects on a board, in the form of the messages
+    needed to recreate them
+
+    This behaves like the list of messages it replaces: new
+    messages are added with append() or extend(), and iterating
+    over the state yields the messages to send to a new client,
+    in the order they should be sent.
+    """
+
+    CREATE_CMDS = frozenset([b'<newrec', b'<newtxt', b'<newfre'])
+
+    # The index, within each object entry, of the latest message
+    # of each kind of update
+    #
+    UPDATE_CMDS = {
+            b'<colupd': 1,
+            b'<posupd': 2
+            }
+
+    ERASE_CMD = b'<erase'
+
+    # The messages for a freehand drawing that is sent while it
+    # is being drawn
+    #
+    BEGIN_STROKE_CMD = b'<begfre'
+    ADD_STROKE_CMD = b'<addfre'
+    END_STROKE_CMD = b'<endfre'
+
+    # The catch-up buffer is not rebuilt until the messages
+    # appended to it add up to at least this many bytes,
+    # even if the board itself is smaller than this
+    #
+    MIN_COMPACT_BYTES = 64 * 1024
+
+    # When there are more than this many chunks in the catch-up
+    # buffer, the chunks after the first are joined into one, so
+    # that a new client isn't sent a long list of small chunks
+    #
+    MAX_CATCHUP_CHUNKS = 32
+
+    def __init__(self):
+
+        # Map from each viob_id to a list of the form
+        # [create_msg, colupd_msg, posupd_msg], where the
+        # update messages are None until there is an update.
+        #
+        # Dictionaries preserve insertion order, and the
+        # creation order is also the stacking order of the
+        # objects, so this is also the order in which the
+        # objects must be recreated.
+        #
+        self.objects = dict()
+
+        # Map from the viob_id of each freehand drawing that has
+        # begun but not ended to the list of its <addfre messages.
+        # (The <begfre is the create message in self.objects.)
+        #
+        self.strokes = dict()
+
+        # The cached catch-up buffer, as a list of chunks of the
+        # form (framed_msgs, n_msgs), where the first chunk is the
+        # board as it was when the buffer was last rebuilt from
+        # the objects, or None if the buffer needs to be rebuilt
+        #
+        self.catchup_chunks = None
+
+        # The batches of framed messages that have arrived since
+        # the catch-up buffer was last extended, and the total
+        # number of bytes that have been added to the buffer since
+        # it was last rebuilt from the objects
+        #
+        self.tail = list()
+        self.tail_msgs = 0
+        self.tail_bytes = 0
+
+        # The catch-up buffer in the binary protocol, or None if
+        # it hasn't been needed since the text buffer was rebuilt.
+        # The binary_tail is a list of the batches that have
+        # arrived since it was last extended, each as a tuple
+        # (text_batch, n_msgs, binary_batch), where the binary_batch
+        # is None if it wasn't relayed in binary.
+        #
+        self.binary_chunks = None
+        self.binary_tail = list()
+
+        # The catch-up buffer for legacy clients, or None if it
+        # hasn't been needed since the text buffer was rebuilt,
+        # and the framed batches (translated for legacy clients)
+        # that have arrived since it was last extended, each as
+        # a tuple (legacy_batch, n_msgs)
+        #
+        self.legacy_chunks = None
+        self.legacy_tail = list()
+
+    @staticmethod
+    def msg_key(msg):
+        """
+        Return the command and the viob_id of a message,
+        as byte strings, without parsing the rest of it
+
+        The viob_id is None for messages that don't have one
+        """
+
+        fields = msg.split(b'/', 2)
+        if len(fields) < 2:
+            return fields[0], None
+        else:
+            return fields[0], fields[1]
+
+    @staticmethod
+    def coalesce_msgs(msgs):
+        """
+        Return a copy of the list msgs with every color update
+        and position update removed if it is followed, later in
+        the list, by another update of the same kind to the same
+        object
+
+        The remaining messages keep their original order.
+        Updates are never combined across a create or erase
+        of the same object, so an update is never moved from
+        one side of a create or erase to the other.
+        """
+
+        # Walk backwards through the messages, so that the
+        # first update of each kind seen for each object is
+        # the one to keep
+        #
+        kept = list()
+        seen = set()
+
+        for msg in reversed(msgs):
+            cmd, viob_id = SnoodsBoardState.msg_key(msg)
+
+            if cmd in SnoodsBoardState.UPDATE_CMDS:
+                if (cmd, viob_id) in seen:
+                    continue
+                seen.add((cmd, viob_id))
+
+            elif viob_id is not None:
+                for update_cmd in SnoodsBoardState.UPDATE_CMDS:
+                    seen.discard((update_cmd, viob_id))
+
+            kept.append(msg)
+
+        kept.reverse()
+        return kept
+
+    def append(self, msg):
+        """
+        Update the state of the board with a single message
+        """
+
+        self.extend([msg])
+
+    def append_msg(self, msg):
+        """
+        Update the objects on the board with a single message,
+        without updating the catch-up buffer
+
+        Messages that don't create, update, or erase an object
+        are not part of the state of the board, and are dropped
+        """
+
+        cmd, viob_id = SnoodsBoardState.msg_key(msg)
+        if viob_id is None:
+            return
+
+        if cmd in SnoodsBoardState.CREATE_CMDS:
+            # If the object already exists, then the clients
+            # will ignore the new create, so we do too
+            #
+            if viob_id not in self.objects:
+                self.objects[viob_id] = [msg, None, None]
+
+        elif cmd in SnoodsBoardState.UPDATE_CMDS:
+            # Clients ignore updates to objects they don't
+            # know about, so there's no need to keep them
+            #
+            entry = self.objects.get(viob_id)
+            if entry:
+                entry[SnoodsBoardState.UPDATE_CMDS[cmd]] = msg
+
+        elif cmd == SnoodsBoardState.ERASE_CMD:
+            self.objects.pop(viob_id, None)
+            self.strokes.pop(viob_id, None)
+
+        elif cmd == SnoodsBoardState.BEGIN_STROKE_CMD:
+            if viob_id not in self.objects:
+                self.objects[viob_id] = [msg, None, None]
+                self.strokes[viob_id] = list()
+
+        elif cmd == SnoodsBoardState.ADD_STROKE_CMD:
+            stroke = self.strokes.get(viob_id)
+            if stroke is not None:
+                stroke.append(msg)
+
+        elif cmd == SnoodsBoardState.END_STROKE_CMD:
+            stroke = self.strokes.pop(viob_id, None)
+            if stroke is not None:
+                entry = self.objects[viob_id]
+                entry[0] = SnoodsBoardState.merge_stroke(entry[0], stroke)
+
+    @staticmethod
+    def merge_stroke(begin_msg, add_msgs):
+        """
+        Return a <newfre message for the freehand drawing that
+        consists of begin_msg (a <begfre) followed by add_msgs
+        (a list of <addfre)
+
+        If any of the messages are malformed, the points in
+        that message are omitted.
+        """
+
+        fields = begin_msg.split(b'/')
+        if len(fields) != 5:
+            return begin_msg
+
+        point_strs = [fields[4]]
+        point_strs += [msg.split(b'/')[-1] for msg in add_msgs]
+
+        points = list()
+        for point_str in point_strs:
+            try:
+                points += decode_points(point_str.decode('utf-8'))
+            except (ValueError, UnicodeDecodeError) as _exc:
+                pass
+
+        fields[0] = b'<newfre'
+        fields[4] = encode_points(points).encode('utf-8')
+        return b'/'.join(fields)
+
+    def extend(self, msgs, batch=None, binary_batch=None, legacy=False):
+        """
+        Update the state of the board with a list of messages
+
+        If batch is provided, it must be the messages in msgs,
+        framed and joined into one buffer (as they are relayed
+        to clients), and it will be appended to the catch-up
+        buffer without making a copy.  Likewise, binary_batch
+        may be the same messages framed for the binary protocol.
+
+        If legacy is True (because there are legacy clients to
+        relay the messages to), returns the messages translated
+        and framed for legacy clients, and the number of messages
+        in the translation, as a tuple; otherwise returns None.
+        """
+
+        legacy_batch = None
+        if legacy or self.legacy_chunks is not None:
+            legacy_batch = self.extend_legacy(msgs)
+        else:
+            for msg in msgs:
+                self.append_msg(msg)
+
+        if self.catchup_chunks is None or not msgs:
+            return legacy_batch
+
+        if batch is None:
+            batch = (SnoodsProtocol.recsep.join(msgs) +
+                     SnoodsProtocol.recsep)
+
+        self.tail.append(batch)
+        self.tail_msgs += len(msgs)
+        self.tail_bytes += len(batch)
+
+        if self.binary_chunks is not None:
+            self.binary_tail.append((batch, len(msgs), binary_batch))
+
+        if self.legacy_chunks is not None:
+            self.legacy_tail.append(legacy_batch)
+
+        # If replaying everything that has been appended would
+        # cost more than sending the board from scratch, then
+        # throw away the buffers; they will be rebuilt the next
+        # time they are needed
+        #
+        if self.tail_bytes > max(
+                len(self.catchup_chunks[0][0]), self.MIN_COMPACT_BYTES):
+            self.catchup_chunks = None
+            self.tail = list()
+            self.binary_chunks = None
+            self.binary_tail = list()
+            self.legacy_chunks = None
+            self.legacy_tail = list()
+
+        return legacy_batch
+
+    def extend_legacy(self, msgs):
+        """
+        Update the objects on the board with a list of messages,
+        and return the messages translated for legacy clients,
+        framed and joined into one buffer, and the number of
+        messages in the buffer
+
+        Legacy clients can't draw a freehand drawing while it is
+        streamed, so the <begfre and <addfre messages are dropped,
+        and the <endfre is replaced with the <newfre for the whole
+        drawing (followed by the latest updates to the drawing,
+        because the legacy clients ignored the updates that arrived
+        before it).  Each message is translated as it is applied,
+        because the translation depends on the objects: a create
+        for an object that already exists is dropped, because the
+        object may be a drawing that legacy clients can't see yet.
+        """
+
+        objects = self.objects
+        strokes = self.strokes
+        translated = list()
+
+        for msg in msgs:
+            cmd, viob_id = SnoodsBoardState.msg_key(msg)
+            if viob_id is None:
+                translated.append(msg)
+                continue
+
+            is_new = viob_id not in objects
+            was_open = viob_id in strokes
+
+            self.append_msg(msg)
+
+            if cmd in SnoodsBoardState.CREATE_CMDS:
+                if is_new:
+                    translated += self.legacy_entry(objects[viob_id])
+
+            elif cmd == SnoodsBoardState.END_STROKE_CMD:
+                if was_open:
+                    translated += self.legacy_entry(objects[viob_id])
+
+            elif (cmd != SnoodsBoardState.BEGIN_STROKE_CMD and
+                    cmd != SnoodsBoardState.ADD_STROKE_CMD):
+                translated.append(msg)
+
+        return SnoodsBoardState.frame_msgs(translated)
+
+    @staticmethod
+    def legacy_entry(entry):
+        """
+        Return the list of messages that recreate the object with
+        the given entry (from self.objects) on a legacy client
+        """
+
+        create_msg = entry[0]
+        if create_msg.startswith(b'<newfre/'):
+            create_msg = SnoodsBoardState.legacy_stroke(create_msg)
+            if not create_msg:
+                return list()
+
+        return [create_msg] + [update for update in entry[1:] if update]
+
+    @staticmethod
+    def frame_msgs(msgs):
+        """
+        Return the msgs framed and joined into one buffer, and
+        the number of messages in the buffer
+        """
+
+        if not msgs:
+            return b'', 0
+
+        batch = SnoodsProtocol.recsep.join(msgs) + SnoodsProtocol.recsep
+        return batch, len(msgs)
+
+    @staticmethod
+    def legacy_stroke(msg):
+        """
+        Return the <newfre msg with its points in the original
+        form, or None if the points can't be decoded
+        """
+
+        fields = msg.split(b'/')
+        if len(fields) != 5:
+            return msg
+
+        if not fields[4].startswith(COMPACT_PREFIX.encode('utf-8')):
+            return msg
+
+        try:
+            points = decode_points(fields[4].decode('utf-8'))
+        except (ValueError, UnicodeDecodeError) as _exc:
+            return None
+
+        fields[4] = encode_hex_points(points).encode('utf-8')
+        return b'/'.join(fields)
+
+    def catchup(self, binary=False, legacy=False):
+        """
+        Return the framed messages needed to bring a new client
+        up to date, as a list of chunks of the form (framed_msgs,
+        n_msgs), where n_msgs is the number of messages in the
+        chunk (which may be zero)
+
+        If binary is True, the messages are framed for the binary
+        protocol instead of the text protocol, and if legacy is
+        True, they are translated for legacy clients.
+
+        The same chunks are returned to every caller, so neither
+        the list nor the chunks may be modified.
+        """
+
+        if binary:
+            return self.binary_catchup()
+        elif legacy:
+            return self.legacy_catchup()
+
+        if self.catchup_chunks is None:
+            msgs = list(self)
+            if msgs:
+                buf = (SnoodsProtocol.recsep.join(msgs) +
+                       SnoodsProtocol.recsep)
+            else:
+                buf = b''
+
+            self.catchup_chunks = [(buf, len(msgs))]
+            self.tail = list()
+            self.tail_msgs = 0
+            self.tail_bytes = 0
+
+        elif self.tail:
+            self.catchup_chunks = self.add_chunk(
+                    self.catchup_chunks, b''.join(self.tail),
+                    self.tail_msgs)
+            self.tail = list()
+            self.tail_msgs = 0
+
+        return self.catchup_chunks
+
+    def binary_catchup(self):
+        """
+        Like catchup, but for the binary protocol
+
+        The first time this is called after the text buffer is
+        rebuilt, the whole text buffer is translated; after that,
+        only the batches that arrive are translated (if they
+        weren't relayed in binary already).
+        """
+
+        if self.catchup_chunks is None or self.binary_chunks is None:
+            self.binary_chunks = [
+                    (SnoodsBinaryCodec.frame_text(
+                        SnoodsProtocol.split_buf(buf)[0]), n_msgs)
+                    for buf, n_msgs in self.catchup()]
+            self.binary_tail = list()
+
+        elif self.binary_tail:
+            batches = list()
+            n_msgs = 0
+            for text_batch, batch_msgs, binary_batch in self.binary_tail:
+                if binary_batch is None:
+                    binary_batch = SnoodsBinaryCodec.frame_text(
+                            SnoodsProtocol.split_buf(text_batch)[0])
+                batches.append(binary_batch)
+                n_msgs += batch_msgs
+
+            self.binary_chunks = self.add_chunk(
+                    self.binary_chunks, b''.join(batches), n_msgs)
+            self.binary_tail = list()
+
+        return self.binary_chunks
+
+    def legacy_catchup(self):
+        """
+        Like catchup, but translated for legacy clients
+
+        The first time this is called after the text buffer is
+        rebuilt, the objects on the board are translated (rather
+        than the text buffer, because the messages in the text
+        buffer may depend on the objects as they were when the
+        messages arrived); after that, the translated batches
+        that arrive are added to it.
+        """
+
+        if self.catchup_chunks is None or self.legacy_chunks is None:
+            # The text buffer must exist, because the translated
+            # batches are only kept while it does
+            #
+            self.catchup()
+
+            msgs = list()
+            for viob_id, entry in self.objects.items():
+                if viob_id not in self.strokes:
+                    msgs += SnoodsBoardState.legacy_entry(entry)
+
+            self.legacy_chunks = [SnoodsBoardState.frame_msgs(msgs)]
+            self.legacy_tail = list()
+
+        elif self.legacy_tail:
+            self.legacy_chunks = self.add_chunk(
+                    self.legacy_chunks,
+                    b''.join([batch for batch, _n_msgs in self.legacy_tail]),
+                    sum([n_msgs for _batch, n_msgs in self.legacy_tail]))
+            self.legacy_tail = list()
+
+        return self.legacy_chunks
+
+    def add_chunk(self, chunks, data, n_msgs):
+        """
+        Return a new list of catch-up chunks, with the chunk
+        (data, n_msgs) added to the end of chunks
+
+        The list is copied, rather than extended, so that the
+        list that was returned to earlier callers doesn't change.
+        """
+
+        chunks = chunks + [(data, n_msgs)]
+
+        if len(chunks) > self.MAX_CATCHUP_CHUNKS:
+            rest = chunks[1:]
+            chunks = [chunks[0], (
+                    b''.join([chunk for chunk, _n_msgs in rest]),
+                    sum([n_msgs for _chunk, n_msgs in rest]))]
+
+        return chunks
+
+    def __iter__(self):
+        for viob_id, entry in self.objects.items():
+            yield entry[0]
+
+            if viob_id in self.strokes:
+                for msg in self.strokes[viob_id]:
+                    yield msg
+
+            for msg in entry[1:]:
+                if msg:
+                    yield msg
+
+    def __len__(self):
+        return sum(
+                1 for entry in self.objects.values()
+                for msg in entry if msg) + sum(
+                len(stroke) for stroke in self.strokes.values())
+
+    def num_objects(self):
+        """ Return the number of live objects on the board """
+
+        return len(self.objects)
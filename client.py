@@ -34,20 +34,40 @@ this is just a basic client that responds to messages
 from the server
 """
 
+import selectors
 import socket
 import threading
 import time
 
 from protocol import SnoodsProtocol
 from drawable_tk import SnoodsDrawableTk
+from latency import SnoodsLatencyHistogram
+from stroke import DEFAULT_TOLERANCE
 
 
 class SnoodsClient(threading.Thread):
     """
     Create a basic client, with a drawable UI
+
+    If latency is True, then the client measures the time from
+    when it sends each update to the server until that update
+    comes back from the server and is applied to the canvas.
     """
 
-    def __init__(self, sockaddr, board_id='default'):
+    # How often (in seconds) the client thread checks whether
+    # it has been stopped, when there's no input from the server
+    #
+    STOP_CHECK_INTERVAL = 0.25
+
+    def __init__(
+            self, sockaddr, board_id='default',
+            version=SnoodsProtocol.VERSION,
+            stroke_tolerance=DEFAULT_TOLERANCE,
+            stream_interval=SnoodsDrawableTk.DEFAULT_STREAM_INTERVAL,
+            drag_rate=SnoodsDrawableTk.DEFAULT_DRAG_RATE,
+            canvas_width=SnoodsDrawableTk.DEFAULT_CANVAS_WIDTH,
+            canvas_height=SnoodsDrawableTk.DEFAULT_CANVAS_HEIGHT,
+            latency=False):
         threading.Thread.__init__(self)
 
         sock = socket.socket()
@@ -55,8 +75,15 @@ class SnoodsClient(threading.Thread):
         sock.settimeout(0.05)
 
         self.wire = SnoodsProtocol(sock)
+        self.wire.negotiate(version)
         self.board_id = board_id
 
+        if latency:
+            self.latency = SnoodsLatencyHistogram()
+            self.wire.sent_times = dict()
+        else:
+            self.latency = None
+
         if board_id == 'default':
             self.curr_board_id = board_id
         else:
@@ -64,7 +91,12 @@ class SnoodsClient(threading.Thread):
             self.wire.push_join(board_id)
 
         self.drawable = SnoodsDrawableTk(
-                viobc=self.wire, client=self)
+                viobc=self.wire, client=self,
+                stroke_tolerance=stroke_tolerance,
+                stream_interval=stream_interval,
+                drag_rate=drag_rate,
+                canvas_width=canvas_width,
+                canvas_height=canvas_height)
         self.do_run = True
 
         # At some point later, you need to start the UI, via:
@@ -87,12 +119,15 @@ class SnoodsClient(threading.Thread):
         cmd = msg['command']
 
         if cmd == '<join':
-            # if the current board_id is already the same
-            # as the new board_id, then don't do anything
+            # The server sends a join, followed by the entire
+            # state of the board, whenever we change boards or
+            # whenever we fall so far behind that the server
+            # sends us the board again, so either way we need
+            # to start over
             #
-            if self.curr_board_id != msg['board_id']:
-                self.curr_board_id = msg['board_id']
-                self.drawable.apply_join(**msg)
+            self.curr_board_id = msg['board_id']
+            self.post_msg(msg)
+            return
 
         # If we haven't gotten the response saying
         # that we've joined the board we want, then
@@ -101,27 +136,58 @@ class SnoodsClient(threading.Thread):
         if self.board_id != self.curr_board_id:
             return
 
-        if cmd == '<colupd':
-            self.drawable.apply_colupd(**msg)
-        elif cmd == '<posupd':
-            self.drawable.apply_posupd(**msg)
-        elif cmd == '<newrec':
-            self.drawable.apply_newrec(**msg)
-        elif cmd == '<newtxt':
-            self.drawable.apply_newtxt(**msg)
-        elif cmd == '<newfre':
-            self.drawable.apply_newfre(**msg)
-        elif cmd == '<erase':
-            self.drawable.apply_erase(**msg)
-        elif cmd == '<join':
-            pass
+        self.post_msg(msg)
+
+    def post_msg(self, msg):
+        """
+        Pass a message to the drawable to apply
+
+        Tkinter isn't thread-safe, so rather than touching the
+        canvas from this thread, the message is prepared and
+        queued for the UI thread to apply.  If we're measuring
+        latency, and the message is the echo of one that we sent,
+        then the latency is recorded after the message is applied.
+        """
+
+        self.drawable.post_msg(msg)
+
+        if self.latency:
+            key = (msg['command'], msg.get('viob_id', msg.get('board_id')))
+            sent_time = self.wire.sent_times.pop(key, None)
+            if sent_time is not None:
+                self.drawable.post_op(self.record_latency, (sent_time,))
+
+    def record_latency(self, sent_time):
+        """
+        Record the latency of a message sent at sent_time
+        (as measured by time.perf_counter)
+        """
+
+        self.latency.record(time.perf_counter() - sent_time)
 
     def run(self):
 
+        # Wait for input from the server, rather than polling
+        # for it, so that each message is handled as soon as it
+        # arrives
+        #
+        selector = selectors.DefaultSelector()
+        selector.register(self.wire.sock, selectors.EVENT_READ)
+
         while self.do_run:
-            time.sleep(0.02)
-            msgs = self.wire.recv_msgs()
-            for msg in msgs:
-                cmd = self.wire.parse_msg(msg)
+            # Commands may have arrived with the reply to our
+            # <hello, so check for them before waiting
+            #
+            if not self.wire.pending_cmds:
+                if not selector.select(self.STOP_CHECK_INTERVAL):
+                    continue
+
+            for cmd in self.wire.recv_cmds():
                 if cmd:
                     self.apply_msg(cmd)
+
+            if self.wire.closed:
+                print('ERROR: the server closed the connection')
+                break
+
+        selector.close()
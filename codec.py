@@ -0,0 +1,298 @@
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+The schema of the Snoods messages, and the codec for their text form
+
+Each command has a declared list of fields, and everything about
+a message -- how it is parsed, how it is formatted, and how it is
+encoded in the binary protocol -- is derived from that list, so
+parsing a message is a single table lookup rather than a chain of
+comparisons.
+
+A parsed message is a SnoodsMsg: a small record with a slot for each
+field, which can also be used as a (read-only) mapping, so it can be
+passed to the apply_ methods of the drawable as keyword arguments.
+"""
+
+from stroke import encode_points
+
+
+# The kinds of fields in the messages, which determine how each
+# field is encoded in the text and binary protocols:
+#
+# ID - an object identifier (usually a UUID)
+# INT - an integer
+# STR - a string, escaped in the text protocol
+# POINTS - a list of (x, y) integer points (see stroke.py)
+#
+ID = 'id'
+INT = 'int'
+STR = 'str'
+POINTS = 'points'
+
+# The commands, with the opcode for each in the binary protocol
+# (or None if the command is only sent as text) and the name and
+# kind of each field.  The field names are the keys of the parsed
+# messages, and the names of the parameters of the apply_ methods.
+#
+# Opcode 0 is reserved for a text message that is carried as-is,
+# for messages that can't be encoded (or re-encoded) exactly.
+#
+SCHEMA = {
+        '<colupd': (1, (('viob_id', ID), ('color', STR))),
+        '<posupd': (2, (('viob_id', ID), ('ll_x', INT), ('ll_y', INT),
+                        ('ur_x', INT), ('ur_y', INT))),
+        '<newrec': (3, (('viob_id', ID), ('ll_x', INT), ('ll_y', INT),
+                        ('ur_x', INT), ('ur_y', INT), ('color', STR))),
+        '<newtxt': (4, (('viob_id', ID), ('ll_x', INT), ('ll_y', INT),
+                        ('text', STR), ('color', STR), ('font', STR),
+                        ('size', STR), ('weight', STR))),
+        '<newfre': (5, (('viob_id', ID), ('color', STR), ('lwidth', INT),
+                        ('point_str', POINTS))),
+        '<erase': (6, (('viob_id', ID),)),
+        '<join': (7, (('board_id', STR),)),
+        '<begfre': (8, (('viob_id', ID), ('color', STR), ('lwidth', INT),
+                        ('point_str', POINTS))),
+        '<addfre': (9, (('viob_id', ID), ('point_str', POINTS))),
+        '<endfre': (10, (('viob_id', ID),)),
+        '<hello': (None, (('version', INT),))
+        }
+
+# Strings that are sent as a single small integer in the binary
+# protocol, instead of spelled out: the colors, fonts, sizes and
+# weights that the client offers.  Strings may be appended to this
+# list, but never removed or reordered (unless the protocol version
+# is changed), because both ends must agree on the index of each one.
+#
+INTERNED_STRS = [
+        'black', 'white', 'red', 'blue', 'coral', 'darkgreen',
+        'sienna', 'purple', 'yellow',
+        'Helvetica', 'Times', 'Courier',
+        '10', '12', '15', '18', '24', '28',
+        'normal', 'bold', 'italic'
+        ]
+
+# The "special" characters and their escaped forms in the text
+# protocol.  '&' must be first (for escape_str) and therefore last
+# (for unescape_str) because it is the prefix of all the escaped forms
+#
+ESCAPES = (
+        ('&', '&amp;'),
+        ('<', '&lt;'),
+        ('>', '&gt;'),
+        ('\n', '&nl;'),
+        ('\t', '&tab;'),
+        ('/', '&fs;')
+        )
+
+CHAR2ESC = dict(ESCAPES)
+
+# str.replace runs in C, so one pass per special character is much
+# faster than any per-character loop in Python (and faster than
+# str.translate or re.sub, for a table this small)
+#
+UNESCAPES = tuple(reversed(ESCAPES))
+
+
+def escape_str(text):
+    """
+    Return a copy of text with each special character
+    replaced by its escaped form
+    """
+
+    for char, esc in ESCAPES:
+        if char in text:
+            text = text.replace(char, esc)
+    return text
+
+
+def unescape_str(text):
+    """
+    Return a copy of text with each escaped form replaced
+    by the original special character
+    """
+
+    if '&' not in text:
+        return text
+
+    for char, esc in UNESCAPES:
+        text = text.replace(esc, char)
+    return text
+
+
+class SnoodsMsg(object):
+    """
+    Base class for parsed messages
+
+    There is a subclass of SnoodsMsg for each command, with a slot
+    for each of its fields (see make_msg_class).  The command itself
+    is a class attribute.
+    """
+
+    __slots__ = ()
+
+    command = None
+    KEYS = ()
+
+    def keys(self):
+        return self.KEYS
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError as _exc:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def __contains__(self, key):
+        return key in self.KEYS
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __eq__(self, other):
+        return dict(self.items()) == dict(other.items())
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.KEYS]
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+def make_msg_class(cmd, names):
+    """
+    Create the SnoodsMsg subclass for the command, whose
+    fields have the given names
+
+    The constructor takes the values of the fields, in order.
+    It is created from source (the same way collections.namedtuple
+    creates its classes) because that's several times faster than
+    a generic constructor that loops over the fields.
+    """
+
+    args = ''.join(', %s' % name for name in names)
+    body = ''.join('    self.%s = %s\n' % (name, name) for name in names)
+    source = 'def __init__(self%s):\n%s    pass\n' % (args, body)
+
+    namespace = dict()
+    exec(source, namespace)
+
+    class_name = 'SnoodsMsg_%s' % cmd.lstrip('<')
+    return type(class_name, (SnoodsMsg,), {
+            '__slots__': tuple(names),
+            '__init__': namespace['__init__'],
+            'command': cmd,
+            'KEYS': ('command',) + tuple(names)})
+
+
+class SnoodsCmdSpec(object):
+    """
+    Everything derived from the schema of a command
+    """
+
+    def __init__(self, cmd, opcode, fields):
+
+        self.cmd = cmd
+        self.opcode = opcode
+        self.fields = fields
+        self.names = tuple(name for name, _kind in fields)
+        self.kinds = tuple(kind for _name, kind in fields)
+        self.n_fields = len(fields)
+
+        self.msg_class = make_msg_class(cmd, self.names)
+
+        # the indices of the fields that are escaped in the text form
+        #
+        self.str_indices = tuple(
+                ind for ind, kind in enumerate(self.kinds) if kind == STR)
+        self.escaped_indices = tuple(
+                ind for ind, kind in enumerate(self.kinds)
+                if kind in (STR, ID))
+        self.points_indices = tuple(
+                ind for ind, kind in enumerate(self.kinds) if kind == POINTS)
+
+        # the format of the text form, given the (escaped) values
+        #
+        conversions = ['%d' if kind == INT else '%s' for kind in self.kinds]
+        self.template = '/'.join([cmd] + conversions)
+
+
+CMD2SPEC = dict(
+        (cmd, SnoodsCmdSpec(cmd, opcode, fields))
+        for cmd, (opcode, fields) in SCHEMA.items())
+
+
+def parse_text(text):
+    """
+    Parse a single text message (as bytes) into a SnoodsMsg
+
+    The fields are strings, with the STR fields unescaped.
+
+    Returns an empty dictionary if the message is not a known
+    command, is missing some of its fields, or is not UTF-8.
+    """
+
+    try:
+        fields = text.decode('utf-8').split('/')
+    except UnicodeDecodeError as _exc:
+        return dict()
+
+    spec = CMD2SPEC.get(fields[0])
+    if spec is None or len(fields) <= spec.n_fields:
+        return dict()
+
+    values = fields[1:spec.n_fields + 1]
+    for ind in spec.str_indices:
+        if '&' in values[ind]:
+            values[ind] = unescape_str(values[ind])
+
+    return spec.msg_class(*values)
+
+
+def format_text(cmd, values):
+    """
+    Format the command, with the given field values (in the
+    order given by the SCHEMA), as a text message (as bytes)
+    """
+
+    spec = CMD2SPEC[cmd]
+
+    values = list(values)
+    for ind in spec.escaped_indices:
+        values[ind] = escape_str(str(values[ind]))
+    for ind in spec.points_indices:
+        values[ind] = encode_points(values[ind])
+
+    return (spec.template % tuple(values)).encode('utf-8')
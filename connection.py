@@ -0,0 +1,361 @@
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Per-client connection state for the Snoods server
+
+Each connection has its own queue of output waiting to be sent.
+The server never blocks writing to a client: it adds messages to
+the queue, sends as much of the queue as the socket will accept,
+and sends the rest when the socket becomes writable again.
+
+A client that can't keep up (because of a slow network, or because
+it has stopped reading) would make its queue grow without bound, so
+each queue has a high-water mark.  When the amount of relayed traffic
+waiting in the queue passes the high-water mark, the server applies
+one of the following policies:
+
+    coalesce - remove position and color updates from the queue that
+        are superseded by later updates to the same object, and if
+        that isn't enough, resync the client
+
+    resync - discard the relayed traffic in the queue and replace it
+        with the current state of the board, which is never larger
+        than the board itself
+
+    disconnect - close the connection
+"""
+
+import collections
+import os
+import socket
+
+from board_state import SnoodsBoardState
+from framing import SnoodsBinaryFramer
+from framing import SnoodsFramer
+from protocol import SnoodsBinaryCodec
+from protocol import SnoodsProtocol
+
+
+class SnoodsConnection(object):
+    """
+    The server's state for a single client connection
+    """
+
+    POLICIES = ('coalesce', 'resync', 'disconnect')
+
+    DEFAULT_HIGH_WATER = 1024 * 1024
+    DEFAULT_POLICY = 'resync'
+
+    # sendmsg() isn't available on every platform, and the number
+    # of buffers that can be passed to it is limited
+    #
+    HAVE_SENDMSG = hasattr(socket.socket, 'sendmsg')
+    try:
+        IOV_MAX = os.sysconf('SC_IOV_MAX')
+    except (AttributeError, ValueError, OSError) as _exc:
+        IOV_MAX = -1
+    if IOV_MAX <= 0:
+        IOV_MAX = 16
+
+    def __init__(
+            self, sock,
+            high_water=DEFAULT_HIGH_WATER, policy=DEFAULT_POLICY):
+
+        if policy not in SnoodsConnection.POLICIES:
+            raise ValueError('unknown policy [%s]' % policy)
+
+        self.sock = sock
+        self.high_water = high_water
+        self.policy = policy
+
+        # the board this client is attached to, if any
+        #
+        self.board_id = None
+
+        # Map from the viob_id (as it appears in the messages) of
+        # each freehand drawing that this client has begun but not
+        # ended to the board_id of the drawing, so that the server
+        # can end the drawings if the client goes away
+        #
+        self.open_strokes = dict()
+
+        # buffer used for partial messages.  We cannot assume
+        # that every recv() gets a complete message -- or only
+        # one message!
+        #
+        self.framer = SnoodsFramer(SnoodsProtocol.recsep)
+
+        # The protocol version used by the client.  Every client
+        # starts out with the text protocol, and is treated as a
+        # legacy client until it sends a <hello, which may also
+        # switch it to the binary protocol (see set_version).  The
+        # messages in the output queue are already encoded for
+        # the client.
+        #
+        self.version = SnoodsProtocol.LEGACY_VERSION
+
+        # The output queue.  Each element is a list of the form
+        # [data, n_msgs, is_live], where data is the bytes to
+        # send, n_msgs is the number of messages in data, and
+        # is_live is True for relayed traffic and False for the
+        # messages that catch the client up with the board.
+        #
+        # The first out_offset bytes of the first element have
+        # already been sent.
+        #
+        self.outq = collections.deque()
+        self.out_offset = 0
+
+        # whether the server is waiting for the socket to
+        # become writable (i.e. the output queue is not empty)
+        #
+        self.want_write = False
+
+        # counters
+        #
+        self.out_bytes = 0
+        self.out_msgs = 0
+        self.live_bytes = 0
+        self.max_out_bytes = 0
+        self.sent_bytes = 0
+        self.sent_msgs = 0
+        self.coalesced_msgs = 0
+        self.resyncs = 0
+
+    def enqueue(self, data, n_msgs=1, is_live=True):
+        """
+        Add data, which contains n_msgs complete messages, to the
+        end of the output queue
+        """
+
+        self.outq.append([data, n_msgs, is_live])
+
+        self.out_bytes += len(data)
+        self.out_msgs += n_msgs
+        if is_live:
+            self.live_bytes += len(data)
+
+        if self.out_bytes > self.max_out_bytes:
+            self.max_out_bytes = self.out_bytes
+
+    def enqueue_msg(self, msg, is_live=True):
+        """
+        Add a single (text) message to the end of the output queue,
+        encoded for the protocol version used by the client
+        """
+
+        if self.version == SnoodsProtocol.BINARY_VERSION:
+            msg = SnoodsBinaryCodec.from_text(msg)
+
+        self.enqueue(self.framer.frame([msg]), 1, is_live)
+
+    def set_version(self, version):
+        """
+        Switch the connection to the given protocol version
+
+        Everything added to the output queue after this is encoded
+        for the new version, and any input that hasn't been split
+        into messages yet is passed to the framer for the new version.
+        """
+
+        self.version = version
+
+        if version == SnoodsProtocol.BINARY_VERSION:
+            framer = SnoodsBinaryFramer()
+        else:
+            framer = SnoodsFramer(SnoodsProtocol.recsep)
+
+        framer.feed(self.framer.take_remainder())
+        self.framer = framer
+
+    def is_lagging(self):
+        """
+        Return True if the amount of relayed traffic waiting
+        to be sent to this client is above the high-water mark
+        """
+
+        return self.live_bytes > self.high_water
+
+    def flush(self):
+        """
+        Send as much of the output queue as the socket will accept
+        without blocking, and return True if the queue is empty
+
+        If there is more than one element in the queue, then all
+        of them (up to the limit of the system) are sent with a
+        single call to sendmsg, so that a client is typically sent
+        everything that was queued for it during a tick with one
+        system call.
+
+        Raises OSError if the connection has failed
+        """
+
+        outq = self.outq
+
+        while outq:
+            if len(outq) == 1 or not SnoodsConnection.HAVE_SENDMSG:
+                buffers = None
+                data = memoryview(outq[0][0])[self.out_offset:]
+            else:
+                buffers = [memoryview(outq[0][0])[self.out_offset:]]
+                for ind in range(1, min(len(outq), self.IOV_MAX)):
+                    buffers.append(outq[ind][0])
+
+            try:
+                if buffers:
+                    n_sent = self.sock.sendmsg(buffers)
+                else:
+                    n_sent = self.sock.send(data)
+            except (BlockingIOError, InterruptedError) as _exc:
+                return False
+
+            self.sent_bytes += n_sent
+            self.out_bytes -= n_sent
+
+            # Remove everything that was completely sent from
+            # the queue, and remember how much of the next
+            # element was sent
+            #
+            while n_sent:
+                data, n_msgs, is_live = outq[0]
+                n_used = min(n_sent, len(data) - self.out_offset)
+                n_sent -= n_used
+                self.out_offset += n_used
+                if is_live:
+                    self.live_bytes -= n_used
+
+                if self.out_offset < len(data):
+                    return False
+
+                outq.popleft()
+                self.out_offset = 0
+                self.out_msgs -= n_msgs
+                self.sent_msgs += n_msgs
+
+        return True
+
+    def clear_queue(self):
+        """
+        Discard everything in the output queue, except for the
+        unsent part of a partially sent element (because sending
+        only part of a message would corrupt the stream)
+        """
+
+        head = None
+        if self.outq and self.out_offset:
+            head = self.outq.popleft()
+
+        for data, n_msgs, is_live in self.outq:
+            self.out_bytes -= len(data)
+            self.out_msgs -= n_msgs
+            if is_live:
+                self.live_bytes -= len(data)
+
+        self.outq.clear()
+        if head:
+            self.outq.append(head)
+
+    def partial_output(self):
+        """
+        Return the rest of the message that has been partly
+        sent to the client, if any
+
+        This is what must be sent to the client, before anything
+        else, if the connection is handed off to another process
+        """
+
+        if not self.outq or not self.out_offset:
+            return b''
+
+        data = self.outq[0][0]
+        end = self.framer.frame_end(data, self.out_offset)
+        return bytes(data[self.out_offset:end])
+
+    def coalesce(self):
+        """
+        Remove the position and color updates from the relayed
+        traffic at the end of the output queue that are superseded
+        by later updates to the same object
+
+        Only the relayed traffic after the last catch-up message
+        (and after any partially sent element) is considered.
+        """
+
+        # find where the run of relayed traffic begins
+        #
+        first = len(self.outq)
+        while first > 0 and self.outq[first - 1][2]:
+            first -= 1
+
+        if first == 0 and self.out_offset:
+            first = 1
+
+        if len(self.outq) - first < 2:
+            return
+
+        msgs = list()
+        for ind in range(first, len(self.outq)):
+            data, _n_msgs, _is_live = self.outq[ind]
+            msgs += self.framer.split(data)
+
+        # coalescing is done on the text form of the messages
+        #
+        if self.version == SnoodsProtocol.BINARY_VERSION:
+            msgs = [SnoodsBinaryCodec.to_text(msg) for msg in msgs]
+
+        kept = SnoodsBoardState.coalesce_msgs(msgs)
+
+        for _ind in range(len(self.outq) - first):
+            data, n_msgs, _is_live = self.outq.pop()
+            self.out_bytes -= len(data)
+            self.out_msgs -= n_msgs
+            self.live_bytes -= len(data)
+
+        for msg in kept:
+            self.enqueue_msg(msg)
+
+        self.coalesced_msgs += len(msgs) - len(kept)
+
+    def stats(self):
+        """
+        Return a dictionary of the counters for this connection
+        """
+
+        return {
+                'board_id': self.board_id,
+                'version': self.version,
+                'queue_bytes': self.out_bytes,
+                'queue_msgs': self.out_msgs,
+                'queue_live_bytes': self.live_bytes,
+                'max_queue_bytes': self.max_out_bytes,
+                'sent_bytes': self.sent_bytes,
+                'sent_msgs': self.sent_msgs,
+                'coalesced_msgs': self.coalesced_msgs,
+                'resyncs': self.resyncs
+                }
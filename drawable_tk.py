@@ -30,10 +30,19 @@
 The UI for the Snoods client
 """
 
+import bisect
+import collections
+import os
+import time
 import tkinter as tk
+import tkinter.font
 
+from model import SnoodsBoardModel
+from model import SnoodsBoardObj
 from protocol import SnoodsProtocol
 from shift import SnoodsShiftCursor
+from stroke import DEFAULT_TOLERANCE
+from stroke import simplify_points
 
 
 class Point(object):
@@ -49,8 +58,25 @@ class Point(object):
 class Stylus(object):
     """
     Utility class to provide a "freehand" drawing action
+
+    A freehand drawing is sent to the server while it is being
+    drawn: a <begfre with the first points, then an <addfre with
+    the new points at most once every stream_interval seconds,
+    and then an <endfre when the mouse button is released, so that
+    other users see the drawing as it is drawn.
+
+    Each drawing is a single (multi-point) line item on the canvas,
+    and new points are appended to the item as they arrive.
     """
 
+    # The options for the line items for drawings
+    #
+    LINE_OPTIONS = {
+            'smooth': True,
+            'capstyle': tk.ROUND,
+            'joinstyle': tk.ROUND
+            }
+
     def __init__(self, drawable):
         self.drawable = drawable
 
@@ -58,9 +84,23 @@ class Stylus(object):
         self.color = self.drawable.active_color[0]
         self.color = self.drawable.active_lwidth
         self.points = None
-        self.group_item = None
+        self.item = None
         self.lwidth = 0
 
+        # The state of the drawing in progress: its viob_id,
+        # whether its <begfre has been sent, the number of points
+        # that have been sent so far, and the pending call to
+        # send_points (if any)
+        #
+        # The points are in board coordinates, rounded to the
+        # nearest pixel, while the line item is drawn through the
+        # points where the mouse actually was on the canvas
+        #
+        self.viob_id = None
+        self.begun = False
+        self.n_sent = 0
+        self.send_timer = None
+
     def activate(self):
         """
         Set the bindings to deal with "freehand drawing"
@@ -78,15 +118,34 @@ class Stylus(object):
         self.drawable.canvas.bind(
                 '<ButtonRelease-2>', self.makeup())
 
+    def board_point(self, event):
+        """
+        Return the point of the event in board coordinates,
+        rounded to the nearest pixel
+        """
+
+        b_x, b_y = self.drawable.to_board(event.x, event.y)
+        return (int(round(b_x)), int(round(b_y)))
+
     def makedown(self):
         """ Return the callback for a mouse-2-down event """
 
         def callback(event):
+            self.drawable.canvas.focus_set()
+
             self.prev_x, self.prev_y = event.x, event.y
             self.color = self.drawable.active_color[0]
             self.lwidth = self.drawable.active_lwidth
             self.points = list()
-            self.points.append((event.x, event.y))
+            self.points.append(self.board_point(event))
+
+            self.item = self.create_line(
+                    [event.x, event.y], self.color,
+                    self.lwidth * self.drawable.zoom)
+
+            self.viob_id = SnoodsProtocol.create_viob_id()
+            self.begun = False
+            self.n_sent = 0
 
         return callback
 
@@ -94,17 +153,19 @@ class Stylus(object):
         """ Return the callback for a mouse-2-motion event """
 
         def callback(event):
-            item = self.drawable.canvas.create_line(
-                    (self.prev_x, self.prev_y, event.x, event.y),
-                    fill=self.color, width=self.lwidth)
-
-            if not self.group_item:
-                self.group_item = 'group-%d' % item
-
-            self.drawable.canvas.itemconfig(
-                    item, tags=('moveable', self.group_item))
+            self.drawable.canvas.insert(
+                    self.item, 'end', (event.x, event.y))
             self.prev_x, self.prev_y = event.x, event.y
-            self.points.append((event.x, event.y))
+            self.points.append(self.board_point(event))
+
+            # Rather than sending each point as it arrives, wait
+            # (at most stream_interval) for more points to send
+            # with it
+            #
+            if self.send_timer is None:
+                self.send_timer = self.drawable.canvas.after(
+                        int(self.drawable.stream_interval * 1000),
+                        self.send_points)
 
         return callback
 
@@ -113,61 +174,87 @@ class Stylus(object):
 
         def callback(_event):
 
-            viob_id = SnoodsProtocol.create_viob_id()
-            self.drawable.register_obj(self.group_item, viob_id)
+            if self.send_timer is not None:
+                self.drawable.canvas.after_cancel(self.send_timer)
+
+            self.send_points()
+            if self.drawable.viobc:
+                self.drawable.viobc.push_end_freehand(self.viob_id)
 
-            self.push_freehand(
-                    viob_id, self.points, self.color, self.lwidth)
-            self.group_item = None
+            self.item = None
             self.points = None
+            self.viob_id = None
         return callback
 
-    def push_freehand(self, viob_id, points, color, lwidth, remote=False):
-        """
-        Push a freehand drawing event to the remote,
-        if there is one
+    def send_points(self):
         """
+        Push the points of the drawing in progress that haven't
+        been pushed yet to the remote, if there is one
 
-        points = [(p[0], self.drawable.flip_y(p[1])) for p in self.points]
-        points_str = ' '.join(['%x,%x' % (p[0], p[1]) for p in points])
-
-        if not remote and self.drawable.viobc:
-            self.drawable.viobc.push_freehand(
-                    viob_id, points_str, color, lwidth)
-
-    def apply_newfre(self, viob_id, points_str, lwidth, color):
-        """
-        Apply a freehand drawing message received from the remote
+        The first call pushes the <begfre for the drawing, and
+        adds the drawing to the model.
         """
 
-        if viob_id in self.drawable.viob_id2item:
-            # we already have this viob; no need to create it
-            return
+        self.send_timer = None
 
-        line_width = int(lwidth)
+        if self.points is None:
+            return
 
-        points_list = points_str.split()
-        points = list()
-        for point_str in points_list:
-            p_x, p_y = point_str.split(',')
-            points.append((int(p_x, 16), self.drawable.flip_y(int(p_y, 16))))
+        # The last point that was sent is included in the
+        # points to simplify, so that the simplified drawing
+        # is continuous, but it isn't sent again
+        #
+        first = max(self.n_sent - 1, 0)
+        if len(self.points) - first < (2 if self.begun else 1):
+            return
 
-        group_item = None
+        # The drawing is drawn locally with every point, but only
+        # the points that make a visible difference are sent
+        #
+        points = simplify_points(
+                self.points[first:], self.drawable.stroke_tolerance)
+        if self.begun:
+            points = points[1:]
+
+        self.n_sent = len(self.points)
+        coords = [coord for point in self.points for coord in point]
+
+        viobc = self.drawable.viobc
+        model = self.drawable.model
+        if not self.begun:
+            self.begun = True
+            self.drawable.register_obj(self.item, self.viob_id)
+            model.add_object(
+                    self.viob_id,
+                    SnoodsBoardObj(
+                        SnoodsBoardObj.LINE, coords,
+                        self.color, self.lwidth))
+            if viobc:
+                viobc.push_begin_freehand(
+                        self.viob_id, points, self.color, self.lwidth)
+        else:
+            obj = model.objects.get(self.viob_id)
+            if obj:
+                obj.coords = coords
+                model.update_object(self.viob_id)
+            if viobc:
+                viobc.push_add_freehand(self.viob_id, points)
+
+    def create_line(self, coords, color, line_width):
+        """
+        Create a line item through the points with the given
+        (flat) list of canvas coordinates, and return the item
 
-        for ind in range(len(points) - 1):
-            point1 = points[ind]
-            point2 = points[ind + 1]
-            item = self.drawable.canvas.create_line(
-                    point1[0], point1[1],
-                    point2[0], point2[1],
-                    fill=color, width=line_width)
+        A line item needs at least two points, so a drawing
+        with only one point is drawn as a dot.
+        """
 
-            if not group_item:
-                group_item = 'group-%d' % item
-                self.drawable.register_obj(group_item, viob_id)
+        if len(coords) == 2:
+            coords = coords * 2
 
-            self.drawable.canvas.itemconfig(
-                    item, tags=('moveable', group_item))
+        return self.drawable.canvas.create_line(
+                coords, fill=color, width=line_width, tags=('moveable',),
+                **self.LINE_OPTIONS)
 
 
 class SnoodsDrawableTk(object):
@@ -200,14 +287,139 @@ class SnoodsDrawableTk(object):
             10, 12, 15, 18, 24, 28
             ]
 
-    def __init__(self, viobc=None, client=None):
+    DEFAULT_STREAM_INTERVAL = 0.05
+
+    # The most position updates per second to send for an
+    # object while it is being dragged
+    #
+    DEFAULT_DRAG_RATE = 30
+
+    # How long (in seconds) to wait for a position update sent
+    # while dragging to return from the server before sending
+    # another one anyway
+    #
+    DRAG_FLIGHT_TIMEOUT = 0.5
+
+    # How close (in pixels) a click must be to an object
+    # to pick that object
+    #
+    PICK_HALO = 2
+
+    # The longest (in seconds) to spend applying messages from
+    # the remote before letting Tk redraw the canvas and handle
+    # user input, and how long (in milliseconds) to wait before
+    # checking for new messages when there aren't any (which is
+    # only necessary on platforms where the client thread can't
+    # wake up the Tk thread when messages arrive)
+    #
+    DRAIN_BUDGET = 0.02
+    DRAIN_INTERVAL = 20
+
+    DEFAULT_CANVAS_WIDTH = 1200
+    DEFAULT_CANVAS_HEIGHT = 900
+
+    # Only the objects within VIEW_MARGIN times the size of the
+    # view of the visible part of the board are drawn on the
+    # canvas, and objects that were drawn aren't removed from the
+    # canvas until they are twice as far as that from the view,
+    # so that panning back and forth over a small distance doesn't
+    # keep recreating the same items
+    #
+    VIEW_MARGIN = 0.5
+
+    # The limits of the zoom factor (the number of canvas pixels
+    # per board pixel), how much each step zooms in or out, and
+    # how far (in canvas pixels) each step pans the view
+    #
+    MIN_ZOOM = 0.05
+    MAX_ZOOM = 8.0
+    ZOOM_STEP = 1.25
+    PAN_STEP = 100
+
+    def __init__(
+            self, viobc=None, client=None,
+            stroke_tolerance=DEFAULT_TOLERANCE,
+            stream_interval=DEFAULT_STREAM_INTERVAL,
+            drag_rate=DEFAULT_DRAG_RATE,
+            canvas_width=DEFAULT_CANVAS_WIDTH,
+            canvas_height=DEFAULT_CANVAS_HEIGHT,
+            model=None):
 
         self.viobc = viobc
         self.client = client
 
+        # how far (in pixels) a point of a freehand drawing may be
+        # from the line between its neighbors before it is omitted
+        # from the drawing that is sent to the server
+        #
+        self.stroke_tolerance = stroke_tolerance
+
+        # how often (in seconds) to send the new points of a
+        # freehand drawing while it is being drawn
+        #
+        self.stream_interval = stream_interval
+
+        # how many position updates per second to send for an object
+        # while it is being dragged (or 0 to only send its final
+        # position)
+        #
+        self.drag_rate = drag_rate
+
+        # The mapping between the viob_ids and the canvas items of
+        # the objects that are drawn on the canvas
+        #
         self.item2viob_id = dict()
         self.viob_id2item = dict()
 
+        # The viob_ids of the objects that have changed in the model
+        # since the canvas was last updated, and whether a call to
+        # flush is scheduled to update it
+        #
+        self.dirty = dict()
+        self.flush_scheduled = False
+
+        # The view: the board coordinates of the lower left corner
+        # of the canvas, and the zoom factor
+        #
+        self.view_x = 0
+        self.view_y = 0
+        self.zoom = 1.0
+
+        # Cache of the fonts used to measure text, by font_des
+        #
+        self.fonts = dict()
+
+        # The viob_ids of the selected objects, and the
+        # rectangle (if any) being dragged out to select them
+        #
+        self.selected = list()
+        self.rubber_band = None
+        self.rubber_start = None
+
+        # Operations, prepared by prepare_msg, waiting to be applied
+        # by the Tk thread.  Messages arrive on the client's thread,
+        # but tkinter isn't thread-safe, so the client only appends
+        # to this queue, and drain_ops applies the operations from
+        # the Tk main loop.
+        #
+        # Each operation is queued along with the number of joins
+        # that had been posted when it was queued, so that drain_ops
+        # can skip the operations that came before the latest join
+        # (only the client's thread changes posted_joins).
+        #
+        self.pending_ops = collections.deque()
+        self.posted_joins = 0
+
+        # The client thread wakes up the Tk thread, when it adds
+        # operations to the queue, by writing to the wakeup_w pipe
+        # (which is created by main, if Tk can watch the pipe), unless
+        # a wakeup is already pending.  If there's no pipe, then
+        # drain_ops polls the queue instead.
+        #
+        self.wakeup_w = None
+        self.wakeup_pending = False
+        self.drain_scheduled = False
+
         self.font_face = self.FONT_FACES[0]
         self.font_size = self.FONT_SIZES[
                 int((len(self.FONT_SIZES) - 1) / 2)]
@@ -236,10 +448,9 @@ class SnoodsDrawableTk(object):
 
         # self.frame = tk.Frame()
 
-        # TODO figure out how to dynamically resize
-
         self.canvas = tk.Canvas(
-                self.frame, width=1200, height=900, background='white')
+                self.frame, width=canvas_width, height=canvas_height,
+                background='white')
         self.canvas.pack(expand=1, fill=tk.BOTH)
         self.canvas.update()
 
@@ -250,14 +461,53 @@ class SnoodsDrawableTk(object):
         # count the pixel border as part of the height?
         # Is this something dependent on the window manager?
         #
+        self.canvas_width = self.canvas.winfo_width()
         self.canvas_height = self.canvas.winfo_height()
 
+        # The objects on the board, which this is a view of.  Text
+        # must be measured with the fonts that it is drawn with.
+        #
+        if model is None:
+            model = SnoodsBoardModel(text_extent=self.text_extent)
+        self.model = model
+        self.model.add_listener(self.model_changed)
+
         self.active_color = self.BASE_COLORS[0]
         self.dragging_item = -1
 
+        # The state of the drag in progress (if any): whether the
+        # object has moved since its position was last sent, when
+        # it was last sent, whether we're waiting for that update
+        # to return from the server, and the pending call to
+        # send_drag_update (if any)
+        #
+        self.drag_moved = False
+        self.drag_sent_time = 0
+        self.drag_in_flight = False
+        self.drag_timer = None
+
+        # Map from the viob_id of each object that has been dragged
+        # to a list of the form [final_bbox, sent_bboxes], where
+        # final_bbox is the position sent when the drag ended (or
+        # None while the drag continues) and sent_bboxes is the set
+        # of the positions that were sent during the drag.  The
+        # entry is removed when the final position returns from
+        # the server (see apply_posupd).
+        #
+        self.drag_echoes = dict()
+
+        # The distance (in canvas pixels) that the object being
+        # dragged has moved that hasn't been applied to its
+        # board coordinates yet
+        #
+        self.drag_dx = 0
+        self.drag_dy = 0
+
         self.drag_mouse_mode()
         self.color_mouse_mode()
         self.delete_mouse_mode()
+        self.select_mouse_mode()
+        self.view_mouse_mode()
 
         subframe = tk.Frame(self.frame)
         self.make_color_bar(parent_frame=subframe)
@@ -382,14 +632,12 @@ class SnoodsDrawableTk(object):
         area into a new text item.
         """
 
-        # FIXME: magic numbers define where the new text goes.
+        # New text goes at the lower left corner of the view.
         #
         # TODO: it would be better to have appear closer to the
         # text entry box, so the user doesn't have to reach as
         # far to move it.
         #
-        default_new_text_pos = (0, 0)
-
         if not parent_frame:
             parent_frame = self.frame
 
@@ -411,7 +659,7 @@ class SnoodsDrawableTk(object):
                 if text:
                     viob_id = SnoodsProtocol.create_viob_id()
                     self.create_text(
-                            default_new_text_pos[0], default_new_text_pos[1],
+                            int(self.view_x), int(self.view_y),
                             text, viob_id,
                             self.active_color[0])
             return callback
@@ -529,24 +777,14 @@ class SnoodsDrawableTk(object):
 
     def get_item_group(self, item):
         """
-        Find the "group" of a grouped item.
-
-        The convention is that items that are always treated
-        as part of a group are given a tag of the form 'group-N'
-        where N is the item number of one of the items in the
-        group (typically the first one created).
+        Find the "group" of an item: the name that is registered
+        for the object that the item is part of.
 
-        If the item is a grouped item, then just return the
-        item.
+        Every object, including a freehand drawing, is drawn as
+        a single canvas item, so this is always the item itself.
         """
 
-        item_group = item
-        for tag in self.canvas.itemcget(item, 'tags').split():
-            if tag.startswith('group-'):
-                item_group = tag
-                break
-
-        return item_group
+        return item
 
     def delete_mouse_mode(self):
         """
@@ -556,11 +794,10 @@ class SnoodsDrawableTk(object):
         def post_nuke(event):
             """ Callback when an item is chosen """
 
-            item = self.canvas.find_closest(event.x, event.y)[0]
-            item_group = self.get_item_group(item)
+            item_group = self.pick_item(event)
+            viob_id = self.item2viob_id.get(item_group)
 
-            if self.viobc:
-                viob_id = self.item2viob_id[item_group]
+            if self.viobc and viob_id is not None:
                 self.viobc.push_erase(viob_id)
 
         self.canvas.tag_bind(
@@ -587,20 +824,549 @@ class SnoodsDrawableTk(object):
         self.canvas.tag_bind(
                 'moveable', '<ButtonRelease-3>', self.color_mouse_release)
 
+    def view_mouse_mode(self):
+        """
+        Set the callbacks for moving the view: the mouse wheel pans
+        the view up and down (or left and right, with the Shift key)
+        or zooms in and out (with the Control key), as do the arrow
+        keys and the + and - keys, and the Home key returns the view
+        to where it started
+        """
+
+        def wheel_command(mode, step=None):
+            """ Create a callback for a mouse wheel event """
+            def callback(event):
+                direction = step
+                if direction is None:
+                    direction = 1 if event.delta > 0 else -1
+
+                if mode == 'zoom':
+                    self.zoom_at(event.x, event.y, self.ZOOM_STEP ** direction)
+                elif mode == 'x':
+                    self.pan(-direction * self.PAN_STEP, 0)
+                else:
+                    self.pan(0, -direction * self.PAN_STEP)
+            return callback
+
+        def pan_command(d_x, d_y):
+            """ Create a callback to pan the view """
+            def callback(_event):
+                self.pan(d_x * self.PAN_STEP, d_y * self.PAN_STEP)
+            return callback
+
+        def zoom_command(factor):
+            """ Create a callback to zoom around the center of the view """
+            def callback(_event):
+                self.zoom_at(
+                        self.canvas_width / 2, self.canvas_height / 2, factor)
+            return callback
+
+        # X11 reports the wheel as buttons 4 and 5, while other
+        # platforms report a MouseWheel event with a delta
+        #
+        for modifier, mode in [
+                ('', 'y'), ('Shift-', 'x'), ('Control-', 'zoom')]:
+            self.canvas.bind(
+                    '<%sMouseWheel>' % modifier, wheel_command(mode))
+            self.canvas.bind(
+                    '<%sButton-4>' % modifier, wheel_command(mode, 1))
+            self.canvas.bind(
+                    '<%sButton-5>' % modifier, wheel_command(mode, -1))
+
+        for key, d_x, d_y in [
+                ('Left', -1, 0), ('Right', 1, 0),
+                ('Up', 0, -1), ('Down', 0, 1)]:
+            self.canvas.bind('<KeyPress-%s>' % key, pan_command(d_x, d_y))
+
+        self.canvas.bind('<KeyPress-plus>', zoom_command(self.ZOOM_STEP))
+        self.canvas.bind('<KeyPress-equal>', zoom_command(self.ZOOM_STEP))
+        self.canvas.bind('<KeyPress-minus>', zoom_command(1 / self.ZOOM_STEP))
+        self.canvas.bind('<KeyPress-Home>', self.reset_view)
+
+        self.canvas.bind('<Configure>', self.resize_view)
+
+        # Start with the keyboard focus on the canvas, so that the
+        # keys work before the canvas has been clicked (clicking
+        # the canvas takes the focus back from the text entry)
+        #
+        self.canvas.focus_set()
+
+    def to_canvas(self, x_pos, y_pos):
+        """
+        Convert a point from board coordinates to canvas coordinates
+        """
+
+        return ((x_pos - self.view_x) * self.zoom,
+                self.canvas_height - (y_pos - self.view_y) * self.zoom)
+
+    def to_board(self, x_pos, y_pos):
+        """
+        Convert a point from canvas coordinates to board coordinates
+        """
+
+        return (self.view_x + x_pos / self.zoom,
+                self.view_y + (self.canvas_height - y_pos) / self.zoom)
+
+    def coords_to_canvas(self, coords):
+        """
+        Convert a flat list of board coordinates, of the form
+        [x0, y0, x1, y1, ...], to canvas coordinates
+        """
+
+        zoom = self.zoom
+        view_x = self.view_x
+        top = self.canvas_height + self.view_y * zoom
+
+        converted = list()
+        for ind in range(0, len(coords), 2):
+            converted.append((coords[ind] - view_x) * zoom)
+            converted.append(top - coords[ind + 1] * zoom)
+        return converted
+
+    def view_rect(self, margin=0):
+        """
+        Return the rectangle of the board that is visible on the
+        canvas, as (x0, y0, x1, y1) in board coordinates, extended
+        on each side by margin times the size of the view
+        """
+
+        width = self.canvas_width / self.zoom
+        height = self.canvas_height / self.zoom
+
+        return (self.view_x - margin * width,
+                self.view_y - margin * height,
+                self.view_x + (1 + margin) * width,
+                self.view_y + (1 + margin) * height)
+
+    @staticmethod
+    def overlaps(bbox, rect):
+        """
+        Return True if the bbox overlaps the rect, and False otherwise
+        """
+
+        return (bbox[0] <= rect[2] and rect[0] <= bbox[2] and
+                bbox[1] <= rect[3] and rect[1] <= bbox[3])
+
+    def text_extent(self, text, font_des):
+        """
+        Return the (width, height) of a text block drawn
+        in the given font, in pixels
+        """
+
+        font = self.fonts.get(font_des)
+        if font is None:
+            font = tkinter.font.Font(root=self.win, font=font_des)
+            self.fonts[font_des] = font
+
+        lines = text.split('\n')
+        width = max([font.measure(line) for line in lines])
+        return width, font.metrics('linespace') * len(lines)
+
+    def is_busy(self, viob_id):
+        """
+        Return True if the user is drawing or dragging the object,
+        in which case its item must not be moved or removed from the
+        canvas to match the model
+        """
+
+        return (viob_id == self.stylus.viob_id or
+                self.viob_id2item.get(viob_id) == self.dragging_item)
+
+    def model_changed(self, change, viob_id):
+        """
+        Listener for changes to the model
+
+        Removed objects are removed from the canvas right away, but
+        other changes are only noted here, and applied to the canvas
+        by flush (which is called after each batch of messages from
+        the remote, or when Tk is idle), so that the canvas is only
+        updated once for any number of changes to an object.
+        """
+
+        if change == SnoodsBoardModel.CLEARED:
+            self.clear_canvas()
+            self.win.title('snoods - %s' % self.model.board_id)
+        elif change == SnoodsBoardModel.REMOVED:
+            self.dirty.pop(viob_id, None)
+            self.dematerialize(viob_id)
+        else:
+            self.dirty[viob_id] = change
+            if not self.flush_scheduled:
+                self.flush_scheduled = True
+                self.canvas.after_idle(self.flush)
+
+    def flush(self):
+        """
+        Update the canvas to match the objects in the model that
+        have changed since the last flush
+
+        Objects that have moved near the view are drawn, and objects
+        that have moved far from the view are removed from the canvas.
+        """
+
+        self.flush_scheduled = False
+
+        dirty = self.dirty
+        if not dirty:
+            return
+        self.dirty = dict()
+
+        objects = self.model.objects
+        near = self.view_rect(self.VIEW_MARGIN)
+        keep = self.view_rect(2 * self.VIEW_MARGIN)
+
+        new_ids = list()
+        for viob_id in dirty:
+            obj = objects.get(viob_id)
+            if obj is None:
+                continue
+
+            item = self.viob_id2item.get(viob_id)
+            if item is None:
+                if self.overlaps(obj.bbox, near):
+                    new_ids.append(viob_id)
+            elif self.is_busy(viob_id):
+                self.canvas.itemconfig(item, {'fill': obj.color})
+            elif not self.overlaps(obj.bbox, keep):
+                self.dematerialize(viob_id)
+            else:
+                self.canvas.coords(item, self.coords_to_canvas(obj.coords))
+                self.canvas.itemconfig(item, {'fill': obj.color})
+
+        if new_ids:
+            new_ids.sort(key=self.model.spatial.order.__getitem__)
+            self.materialize_all(new_ids)
+
+    def clear_canvas(self):
+        """
+        Remove every item from the canvas
+        """
+
+        self.canvas.delete('all')
+        self.item2viob_id = dict()
+        self.viob_id2item = dict()
+        self.dirty = dict()
+        self.selected = list()
+        self.rubber_band = None
+
     def register_obj(self, item, viob_id):
         """
         Associate a given viob_id and item
 
         Objects are referenced at the protocol level by viob_id,
-        but locally, for tkinter, each object has an item identifier
-        (which may be a group identifier for a grouped object)
-        that must be used as the object name for Tk operations
+        but locally, for tkinter, each object that is drawn on the
+        canvas has an item identifier that must be used as the
+        object name for Tk operations
         """
 
-        # TODO: check that there's not already a mapping!
         self.viob_id2item[viob_id] = item
         self.item2viob_id[item] = viob_id
 
+    def materialize(self, viob_id, obj):
+        """
+        Create the canvas item for an object, on top of the stack
+        """
+
+        coords = self.coords_to_canvas(obj.coords)
+
+        if obj.kind == SnoodsBoardObj.RECT:
+            item = self.canvas.create_rectangle(
+                    coords, fill=obj.color, tag='moveable')
+        elif obj.kind == SnoodsBoardObj.TEXT:
+            face, size, weight = obj.font
+            item = self.create_text_widget(
+                    coords[0], coords[1], obj.text, obj.color,
+                    (face, max(1, int(round(size * self.zoom))), weight))
+        else:
+            item = self.stylus.create_line(
+                    coords, obj.color, max(1, obj.width * self.zoom))
+
+        self.register_obj(item, viob_id)
+
+    def materialize_all(self, viob_ids):
+        """
+        Create the canvas items for the objects in viob_ids (in
+        stacking order, from the bottom up) that don't have items,
+        and put them in their places in the stack
+        """
+
+        new_ids = [viob_id for viob_id in viob_ids
+                   if viob_id not in self.viob_id2item]
+        if not new_ids:
+            return
+
+        # The stacking order of the items that are already on the
+        # canvas; each new item goes just below the lowest of these
+        # that is above it, if there is one
+        #
+        order = self.model.spatial.order
+        old_ids = sorted(self.viob_id2item, key=order.__getitem__)
+        old_order = [order[viob_id] for viob_id in old_ids]
+
+        objects = self.model.objects
+        for viob_id in new_ids:
+            self.materialize(viob_id, objects[viob_id])
+
+            above = bisect.bisect(old_order, order[viob_id])
+            if above < len(old_ids):
+                self.canvas.tag_lower(
+                        self.viob_id2item[viob_id],
+                        self.viob_id2item[old_ids[above]])
+
+    def dematerialize(self, viob_id):
+        """
+        Remove the canvas item for an object, if it has one
+        """
+
+        item = self.viob_id2item.pop(viob_id, None)
+        if item is None:
+            return
+
+        del self.item2viob_id[item]
+        self.canvas.delete(item)
+
+    def refresh_view(self):
+        """
+        Remove the items that are far from the view from the canvas,
+        and draw the objects that are near the view
+        """
+
+        keep = self.view_rect(2 * self.VIEW_MARGIN)
+        objects = self.model.objects
+        for viob_id in list(self.viob_id2item):
+            obj = objects.get(viob_id)
+            if obj is None:
+                # an item for a drawing that hasn't been added yet
+                continue
+
+            if not self.overlaps(obj.bbox, keep) and not self.is_busy(viob_id):
+                self.dematerialize(viob_id)
+
+        self.materialize_all(
+                self.model.objects_in_rect(*self.view_rect(self.VIEW_MARGIN)))
+
+    def redraw(self):
+        """
+        Remove every item from the canvas, and draw the objects
+        near the view from scratch
+        """
+
+        self.clear_canvas()
+        self.refresh_view()
+
+    def pan(self, d_x, d_y):
+        """
+        Move the view by (d_x, d_y) canvas pixels
+        """
+
+        self.view_x += d_x / self.zoom
+        self.view_y -= d_y / self.zoom
+        self.canvas.move('all', -d_x, -d_y)
+
+        self.refresh_view()
+
+    def zoom_at(self, x_pos, y_pos, factor):
+        """
+        Zoom the view by the given factor, keeping the point
+        at (x_pos, y_pos) on the canvas in the same place
+
+        Every item must be redrawn at the new scale, so this
+        is ignored while an object is being drawn or dragged.
+        """
+
+        if self.stylus.points is not None or self.dragging_item != -1:
+            return
+
+        zoom = min(max(self.zoom * factor, self.MIN_ZOOM), self.MAX_ZOOM)
+        if zoom == self.zoom:
+            return
+
+        b_x, b_y = self.to_board(x_pos, y_pos)
+        self.zoom = zoom
+        self.view_x = b_x - x_pos / zoom
+        self.view_y = b_y - (self.canvas_height - y_pos) / zoom
+
+        self.redraw()
+
+    def reset_view(self, _event=None):
+        """
+        Return the view to the lower left corner of the board,
+        at the original scale
+        """
+
+        if self.stylus.points is not None or self.dragging_item != -1:
+            return
+
+        self.view_x = 0
+        self.view_y = 0
+        self.zoom = 1.0
+
+        self.redraw()
+
+    def resize_view(self, event):
+        """
+        Callback for when the canvas changes size
+
+        The lower left corner of the view stays in the same place
+        on the board, so the items must move by the change in the
+        height of the canvas.
+        """
+
+        d_height = event.height - self.canvas_height
+        self.canvas_width = event.width
+        self.canvas_height = event.height
+
+        if d_height:
+            self.canvas.move('all', 0, d_height)
+
+        self.refresh_view()
+
+    def pick(self, x_pos, y_pos):
+        """
+        Return the topmost item at (or within PICK_HALO of) the
+        given point on the canvas, or None if there isn't one
+        """
+
+        b_x, b_y = self.to_board(x_pos, y_pos)
+        for viob_id in self.model.objects_at(
+                b_x, b_y, self.PICK_HALO / self.zoom):
+            item = self.viob_id2item.get(viob_id)
+            if item is not None:
+                return item
+
+        return None
+
+    def pick_item(self, event):
+        """
+        Return the item that the user clicked on in the event
+
+        If the model doesn't find anything (which can happen if the
+        event is for an item that isn't in the model yet, like a
+        drawing that hasn't been sent yet), then the canvas finds
+        the closest item instead.
+        """
+
+        item = self.pick(event.x, event.y)
+        if item is None:
+            item = self.canvas.find_closest(event.x, event.y)[0]
+
+        return item
+
+    def objects_in_rect(self, x0, y0, x1, y1):
+        """
+        Return a list of the viob_ids of the objects whose bounding
+        boxes overlap the given rectangle of the canvas, from the
+        bottom of the stack up
+        """
+
+        b_x0, b_y0 = self.to_board(x0, y0)
+        b_x1, b_y1 = self.to_board(x1, y1)
+
+        return self.model.objects_in_rect(b_x0, b_y0, b_x1, b_y1)
+
+    def objects_in_view(self):
+        """
+        Return a list of the viob_ids of the objects that may be
+        visible in the canvas window, from the bottom of the stack up
+        """
+
+        return self.model.objects_in_rect(*self.view_rect())
+
+    def select_mouse_mode(self):
+        """
+        Set the callbacks for selecting objects by dragging out a
+        rectangle (starting from an empty part of the canvas) with
+        the left mouse button, and for erasing the selected objects
+        with the Delete or BackSpace keys
+        """
+
+        self.canvas.bind('<ButtonPress-1>', self.select_mouse_down)
+        self.canvas.bind('<B1-Motion>', self.select_mouse_move)
+        self.canvas.bind('<ButtonRelease-1>', self.select_mouse_release)
+        self.canvas.bind('<KeyPress-Delete>', self.erase_selected)
+        self.canvas.bind('<KeyPress-BackSpace>', self.erase_selected)
+
+    def select_mouse_down(self, event):
+        """
+        Callback to start selecting objects
+
+        Clicking anywhere clears the selection.  Clicking on an object
+        is handled by the callbacks for the object, so a new selection
+        only begins if the click isn't on an object.
+        """
+
+        # A canvas doesn't take the keyboard focus when it's
+        # clicked, and the key bindings for the canvas only fire
+        # when it has the focus, so take the focus here
+        #
+        self.canvas.focus_set()
+
+        self.clear_selection()
+
+        if self.pick(event.x, event.y) is not None:
+            return
+
+        self.rubber_start = (event.x, event.y)
+        self.rubber_band = self.canvas.create_rectangle(
+                event.x, event.y, event.x, event.y,
+                outline='gray', dash=(4, 4))
+
+    def select_mouse_move(self, event):
+        """
+        Callback to stretch the selection rectangle
+        """
+
+        if self.rubber_band is None:
+            return
+
+        self.canvas.coords(
+                self.rubber_band,
+                self.rubber_start[0], self.rubber_start[1],
+                event.x, event.y)
+
+    def select_mouse_release(self, event):
+        """
+        Callback to select the objects that overlap the
+        selection rectangle, and outline them
+        """
+
+        if self.rubber_band is None:
+            return
+
+        self.canvas.delete(self.rubber_band)
+        self.rubber_band = None
+
+        self.selected = self.objects_in_rect(
+                self.rubber_start[0], self.rubber_start[1],
+                event.x, event.y)
+
+        for viob_id in self.selected:
+            x0, y0, x1, y1 = self.model.objects[viob_id].bbox
+            x0, y0 = self.to_canvas(x0, y0)
+            x1, y1 = self.to_canvas(x1, y1)
+            self.canvas.create_rectangle(
+                    x0, y0, x1, y1,
+                    outline='gray', dash=(2, 2), tags=('selection',))
+
+    def clear_selection(self):
+        """
+        Clear the selection, and the outlines of the selected objects
+        """
+
+        self.selected = list()
+        self.canvas.delete('selection')
+
+    def erase_selected(self, _event):
+        """
+        Callback to erase the selected objects
+        """
+
+        if self.viobc:
+            for viob_id in self.selected:
+                self.viobc.push_erase(viob_id)
+
+        self.clear_selection()
+
     def create_rect(
             self, ll_x, ll_y, ur_x, ur_y, viob_id,
             bg_color=None, remote=False):
@@ -611,17 +1377,17 @@ class SnoodsDrawableTk(object):
         if not bg_color:
             bg_color = self.active_color[0]
 
-        item = self.canvas.create_rectangle(
-                ll_x, self.flip_y(ll_y),
-                ur_x, self.flip_y(ur_y),
-                fill=bg_color, tag='moveable')
-        self.register_obj(item, viob_id)
+        self.model.add_object(
+                viob_id,
+                SnoodsBoardObj(
+                    SnoodsBoardObj.RECT, [ll_x, ll_y, ur_x, ur_y], bg_color))
+        self.flush()
 
         if not remote and self.viobc:
             self.viobc.push_create_rect(
                     viob_id, ll_x, ll_y, ur_x, ur_y, bg_color)
 
-        return item
+        return self.viob_id2item.get(viob_id)
 
     def create_text(
             self, ll_x, ll_y, text, viob_id,
@@ -642,17 +1408,19 @@ class SnoodsDrawableTk(object):
         if not weight:
             weight = self.font_weight
 
-        font_des = (font, size, weight)
-        item = self.create_text_widget(
-                ll_x, self.flip_y(ll_y), text, fg_color, font_des)
+        self.model.add_object(
+                viob_id,
+                SnoodsBoardObj(
+                    SnoodsBoardObj.TEXT, [ll_x, ll_y], fg_color,
+                    text=text, font=(font, int(size), weight)))
+        self.flush()
 
-        self.register_obj(item, viob_id)
         if not remote and self.viobc:
             self.viobc.push_create_text(
                     viob_id, ll_x, ll_y, text,
                     fg_color, font, size, weight)
 
-        return item
+        return self.viob_id2item.get(viob_id)
 
     def create_text_widget(
             self, ll_x, ll_y, text, fill_color, font_des):
@@ -667,127 +1435,160 @@ class SnoodsDrawableTk(object):
                 fill=fill_color, font=font_des,
                 anchor=tk.SW, tag='moveable')
 
-    def apply_join(self, command, board_id):
+    def prepare_msg(self, msg):
         """
-        Join a whiteboard
-
-        If there's anything on the default whiteboard (or any
-        other previous whiteboard) then we need to erase it
-        when we join a new whiteboard.  Otherwise our view
-        may be inconsistent with other viewers.
+        Convert a message from the remote into an operation to
+        apply, of the form (method, args), or None if the message
+        should be ignored
+
+        The model does all of the work that doesn't depend on the
+        state of the model (converting the fields, and decoding the
+        points of freehand drawings) when it prepares the message,
+        so that it can be done on the client's thread instead of
+        the Tk thread.  Position updates are applied by the drawable,
+        because they may be for the object that is being dragged.
         """
 
-        self.canvas.delete('all')
-        self.win.title('snoods - %s' % board_id)
+        operation = self.model.prepare_msg(msg)
+        if operation and operation[0] == self.model.apply_posupd:
+            operation = (self.apply_posupd, operation[1])
 
-    def apply_erase(self, command, viob_id):
+        return operation
+
+    def post_msg(self, msg):
         """
-        Erase a viob_id
+        Prepare a message from the remote and add it to the
+        queue of operations for the Tk thread to apply
+
+        Unlike the other methods, this may be called from any thread.
         """
 
-        if viob_id not in self.viob_id2item:
-            # TODO log the error
+        operation = self.prepare_msg(msg)
+        if not operation:
             return
 
-        item = self.viob_id2item[viob_id]
-        self.canvas.delete(item)
+        # A join starts over with an empty canvas, so there's
+        # no point in applying anything that came before it.  The
+        # queue is shared with the Tk thread, so instead of removing
+        # those operations here, drain_ops skips them.
+        #
+        if operation[0] == self.model.apply_join:
+            self.posted_joins += 1
+
+        self.post_op(*operation)
 
-    def apply_colupd(self, command, viob_id, color):
+    def post_op(self, method, args):
         """
-        Apply a color update
+        Add an operation to the queue for the Tk thread to
+        apply, and wake up the Tk thread, if necessary
+
+        This may be called from any thread.
         """
 
-        if viob_id not in self.viob_id2item:
-            # TODO log the error
-            return
+        self.pending_ops.append((method, args, self.posted_joins))
 
-        item = self.viob_id2item[viob_id]
-        self.canvas.itemconfig(item, {'fill': color})
+        if self.wakeup_w is not None and not self.wakeup_pending:
+            self.wakeup_pending = True
+            os.write(self.wakeup_w, b'!')
 
-    def apply_posupd(self, command, viob_id, ll_x, ll_y, ur_x, ur_y):
+    def wakeup(self, wakeup_r, _mask):
         """
-        Apply a position update
+        Callback for when the wakeup pipe is readable
         """
 
-        if viob_id not in self.viob_id2item:
-            # TODO log the error
-            return
+        os.read(wakeup_r, 4096)
+        self.wakeup_pending = False
 
-        item = self.viob_id2item[viob_id]
-        llx = int(ll_x)
-        flip_lly = self.flip_y(int(ll_y))
-        urx = int(ur_x)
-        flip_ury = self.flip_y(int(ur_y))
-
-        # How we move an item depends on what type
-        # of item it is
-        #
-        item_type = self.canvas.type(item)
-        if item_type == 'rectangle':
-            self.canvas.coords(item, llx, flip_lly, urx, flip_ury)
-        elif item_type == 'text':
-            self.canvas.coords(item, llx, flip_lly)
-        elif item_type == 'line':
-            # lines are tricky because it's likely to be a group
-            # of lines, rather than a single line.  So instead of
-            # just changing the coordinates of the line, we need
-            # to find the bounding box of the set of lines, and
-            # then the delta between the current coordinates and
-            # the desired coordinates, and then move all the lines
-            # by that amount.
-
-            # Note the funny-looking order, because the canvas
-            # is "upside down" in our coordinate system
-            #
-            cllx, _cury, _curx, clly = self.canvas.bbox(item)
-            self.canvas.move(item, llx - cllx, flip_lly - clly)
+        if not self.drain_scheduled:
+            self.drain_ops()
 
-    def apply_newrec(
-            self, command, viob_id, ll_x, ll_y, ur_x, ur_y, color):
+    def apply_msg(self, msg):
         """
-        Apply a new rectangle creation
-        """
-
-        if viob_id in self.viob_id2item:
-            # TODO log the error
-            return
+        Apply a message from the remote immediately
 
-        llx = int(ll_x)
-        lly = int(ll_y)
-        urx = int(ur_x)
-        ury = int(ur_y)
+        This must only be called from the Tk thread.
+        """
 
-        self.create_rect(
-                llx, lly, urx, ury, viob_id,
-                bg_color=color, remote=True)
+        operation = self.prepare_msg(msg)
+        if operation:
+            operation[0](*operation[1])
+            self.flush()
 
-    def apply_newtxt(
-            self, command, viob_id, ll_x, ll_y, text,
-            color, font, size, weight):
+    def drain_ops(self):
         """
-        Apply a new text block creation
+        Apply the pending operations, for at most DRAIN_BUDGET
+        seconds, update the canvas to match, and then schedule the
+        next call, if necessary
+
+        If operations remain, then the next call is scheduled
+        as soon as Tk has had a chance to redraw and handle any
+        input, so that the UI stays responsive while a large
+        board is loading.
         """
 
-        if viob_id in self.viob_id2item:
-            # we already have this viob; no need to create it
-            return
+        self.drain_scheduled = False
+
+        pending_ops = self.pending_ops
+        deadline = time.perf_counter() + self.DRAIN_BUDGET
+
+        # Check the time only every few operations; most
+        # operations take far less time than the check
+        #
+        while pending_ops:
+            for _ in range(32):
+                try:
+                    method, args, n_joins = pending_ops.popleft()
+                except IndexError as _exc:
+                    break
+
+                if n_joins == self.posted_joins:
+                    method(*args)
+
+            if time.perf_counter() > deadline:
+                break
 
-        llx = int(ll_x)
-        lly = int(ll_y)
+        self.flush()
 
-        self.create_text(
-                llx, lly, text, viob_id,
-                fg_color=color, font=font, size=size, weight=weight,
-                remote=True)
+        if pending_ops:
+            self.drain_scheduled = True
+            self.canvas.after(1, self.drain_ops)
+        elif self.wakeup_w is None:
+            self.drain_scheduled = True
+            self.canvas.after(self.DRAIN_INTERVAL, self.drain_ops)
 
-    def apply_newfre(self, command, viob_id, point_str, lwidth, color):
+    def apply_posupd(self, viob_id, ll_x, ll_y, ur_x, ur_y):
         """
-        Apply a new "freehand" drawing creating
+        Apply a position update
         """
 
-        if viob_id in self.viob_id2item:
+        # If we're dragging this object, then this is most likely
+        # the return of one of the updates we sent while dragging
+        # it, which is behind where the object is now, so don't
+        # move it back, but send the next update if necessary
+        #
+        item = self.viob_id2item.get(viob_id)
+        if item is not None and item == self.dragging_item:
+            self.drag_in_flight = False
+            if self.drag_moved:
+                self.schedule_drag_update()
             return
-        self.stylus.apply_newfre(viob_id, point_str, lwidth, color)
+
+        # After the drag has ended, the updates sent during the drag
+        # may still be on their way back from the server, and they
+        # would move the object back to where it was before the end
+        # of the drag, so ignore them until the final position
+        # returns.  (Updates from other clients are applied as usual,
+        # and the server relays them in the order it receives them.)
+        #
+        echoes = self.drag_echoes.get(viob_id)
+        if echoes is not None:
+            bbox = (int(ll_x), int(ll_y), int(ur_x), int(ur_y))
+            if bbox == echoes[0]:
+                del self.drag_echoes[viob_id]
+            elif bbox in echoes[1]:
+                return
+
+        self.model.apply_posupd(viob_id, ll_x, ll_y, ur_x, ur_y)
 
     def color_mouse_down(self, event):
         """
@@ -799,14 +1600,15 @@ class SnoodsDrawableTk(object):
         it appears to do nothing
         """
 
-        item = self.canvas.find_closest(event.x, event.y)[0]
-        item_group = self.get_item_group(item)
-        self.canvas.itemconfig(
-                item_group, {'fill': self.active_color[0]})
+        item_group = self.pick_item(event)
+        viob_id = self.item2viob_id.get(item_group)
+        if viob_id is None:
+            return
+
+        self.model.set_color(viob_id, self.active_color[0])
 
         if self.viobc:
-            self.viobc.push_color_update(
-                    self.item2viob_id[item_group], self.active_color[0])
+            self.viobc.push_color_update(viob_id, self.active_color[0])
 
     def color_mouse_release(self, event):
         """
@@ -823,15 +1625,14 @@ class SnoodsDrawableTk(object):
         Callback for the movement-by-dragging action
         """
 
-        item = self.canvas.find_closest(event.x, event.y)[0]
-        item_type = self.canvas.type(item)
+        item = self.pick_item(event)
 
-        if item_type in ['line', 'rectangle', 'text']:
+        if item in self.item2viob_id:
             event.widget.bind(
                     '<Motion>',
                     self.make_obj_mover(self.canvas, item, event))
         else:
-            print('mouse_down unhandled [%s]' % item_type)
+            print('mouse_down unhandled [%s]' % self.canvas.type(item))
 
     def drag_mouse_release(self, event):
         """
@@ -843,73 +1644,143 @@ class SnoodsDrawableTk(object):
         to the original position) in order to avoid a race condition
         if more than one user is dragging the object at the same
         time
+
+        The final position is always sent, even if it has already
+        been sent while the object was being dragged.
         """
 
         event.widget.unbind('<Motion>')
         item = self.dragging_item
+        viob_id = self.sync_drag()
         self.dragging_item = -1
 
-        if item == -1:
+        if self.drag_timer is not None:
+            self.canvas.after_cancel(self.drag_timer)
+            self.drag_timer = None
+        self.drag_moved = False
+        self.drag_in_flight = False
+
+        if item == -1 or viob_id is None:
             return
 
-        # depending on the type of the object, the extent of the
-        # current bounding box is calculated differently, so when
-        # we need to caclulate the new position, we need to fudge
-        # the bounding box so that the result is exactly what we
-        # use in our calculation
-        #
-        item_type = self.canvas.type(item)
-        if item_type == 'rectangle':
-            x_fudge, y_fudge = 1, 1
-        elif item_type == 'text':
-            x_fudge, y_fudge = 1, 0
-        elif item_type == 'line':
-            x_fudge, y_fudge = -1, -1
-        else:
-            x_fudge, y_fudge = 0, 0
+        final_bbox = self.push_position(viob_id)
 
-        # NOTE: This looks mixed up, but it's because the tkinter
-        # canvas coordinate system is upside-down and we want them
-        # right side up.
-        #
-        ll_x, ur_y, ur_x, ll_y = self.canvas.bbox(item)
+        echoes = self.drag_echoes.get(viob_id)
+        if echoes is not None:
+            if self.viobc and echoes[1]:
+                echoes[0] = final_bbox
+            else:
+                del self.drag_echoes[viob_id]
+
+    def sync_drag(self):
+        """
+        Move the object being dragged, on the board, by however far
+        its item has been dragged on the canvas, and return its
+        viob_id (or None if it has been erased)
 
-        # Add the fudge factors
+        The object is moved by a whole number of board pixels, and
+        the remainder is kept for the next call.
+        """
+
+        viob_id = self.item2viob_id.get(self.dragging_item)
+        if viob_id is None:
+            return None
+
+        d_x = int(round(self.drag_dx / self.zoom))
+        d_y = int(round(self.drag_dy / self.zoom))
+        self.drag_dx -= d_x * self.zoom
+        self.drag_dy -= d_y * self.zoom
+
+        # The canvas is "upside down" in our coordinate system
         #
-        ll_x += x_fudge
-        ll_y = self.flip_y(ll_y - y_fudge)
-        ur_x -= x_fudge
-        ur_y = self.flip_y(ur_y + y_fudge)
+        self.model.translate_object(viob_id, d_x, -d_y)
+
+        return viob_id
 
-        # print('item %s viob_id %s moved to %d %d %d %d' %
-        #         ( str(item), self.item2viob_id[item],
-        #             ll_x, ll_y, ur_x, ur_y))
+    def push_position(self, viob_id):
+        """
+        Push the current position of an object to the remote,
+        if there is one, and return the position (as integers)
+
+        The position is the bounding box of the object, which for
+        a rectangle is the rectangle itself, and for a text block
+        begins at the lower left corner of the text.
+        """
+
+        ll_x, ll_y, ur_x, ur_y = self.model.objects[viob_id].bbox
 
         if self.viobc:
             self.viobc.push_position_update(
-                    self.item2viob_id[item], ll_x, ll_y, ur_x, ur_y)
-            pass
+                    viob_id, ll_x, ll_y, ur_x, ur_y)
+
+        return (int(ll_x), int(ll_y), int(ur_x), int(ur_y))
+
+    def schedule_drag_update(self):
+        """
+        Schedule a call to send_drag_update for the object being
+        dragged, unless one is already scheduled, or the previous
+        update hasn't returned from the server yet
+
+        Updates are sent at most drag_rate times per second, and
+        the position is taken when the update is sent, so all the
+        movements between updates are coalesced into one update.
+        """
+
+        if not self.drag_rate or self.drag_timer is not None:
+            return
+
+        now = time.perf_counter()
+        if (self.drag_in_flight and
+                now - self.drag_sent_time < self.DRAG_FLIGHT_TIMEOUT):
+            return
+
+        delay = max(0, self.drag_sent_time + 1.0 / self.drag_rate - now)
+        self.drag_timer = self.canvas.after(
+                int(delay * 1000), self.send_drag_update)
+
+    def send_drag_update(self):
+        """
+        Send the current position of the object being dragged
+        """
+
+        self.drag_timer = None
+
+        if self.dragging_item == -1 or not self.drag_moved:
+            return
+
+        viob_id = self.sync_drag()
+        if viob_id is None:
+            return
+
+        bbox = self.push_position(viob_id)
+        self.drag_echoes.setdefault(viob_id, [None, set()])[1].add(bbox)
+
+        self.drag_moved = False
+        self.drag_sent_time = time.perf_counter()
+        self.drag_in_flight = bool(self.viobc)
 
     def make_obj_mover(self, canvas, item, down_event):
 
         item_group = self.get_item_group(item)
         self.dragging_item = item_group
+        self.drag_dx = 0
+        self.drag_dy = 0
+        self.drag_echoes[self.item2viob_id[item_group]] = [None, set()]
         prev = Point(down_event.x, down_event.y)
 
         def mover(event):
-            event.widget.move(
-                    item_group, event.x - prev.x_pos, event.y - prev.y_pos)
+            d_x = event.x - prev.x_pos
+            d_y = event.y - prev.y_pos
+            event.widget.move(item_group, d_x, d_y)
             prev.x_pos, prev.y_pos = event.x, event.y
 
-        return mover
+            self.drag_dx += d_x
+            self.drag_dy += d_y
 
-    def flip_y(self, y_pos):
-        """
-        Flip the coordinate system so that the lower-left of the canvas
-        is 0,0, instead of the upper-left
-        """
+            self.drag_moved = True
+            self.schedule_drag_update()
 
-        return self.canvas_height - y_pos
+        return mover
 
     def main(self):
         """
@@ -918,4 +1789,12 @@ class SnoodsDrawableTk(object):
         Does not return until the UI is shut down
         """
 
+        # Tk can only watch file descriptors on POSIX platforms
+        #
+        if hasattr(self.win.tk, 'createfilehandler'):
+            wakeup_r, self.wakeup_w = os.pipe()
+            self.win.tk.createfilehandler(
+                    wakeup_r, tk.READABLE, self.wakeup)
+
+        self.drain_ops()
         tk.mainloop()
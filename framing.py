@@ -0,0 +1,447 @@
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Incremental framing of a stream of messages
+
+The messages of the text protocol are separated by newlines, and
+the messages of the binary protocol are each prefixed with their
+length, encoded as a varint.
+
+A SnoodsFramer reads from a socket directly into a single growable
+buffer, and finds the message boundaries in the new data only: it
+remembers how far it has already searched, so a long message that
+arrives in many pieces (such as the replay of a large board, or
+a long freehand stroke) is scanned once, and the buffer is never
+copied except to make room for more input.  A SnoodsBinaryFramer
+does the same for length-prefixed messages.
+
+The buffer starts out small, so that the many connections that
+only send an occasional short message don't each hold a large
+buffer, and the amount read by each recv grows (up to recv_size)
+while the peer keeps filling it.
+
+No message may be longer than the framer's max_msg_len, so that
+a peer can't make the framer buffer an unlimited amount of input
+by never finishing a message (or by sending a huge length prefix).
+Input that breaks the rules of the framing raises a
+SnoodsProtocolError, after which the connection can't be trusted
+and should be closed.
+"""
+
+
+class SnoodsProtocolError(ValueError):
+    """
+    Raised when the input from a peer isn't a valid
+    message (or stream of messages)
+    """
+
+
+def encode_varint(value, out):
+    """
+    Append the varint encoding of the non-negative integer
+    value to the bytearray out
+
+    Each byte holds seven bits of the value, starting with
+    the least significant, and the high bit of each byte is
+    set if there are more bytes to follow.
+    """
+
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varint(buf, pos):
+    """
+    Decode the varint that starts at offset pos of buf, and
+    return the value and the offset of the next byte
+
+    Raises IndexError if buf ends before the varint does.
+    """
+
+    byte = buf[pos]
+    if byte < 0x80:
+        return byte, pos + 1
+
+    value = byte & 0x7f
+    shift = 7
+    while True:
+        pos += 1
+        byte = buf[pos]
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos + 1
+        shift += 7
+
+
+class SnoodsFramer(object):
+    """
+    Splits the input from a stream socket into messages
+
+    The messages are returned as memoryview slices of the
+    framer's buffer, without copying them.  A slice is only
+    valid until the next call to recv() or feed(), because the
+    buffer may be reused after that, so the caller must copy
+    (e.g. with bytes()) any message it wants to keep.
+    """
+
+    DEFAULT_RECV_SIZE = 64 * 1024
+
+    # The size of the first buffer, and the least that each
+    # recv asks for
+    #
+    MIN_RECV_SIZE = 4 * 1024
+
+    # The longest message that may be received; the longest
+    # messages are freehand drawings, and this is room for
+    # several hundred thousand points
+    #
+    DEFAULT_MAX_MSG_LEN = 1024 * 1024
+
+    def __init__(
+            self, recsep=b'\n', recv_size=DEFAULT_RECV_SIZE,
+            max_msg_len=DEFAULT_MAX_MSG_LEN):
+
+        self.recsep = recsep
+        self.recv_size = recv_size
+        self.max_msg_len = max_msg_len
+
+        # How much to ask for in the next recv; this doubles each
+        # time a recv fills the space it was given, and shrinks
+        # again when the recvs are mostly empty
+        #
+        self.recv_chunk = min(self.MIN_RECV_SIZE, recv_size)
+
+        self.buf = bytearray(self.recv_chunk)
+        self.view = memoryview(self.buf)
+
+        # The unconsumed input is self.buf[self.start:self.end],
+        # and there is no recsep in self.buf[self.start:self.scan]
+        #
+        self.start = 0
+        self.scan = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def reserve(self, n_bytes):
+        """
+        Make sure that there is room for at least n_bytes
+        after the end of the unconsumed input
+        """
+
+        n_pending = self.end - self.start
+
+        # If everything has been consumed, start over at the
+        # beginning of the buffer, and give back the memory if
+        # the buffer grew to hold a very large message
+        #
+        if not n_pending:
+            self.start = self.scan = self.end = 0
+            if len(self.buf) > 4 * max(self.recv_chunk, n_bytes):
+                self.buf = bytearray(max(self.recv_chunk, n_bytes))
+                self.view = memoryview(self.buf)
+
+        if self.end + n_bytes <= len(self.buf):
+            return
+
+        if n_pending + n_bytes <= len(self.buf):
+            # slide the unconsumed input down to the start
+            # of the buffer
+            #
+            self.view[:n_pending] = self.view[self.start:self.end]
+        else:
+            # Replace the buffer with one that's (at least) twice
+            # as large, so that the total cost of growing it is
+            # linear.  A new buffer is always allocated (rather
+            # than extending the old one) so that any slices of
+            # the old buffer the caller is still holding don't
+            # prevent it from being resized.
+            #
+            new_len = max(2 * len(self.buf), n_pending + n_bytes)
+            new_buf = bytearray(new_len)
+            new_buf[:n_pending] = self.view[self.start:self.end]
+            self.buf = new_buf
+            self.view = memoryview(new_buf)
+
+        self.scan -= self.start
+        self.start = 0
+        self.end = n_pending
+
+    def recv(self, sock):
+        """
+        Read whatever input is available from sock into the buffer
+        (with a single recv_into call) and return the number of
+        bytes read, which is 0 if the other end has closed the
+        connection
+
+        Any exception raised by recv_into is passed to the caller
+        """
+
+        recv_chunk = self.recv_chunk
+        self.reserve(recv_chunk)
+
+        n_read = sock.recv_into(self.view[self.end:self.end + recv_chunk])
+        self.end += n_read
+
+        if n_read == recv_chunk:
+            self.recv_chunk = min(2 * recv_chunk, self.recv_size)
+        elif n_read < recv_chunk // 4:
+            self.recv_chunk = max(recv_chunk // 2, self.MIN_RECV_SIZE)
+
+        return n_read
+
+    def feed(self, data):
+        """
+        Add data to the input, as if it had been received
+        """
+
+        self.reserve(len(data))
+
+        n_bytes = len(data)
+        self.view[self.end:self.end + n_bytes] = data
+        self.end += n_bytes
+
+    def next_msg(self):
+        """
+        Return the next complete message (without its recsep) and
+        consume it, or return None if there is no complete message
+        """
+
+        ind = self.buf.find(self.recsep, self.scan, self.end)
+        if ind < 0:
+            self.check_partial()
+
+            # The recsep might be split between this input and
+            # the next, so back up a little
+            #
+            self.scan = max(self.start, self.end - len(self.recsep) + 1)
+            return None
+
+        msg = self.view[self.start:ind]
+        self.start = self.scan = ind + len(self.recsep)
+
+        return msg
+
+    def __iter__(self):
+        """
+        Consume and yield each of the complete messages
+
+        If the caller stops early, the remaining messages are
+        not consumed.
+        """
+
+        while True:
+            msg = self.next_msg()
+            if msg is None:
+                return
+            yield msg
+
+    def msgs(self):
+        """
+        Consume all of the complete messages, and return them
+        as a list of bytes
+
+        Unlike iterating over the framer, this copies the messages,
+        but it finds and copies all of them in a few calls, which
+        for small messages is much faster than creating a slice
+        for each message.
+        """
+
+        last = self.buf.rfind(self.recsep, self.scan, self.end)
+        if last < 0:
+            self.check_partial()
+            self.scan = max(self.start, self.end - len(self.recsep) + 1)
+            return list()
+
+        msgs = self.view[self.start:last].tobytes().split(self.recsep)
+        self.start = self.scan = last + len(self.recsep)
+
+        # Only the last message can be incomplete
+        #
+        self.check_partial()
+
+        return msgs
+
+    def check_partial(self):
+        """
+        Raise SnoodsProtocolError if the unconsumed input (which
+        must not contain a complete message) is already longer
+        than any message (and its length prefix, if any) may be
+        """
+
+        if self.end - self.start > self.max_msg_len + 10:
+            raise SnoodsProtocolError(
+                    'message longer than %d bytes' % self.max_msg_len)
+
+    def frame(self, msgs):
+        """
+        Return the bytes that would be split into msgs
+        """
+
+        return b''.join(msg + self.recsep for msg in msgs)
+
+    def split(self, data):
+        """
+        Return the list of messages in data, which must
+        contain only complete messages
+        """
+
+        return data.split(self.recsep)[:-1]
+
+    def frame_end(self, data, offset):
+        """
+        Return the offset of the end of the message in data
+        that contains the byte at offset
+        """
+
+        return data.find(self.recsep, offset) + len(self.recsep)
+
+    def take_remainder(self):
+        """
+        Consume all of the input (including any complete
+        messages), and return it as bytes
+        """
+
+        remainder = bytes(self.view[self.start:self.end])
+        self.start = self.scan = self.end
+
+        return remainder
+
+
+class SnoodsBinaryFramer(SnoodsFramer):
+    """
+    Splits the input from a stream socket into messages that
+    are each prefixed by their length (as a varint)
+
+    Other than how the messages are delimited, this behaves
+    the same as a SnoodsFramer.
+    """
+
+    def __init__(
+            self, recv_size=SnoodsFramer.DEFAULT_RECV_SIZE,
+            max_msg_len=SnoodsFramer.DEFAULT_MAX_MSG_LEN):
+
+        SnoodsFramer.__init__(self, b'', recv_size, max_msg_len)
+
+    def check_length(self, length, pos):
+        """
+        Raise SnoodsProtocolError if the length prefix of a
+        message (which ends at pos) is too large
+
+        A length prefix that hasn't been completely received yet
+        may appear to be too large, so it is only checked once
+        it is complete.
+        """
+
+        if length > self.max_msg_len and pos <= self.end:
+            raise SnoodsProtocolError(
+                    'message length %d is longer than %d bytes' % (
+                        length, self.max_msg_len))
+
+    def next_msg(self):
+
+        try:
+            length, pos = decode_varint(self.buf, self.start)
+        except IndexError as _exc:
+            self.check_partial()
+            return None
+
+        self.check_length(length, pos)
+        if pos > self.end or pos + length > self.end:
+            self.check_partial()
+            return None
+
+        msg = self.view[pos:pos + length]
+        self.start = self.scan = pos + length
+
+        return msg
+
+    def msgs(self):
+
+        buf = self.buf
+        view = self.view
+        start = self.start
+        end = self.end
+        max_msg_len = self.max_msg_len
+
+        msgs = list()
+        while start < end:
+            length = buf[start]
+            pos = start + 1
+            if length >= 0x80:
+                try:
+                    length, pos = decode_varint(buf, start)
+                except IndexError as _exc:
+                    break
+
+            if length > max_msg_len:
+                self.check_length(length, pos)
+
+            if pos + length > end:
+                break
+
+            msgs.append(view[pos:pos + length].tobytes())
+            start = pos + length
+
+        self.start = self.scan = start
+        self.check_partial()
+
+        return msgs
+
+    def frame(self, msgs):
+
+        out = bytearray()
+        for msg in msgs:
+            encode_varint(len(msg), out)
+            out += msg
+
+        return bytes(out)
+
+    def split(self, data):
+
+        msgs = list()
+        pos = 0
+        while pos < len(data):
+            length, pos = decode_varint(data, pos)
+            msgs.append(data[pos:pos + length])
+            pos += length
+
+        return msgs
+
+    def frame_end(self, data, offset):
+
+        pos = 0
+        while pos <= offset:
+            length, pos = decode_varint(data, pos)
+            pos += length
+
+        return pos
@@ -0,0 +1,121 @@
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Passing client connections between Snoods server processes
+
+When the server runs as several processes (see shard.py), a client
+connection sometimes has to be moved from one process to another:
+from the router to the worker that owns the client's board, or from
+a worker back to the router when the client joins a board owned by
+some other worker.
+
+A connection is handed off over a Unix-domain socket by sending
+the file descriptor of the client socket (via SCM_RIGHTS) along
+with a small header and any data that goes with the connection:
+input that has been received from the client but not yet processed,
+and output that must be sent to the client before anything else
+(the rest of a message that was only partly sent).
+
+Each handoff is framed as three 32-bit lengths (header, input, and
+output) followed by the JSON-encoded header, the input, and the
+output.  The file descriptor is attached to the first part.
+"""
+
+import json
+import socket
+import struct
+
+
+HANDOFF_PREFIX = struct.Struct('!III')
+
+
+def send_handoff(chan, sock, header, inbuf=b'', outbuf=b''):
+    """
+    Send the client socket sock, the header (a dictionary),
+    and the buffers inbuf and outbuf over the Unix-domain
+    socket chan
+
+    The caller should close sock after this returns; the
+    receiver gets its own copy of the file descriptor.
+    """
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    prefix = HANDOFF_PREFIX.pack(len(header_bytes), len(inbuf), len(outbuf))
+    data = prefix + header_bytes + inbuf + outbuf
+
+    n_sent = socket.send_fds(chan, [data], [sock.fileno()])
+    if n_sent < len(data):
+        chan.sendall(data[n_sent:])
+
+
+def recv_exactly(chan, n_bytes):
+    """
+    Read exactly n_bytes from chan, or raise ConnectionError
+    if the other end closes the socket first
+    """
+
+    chunks = list()
+    while n_bytes > 0:
+        chunk = chan.recv(n_bytes)
+        if not chunk:
+            raise ConnectionError('handoff channel closed')
+        chunks.append(chunk)
+        n_bytes -= len(chunk)
+
+    return b''.join(chunks)
+
+
+def recv_handoff(chan):
+    """
+    Receive a handoff sent by send_handoff over chan, and
+    return the client socket, the header, and the buffers
+
+    Raises ConnectionError if the channel has been closed
+    """
+
+    data, fds, _flags, _addr = socket.recv_fds(
+            chan, HANDOFF_PREFIX.size, 1)
+    if not data:
+        raise ConnectionError('handoff channel closed')
+    if not fds:
+        raise ConnectionError('handoff without a file descriptor')
+
+    if len(data) < HANDOFF_PREFIX.size:
+        data += recv_exactly(chan, HANDOFF_PREFIX.size - len(data))
+
+    header_len, in_len, out_len = HANDOFF_PREFIX.unpack(data)
+    body = recv_exactly(chan, header_len + in_len + out_len)
+
+    header = json.loads(body[:header_len].decode('utf-8'))
+    inbuf = body[header_len:header_len + in_len]
+    outbuf = body[header_len + in_len:]
+
+    sock = socket.socket(fileno=fds[0])
+
+    return sock, header, inbuf, outbuf
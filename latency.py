@@ -0,0 +1,134 @@
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+A histogram of latencies, for measuring how long it takes for
+an update to make the round trip from a client, through the
+server, and back to the canvas of the client
+"""
+
+import bisect
+
+
+class SnoodsLatencyHistogram(object):
+    """
+    A histogram of latencies (in seconds), with buckets whose
+    bounds grow geometrically, so that the relative error of
+    each bucket is the same whether the latencies are a fraction
+    of a millisecond or several seconds
+    """
+
+    # The upper bound (in seconds) of the smallest bucket, the
+    # ratio between the bounds of successive buckets, and the
+    # number of buckets.  Anything larger than the largest bound
+    # goes in an extra, unbounded, bucket.
+    #
+    MIN_BOUND = 0.0001
+    BOUND_RATIO = 1.25
+    N_BUCKETS = 64
+
+    def __init__(self):
+        self.bounds = [
+                self.MIN_BOUND * (self.BOUND_RATIO ** ind)
+                for ind in range(self.N_BUCKETS)]
+        self.counts = [0] * (self.N_BUCKETS + 1)
+
+        self.count = 0
+        self.total = 0.0
+        self.max_latency = 0.0
+
+    def record(self, latency):
+        """
+        Add a latency (in seconds) to the histogram
+        """
+
+        self.counts[bisect.bisect_left(self.bounds, latency)] += 1
+        self.count += 1
+        self.total += latency
+        if latency > self.max_latency:
+            self.max_latency = latency
+
+    def percentile(self, fraction):
+        """
+        Return the upper bound of the bucket that contains the
+        given fraction (from 0 to 1) of the latencies, or None
+        if there aren't any latencies yet
+
+        The result for the unbounded bucket is the largest
+        latency recorded.
+        """
+
+        if not self.count:
+            return None
+
+        wanted = fraction * self.count
+        seen = 0
+        for ind, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= wanted:
+                if ind < self.N_BUCKETS:
+                    return min(self.bounds[ind], self.max_latency)
+                break
+
+        return self.max_latency
+
+    def report(self):
+        """
+        Return a multi-line description of the histogram: a summary,
+        followed by a line for each non-empty bucket, showing its
+        upper bound (in milliseconds) and the number of latencies
+        in it
+        """
+
+        if not self.count:
+            return 'latency: no samples'
+
+        lines = list()
+        lines.append(
+                'latency: n %d mean %.2fms p50 %.2fms p90 %.2fms '
+                'p99 %.2fms max %.2fms' % (
+                    self.count, 1000 * self.total / self.count,
+                    1000 * self.percentile(0.5),
+                    1000 * self.percentile(0.9),
+                    1000 * self.percentile(0.99),
+                    1000 * self.max_latency))
+
+        widest = max(self.counts)
+        for ind, count in enumerate(self.counts):
+            if not count:
+                continue
+
+            if ind < self.N_BUCKETS:
+                label = '<= %.2fms' % (1000 * self.bounds[ind])
+            else:
+                label = '>  %.2fms' % (1000 * self.bounds[-1])
+
+            bar = '#' * max(1, int(40 * count / widest))
+            lines.append('%12s %8d %s' % (label, count, bar))
+
+        return '\n'.join(lines)
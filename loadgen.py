@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Synthetic load generator and latency benchmark for the server
+
+Spawns a server, connects N headless clients (each speaking the
+Snoods protocol through SnoodsProtocol) spread across M boards,
+and then has the clients send a configurable mix of new drawings,
+position updates, color updates, new text blocks, and erases, at
+a fixed total rate, for a fixed time.  Every client on a board
+(including the sender) receives every message sent to that board,
+and the time from when each message was due to be sent until each
+client receives it is measured.
+
+The messages are sent on a fixed schedule (rather than as fast
+as the server accepts them), and the latency is measured from
+when each message was scheduled to be sent, so that if the
+server (or the load generator) falls behind, the delay shows up
+in the latency instead of being hidden by sending less.
+
+For each combination of the number of clients and the rate,
+this reports the rate at which messages were sent, the rate at
+which they were delivered, the p50, p99, and p99.9 latency, the
+CPU time used by the server, and the number of clients that the
+server resynced (because they fell too far behind) and the number
+of deliveries that never arrived.  If --max_p99 is given, then
+the exit status is 1 if the p99 latency exceeds it for any run,
+so this can be used as a release gate.
+
+Everything runs on localhost.  Any arguments after -- are passed
+to the server.  (If the server is told to coalesce updates, then
+the updates that it drops are counted as lost, and the latencies
+of the updates that follow them are overstated.)
+"""
+
+import argparse
+import random
+import selectors
+import socket
+import sys
+import time
+
+from bench_util import percentile
+from bench_util import raise_fd_limit
+from bench_util import spawn_server
+from bench_util import stop_server
+from protocol import SnoodsProtocol
+
+
+# The kinds of messages that the clients send, and the default
+# weight of each in the mix
+#
+DEFAULT_MIX = 'newfre=2,posupd=10,colupd=2,newtxt=1,erase=1'
+
+COLORS = ['black', 'red', 'blue', 'coral', 'darkgreen', 'sienna', 'purple']
+FONTS = ['Helvetica', 'Times', 'Courier']
+WORDS = ['snood', 'board', 'pen', 'text', 'draw', 'move', 'erase', 'color']
+
+BOARD_SIZE = 2000
+
+
+class LoadClient(object):
+    """
+    A headless client that sends synthetic messages to its board,
+    and measures the latency of the messages it receives
+    """
+
+    def __init__(self, port, board_id, version, rand, nodelay=False):
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.settimeout(10)
+        if nodelay:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        self.wire = SnoodsProtocol(sock)
+        self.wire.negotiate(version)
+        self.wire.push_join(board_id)
+
+        self.board_id = board_id
+        self.rand = rand
+        self.joined = False
+        self.resynced = False
+
+        # The number of messages this client has received
+        # and measured
+        #
+        self.received = 0
+
+        # The viob_ids of the objects this client has created
+        # and not yet erased
+        #
+        self.objects = list()
+
+        # The number of messages received for each (command,
+        # viob_id), which is the index of the next send time
+        # for that key
+        #
+        self.seen = dict()
+
+    def send(self, kind, stroke_points, text_len):
+        """
+        Send a message of the given kind, and return the
+        (command, viob_id) of the message
+
+        A client can only update or erase its own objects, so
+        if it doesn't have any, it creates a drawing instead.
+        """
+
+        rand = self.rand
+        wire = self.wire
+
+        if kind in ('posupd', 'colupd', 'erase') and not self.objects:
+            kind = 'newfre'
+
+        if kind == 'newfre':
+            viob_id = SnoodsProtocol.create_viob_id()
+            p_x = rand.randrange(BOARD_SIZE)
+            p_y = rand.randrange(BOARD_SIZE)
+            points = list()
+            for _ind in range(stroke_points):
+                p_x += rand.randint(-3, 3)
+                p_y += rand.randint(-3, 3)
+                points.append((max(p_x, 0), max(p_y, 0)))
+            wire.push_freehand(viob_id, points, rand.choice(COLORS), 2)
+            self.objects.append(viob_id)
+            return '<newfre', viob_id
+
+        elif kind == 'newtxt':
+            viob_id = SnoodsProtocol.create_viob_id()
+            words = list()
+            while sum([len(word) + 1 for word in words]) < text_len:
+                words.append(rand.choice(WORDS))
+            wire.push_create_text(
+                    viob_id, rand.randrange(BOARD_SIZE),
+                    rand.randrange(BOARD_SIZE), ' '.join(words)[:text_len],
+                    rand.choice(COLORS), rand.choice(FONTS), 15, 'normal')
+            self.objects.append(viob_id)
+            return '<newtxt', viob_id
+
+        viob_id = rand.choice(self.objects)
+
+        if kind == 'posupd':
+            ll_x = rand.randrange(BOARD_SIZE)
+            ll_y = rand.randrange(BOARD_SIZE)
+            wire.push_position_update(
+                    viob_id, ll_x, ll_y, ll_x + 100, ll_y + 50)
+            return '<posupd', viob_id
+
+        elif kind == 'colupd':
+            wire.push_color_update(viob_id, rand.choice(COLORS))
+            return '<colupd', viob_id
+
+        else:
+            self.objects.remove(viob_id)
+            wire.push_erase(viob_id)
+            return '<erase', viob_id
+
+    def recv(self, send_times, latencies):
+        """
+        Receive the messages that are waiting for this client, and
+        append the latency of each to latencies
+
+        The messages for each (command, viob_id) are all sent by
+        the same client, on the same connection, so they arrive in
+        the order they were sent, and the n'th message received for
+        a key is the n'th message sent for that key.
+        """
+
+        now = time.perf_counter()
+
+        for cmd in self.wire.recv_cmds():
+            command = cmd.get('command')
+
+            if command == '<join':
+                # The first join for our board is the reply to our
+                # join (the server may first put the client on the
+                # default board); any later join means that the
+                # server has resynced this client, and it will
+                # receive the whole board again, so stop counting
+                # its messages
+                #
+                if cmd.get('board_id') == self.board_id:
+                    if self.joined:
+                        self.resynced = True
+                    self.joined = True
+                continue
+
+            if self.resynced:
+                continue
+
+            key = (command, cmd.get('viob_id'))
+            times = send_times.get(key)
+            if times is None:
+                continue
+
+            ind = self.seen.get(key, 0)
+            self.seen[key] = ind + 1
+            if ind < len(times):
+                latencies.append(now - times[ind])
+                self.received += 1
+
+
+def parse_mix(mix_str):
+    """
+    Parse a mix of the form kind=weight,kind=weight,...
+    and return a list of the kinds and a list of their weights
+    """
+
+    kinds = list()
+    weights = list()
+    for term in mix_str.split(','):
+        kind, weight = term.split('=')
+        if kind not in ('newfre', 'posupd', 'colupd', 'newtxt', 'erase'):
+            raise ValueError('unknown kind of message [%s]' % kind)
+        kinds.append(kind)
+        weights.append(float(weight))
+
+    return kinds, weights
+
+
+def run_load(port, args, n_clients, rate):
+    """
+    Connect n_clients to the server on the given port, send
+    messages at the given total rate for args.duration seconds,
+    and return a dictionary of the results
+    """
+
+    kinds, weights = parse_mix(args.mix)
+    rand = random.Random(args.seed)
+
+    clients = list()
+    members = dict()
+    for ind in range(n_clients):
+        board_id = 'load-%d' % (ind % args.boards)
+        clients.append(LoadClient(
+                port, board_id, args.protocol,
+                random.Random(rand.random()), args.nodelay))
+        members[board_id] = members.get(board_id, 0) + 1
+
+    sel = selectors.DefaultSelector()
+    for client in clients:
+        sel.register(client.wire.sock, selectors.EVENT_READ, client)
+
+    # Wait for every client to join, so that the first messages
+    # aren't sent before everyone is listening
+    #
+    deadline = time.monotonic() + 30
+    while not all([client.joined for client in clients]):
+        if time.monotonic() > deadline:
+            raise RuntimeError('clients did not join')
+        for key, _mask in sel.select(1):
+            key.data.recv(dict(), list())
+
+    def missing():
+        """
+        Return the number of messages that have been sent but
+        not yet received by the clients that haven't been resynced
+        """
+
+        return sum([board_sent[client.board_id] - client.received
+                    for client in clients if not client.resynced])
+
+    send_times = dict()
+    latencies = list()
+    board_sent = dict([(board_id, 0) for board_id in members])
+    sent = 0
+
+    interval = 1.0 / rate
+    n_msgs = int(rate * args.duration)
+
+    start = time.perf_counter()
+    next_send = start
+    end = None
+
+    while True:
+        now = time.perf_counter()
+
+        while sent < n_msgs and next_send <= now:
+            client = clients[sent % n_clients]
+            key = client.send(
+                    rand.choices(kinds, weights)[0],
+                    args.stroke_points, args.text_len)
+
+            times = send_times.get(key)
+            if times is None:
+                send_times[key] = [next_send]
+            else:
+                times.append(next_send)
+
+            board_sent[client.board_id] += 1
+            sent += 1
+            next_send = start + sent * interval
+
+        if sent == n_msgs and end is None:
+            end = time.perf_counter()
+
+        if end is not None:
+            if not missing() or now > end + args.drain:
+                break
+            timeout = 0.1
+        else:
+            timeout = max(0, next_send - now)
+
+        for key, _mask in sel.select(timeout):
+            key.data.recv(send_times, latencies)
+
+    finish = time.perf_counter()
+
+    for client in clients:
+        client.wire.sock.close()
+
+    latencies.sort()
+
+    return {
+            'clients': n_clients,
+            'rate': rate,
+            'sent_rate': sent / (end - start),
+            'delivered_rate': len(latencies) / (finish - start),
+            'p50': percentile(latencies, 50),
+            'p99': percentile(latencies, 99),
+            'p999': percentile(latencies, 99.9),
+            'resynced': len([client for client in clients
+                             if client.resynced]),
+            'lost': missing()
+            }
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(
+            description='Measure server throughput and relay latency '
+            'under a synthetic load')
+    parser.add_argument(
+            '-c', '--clients', default='10,100',
+            help='Comma-separated list of numbers of clients '
+            '[default=%(default)s]')
+    parser.add_argument(
+            '-b', '--boards', default=5, type=int,
+            help='Number of boards to spread the clients across '
+            '[default=%(default)d]')
+    parser.add_argument(
+            '-r', '--rates', default='500,2000',
+            help='Comma-separated list of total rates (messages '
+            'per second sent by all the clients) [default=%(default)s]')
+    parser.add_argument(
+            '-t', '--duration', default=5, type=float,
+            help='Seconds to send messages at each rate '
+            '[default=%(default)g]')
+    parser.add_argument(
+            '-m', '--mix', default=DEFAULT_MIX,
+            help='Relative weights of the kinds of messages to send '
+            '[default=%(default)s]')
+    parser.add_argument(
+            '--stroke_points', default=50, type=int,
+            help='Number of points in each drawing [default=%(default)d]')
+    parser.add_argument(
+            '--text_len', default=40, type=int,
+            help='Length of each text block [default=%(default)d]')
+    parser.add_argument(
+            '-P', '--protocol', default=SnoodsProtocol.VERSION, type=int,
+            choices=(SnoodsProtocol.TEXT_VERSION, SnoodsProtocol.VERSION),
+            help='Protocol version for the clients to use '
+            '[default=%(default)d]')
+    parser.add_argument(
+            '--nodelay', default=False, action='store_true',
+            help='Also disable Nagle\'s algorithm on the load '
+            'generator\'s end of each connection (the server always '
+            'disables it on its end)')
+    parser.add_argument(
+            '--drain', default=5, type=float,
+            help='Seconds to wait, after the last message is sent, for '
+            'the rest of the messages to arrive [default=%(default)g]')
+    parser.add_argument(
+            '--max_p99', default=None, type=float,
+            help='Exit with status 1 if the p99 latency of any run '
+            'exceeds this many milliseconds')
+    parser.add_argument(
+            '--seed', default=0, type=int,
+            help='Seed for the random number generator '
+            '[default=%(default)d]')
+    parser.add_argument(
+            'server_args', nargs='*',
+            help='Extra arguments for the server (after --)')
+    args = parser.parse_args(argv[1:])
+
+    try:
+        parse_mix(args.mix)
+    except ValueError as exc:
+        print('ERROR: bad mix [%s]: %s' % (args.mix, str(exc)))
+        return 1
+
+    counts = [int(count) for count in args.clients.split(',')]
+    rates = [float(rate) for rate in args.rates.split(',')]
+    raise_fd_limit()
+
+    print('%8s %8s %10s %12s %9s %9s %9s %8s %8s %8s' % (
+            'clients', 'rate', 'sent/sec', 'delivered/sec',
+            'p50 ms', 'p99 ms', 'p999 ms', 'cpu s', 'resyncs', 'lost'))
+
+    status = 0
+    for count in counts:
+        for rate in rates:
+            proc, port = spawn_server(*args.server_args)
+            try:
+                result = run_load(port, args, count, rate)
+            finally:
+                rusage = stop_server(proc)
+
+            print('%8d %8.0f %10.0f %12.0f %9.2f %9.2f %9.2f %8.2f '
+                  '%8d %8d' % (
+                    result['clients'], result['rate'], result['sent_rate'],
+                    result['delivered_rate'], 1000 * result['p50'],
+                    1000 * result['p99'], 1000 * result['p999'],
+                    rusage.ru_utime + rusage.ru_stime,
+                    result['resynced'], result['lost']))
+            sys.stdout.flush()
+
+            if (args.max_p99 is not None and
+                    1000 * result['p99'] > args.max_p99):
+                status = 1
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
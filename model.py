@@ -0,0 +1,576 @@
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+A model of the objects on a board, for the Snoods client
+
+The model holds every object on the board, with its geometry (in
+board coordinates, with the origin at the lower left of the board
+and y increasing upward), its color, and (for a freehand drawing)
+its points, and applies the messages from the server to them.
+It doesn't depend on Tk, or on anything else that needs a display,
+so it can be used by headless clients, bots, and benchmarks, as
+well as by the UI.
+
+Whenever an object is added, changed, or removed, the model calls
+each of its listeners.  The UI is a view over the model: it draws
+the objects that it is showing, and redraws them when the model
+says they have changed.
+"""
+
+from spatial import SnoodsSpatialGrid
+from stroke import decode_points
+from stroke import segment_dist_sq
+
+
+class SnoodsBoardObj(object):
+    """
+    An object on the board
+
+    The coords are [ll_x, ll_y, ur_x, ur_y] for a rectangle, [ll_x,
+    ll_y] for a text block, and [x0, y0, x1, y1, ...] for a freehand
+    drawing.  The bbox is the bounding box of the object, as (x0,
+    y0, x1, y1), which is kept up to date by the model.
+    """
+
+    __slots__ = ('kind', 'coords', 'color', 'width', 'text', 'font', 'bbox')
+
+    # The kinds of objects, which are the same as the
+    # types of the canvas items that draw them
+    #
+    RECT = 'rectangle'
+    TEXT = 'text'
+    LINE = 'line'
+
+    def __init__(self, kind, coords, color, width=0, text=None, font=None):
+        self.kind = kind
+        self.coords = coords
+        self.color = color
+        self.width = width
+        self.text = text
+        self.font = font
+        self.bbox = None
+
+    def translate(self, d_x, d_y):
+        """
+        Move the object by (d_x, d_y)
+        """
+
+        coords = self.coords
+        for ind in range(0, len(coords), 2):
+            coords[ind] += d_x
+            coords[ind + 1] += d_y
+
+
+def estimate_text_extent(text, font_des):
+    """
+    Return an estimate of the (width, height), in pixels, of a text
+    block drawn in the font described by font_des, which is a tuple
+    of the form (face, size, weight)
+
+    This doesn't know anything about the font except its size, and
+    assumes that the characters are about 0.6 of the size wide, and
+    the lines are 1.2 of the size apart.  As in Tk, a positive size
+    is in points (assuming 96 pixels per inch), and a negative size
+    is in pixels.
+    """
+
+    size = font_des[1]
+    if size > 0:
+        size = size * 4.0 / 3
+    else:
+        size = -size
+
+    lines = text.split('\n')
+    width = int(0.6 * size * max([len(line) for line in lines]) + 0.5)
+    return width, int(1.2 * size + 0.5) * len(lines)
+
+
+class SnoodsBoardModel(object):
+    """
+    The objects on a board, and the messages that change them
+
+    Each listener is called as listener(change, viob_id) after each
+    change to the model, where change is ADDED, CHANGED, or REMOVED
+    (for a change to the object with the given viob_id), or CLEARED
+    (when every object is removed, in which case viob_id is None).
+
+    text_extent is the function that returns the (width, height) of
+    a block of text, as a tuple, given the text and the font_des;
+    a UI should supply one that measures the text in the same way
+    that the text is drawn.
+    """
+
+    ADDED = 'added'
+    CHANGED = 'changed'
+    REMOVED = 'removed'
+    CLEARED = 'cleared'
+
+    def __init__(self, text_extent=estimate_text_extent):
+
+        self.text_extent = text_extent
+        self.board_id = None
+
+        # Every object on the board, by viob_id, in stacking order
+        #
+        self.objects = dict()
+
+        # The viob_ids of the freehand drawings from the remote
+        # that are still being drawn
+        #
+        self.strokes = set()
+
+        # The bounding boxes of the objects, by viob_id, for
+        # finding the objects at a point or in a region
+        #
+        self.spatial = SnoodsSpatialGrid()
+
+        self.listeners = list()
+
+    def add_listener(self, listener):
+        """
+        Add a function to be called after each change to the model
+        """
+
+        self.listeners.append(listener)
+
+    def notify(self, change, viob_id):
+        """
+        Tell the listeners about a change to the model
+        """
+
+        for listener in self.listeners:
+            listener(change, viob_id)
+
+    def object_bbox(self, obj):
+        """
+        Return the bounding box of an object
+        """
+
+        coords = obj.coords
+        if obj.kind == SnoodsBoardObj.RECT:
+            return (min(coords[0], coords[2]), min(coords[1], coords[3]),
+                    max(coords[0], coords[2]), max(coords[1], coords[3]))
+        elif obj.kind == SnoodsBoardObj.TEXT:
+            width, height = self.text_extent(obj.text, obj.font)
+            return (coords[0], coords[1],
+                    coords[0] + width, coords[1] + height)
+        else:
+            x_coords = coords[0::2]
+            y_coords = coords[1::2]
+            pad = (obj.width + 1) // 2
+            return (min(x_coords) - pad, min(y_coords) - pad,
+                    max(x_coords) + pad, max(y_coords) + pad)
+
+    def add_object(self, viob_id, obj):
+        """
+        Add a new object to the top of the board, and return True,
+        or return False if there is already an object with the
+        same viob_id (in which case the new object is ignored)
+        """
+
+        if viob_id in self.objects:
+            return False
+
+        self.objects[viob_id] = obj
+        obj.bbox = self.object_bbox(obj)
+        self.spatial.set(viob_id, obj.bbox)
+
+        self.notify(self.ADDED, viob_id)
+        return True
+
+    def update_object(self, viob_id):
+        """
+        Update the bounding box of an object after its coords have
+        been changed, and tell the listeners
+        """
+
+        obj = self.objects[viob_id]
+        obj.bbox = self.object_bbox(obj)
+        self.spatial.set(viob_id, obj.bbox)
+
+        self.notify(self.CHANGED, viob_id)
+
+    def remove_object(self, viob_id):
+        """
+        Remove an object from the board, if it is there
+        """
+
+        if self.objects.pop(viob_id, None) is None:
+            return
+
+        self.strokes.discard(viob_id)
+        self.spatial.remove(viob_id)
+
+        self.notify(self.REMOVED, viob_id)
+
+    def clear(self, board_id=None):
+        """
+        Remove every object from the board, and note which
+        board this is
+        """
+
+        self.board_id = board_id
+        self.objects = dict()
+        self.strokes = set()
+        self.spatial.clear()
+
+        self.notify(self.CLEARED, None)
+
+    def set_color(self, viob_id, color):
+        """
+        Change the color of an object, if it is there
+        """
+
+        obj = self.objects.get(viob_id)
+        if obj is None:
+            return
+
+        obj.color = color
+        self.notify(self.CHANGED, viob_id)
+
+    def translate_object(self, viob_id, d_x, d_y):
+        """
+        Move an object by (d_x, d_y), if it is there
+        """
+
+        obj = self.objects.get(viob_id)
+        if obj is None:
+            return
+
+        obj.translate(d_x, d_y)
+        self.update_object(viob_id)
+
+    def move_object(self, viob_id, ll_x, ll_y, ur_x, ur_y):
+        """
+        Move an object to the position given by a position update,
+        if it is there
+
+        The position is the bounding box of the object, which for
+        a rectangle is the rectangle itself, and for a text block
+        begins at the lower left corner of the text.
+        """
+
+        obj = self.objects.get(viob_id)
+        if obj is None:
+            return
+
+        # How we move an object depends on what kind
+        # of object it is
+        #
+        if obj.kind == SnoodsBoardObj.RECT:
+            obj.coords = [ll_x, ll_y, ur_x, ur_y]
+        elif obj.kind == SnoodsBoardObj.TEXT:
+            obj.coords = [ll_x, ll_y]
+        else:
+            # a line has a point for each point of the drawing,
+            # so instead of changing the coordinates of the line,
+            # we need to find the delta between the lower left of
+            # the bounding box of the line and the desired position,
+            # and then move the line by that amount.
+            #
+            obj.translate(ll_x - obj.bbox[0], ll_y - obj.bbox[1])
+
+        self.update_object(viob_id)
+
+    def extend_object(self, viob_id, coords):
+        """
+        Add points (as a flat list of coordinates) to the end
+        of a freehand drawing, if it is there
+        """
+
+        obj = self.objects.get(viob_id)
+        if obj is None:
+            return
+
+        obj.coords.extend(coords)
+        self.update_object(viob_id)
+
+    def objects_at(self, x_pos, y_pos, halo=0):
+        """
+        Return a list of the viob_ids of the objects at (or within
+        halo of) the given point, with the topmost first
+
+        The spatial index only knows the bounding box of each object,
+        which for a freehand drawing may include a lot of space that
+        the drawing doesn't touch, so drawings are checked against
+        the segments of the line.
+        """
+
+        found = list()
+        for viob_id in self.spatial.query_point(x_pos, y_pos, halo):
+            obj = self.objects[viob_id]
+            if obj.kind == SnoodsBoardObj.LINE:
+                reach = halo + obj.width / 2.0
+                if not self.near_line(
+                        obj.coords, x_pos, y_pos, reach * reach):
+                    continue
+
+            found.append(viob_id)
+
+        return found
+
+    @staticmethod
+    def near_line(coords, x_pos, y_pos, dist_sq):
+        """
+        Return True if the point (x_pos, y_pos) is within
+        sqrt(dist_sq) of the line through the given (flat)
+        list of coordinates, and False otherwise
+        """
+
+        if len(coords) == 2:
+            coords = coords * 2
+
+        prev_x, prev_y = coords[0], coords[1]
+
+        for ind in range(2, len(coords), 2):
+            curr_x, curr_y = coords[ind], coords[ind + 1]
+            d_x = curr_x - prev_x
+            d_y = curr_y - prev_y
+            if segment_dist_sq(
+                    x_pos - prev_x, y_pos - prev_y,
+                    d_x, d_y, d_x * d_x + d_y * d_y) <= dist_sq:
+                return True
+            prev_x, prev_y = curr_x, curr_y
+
+        return False
+
+    def objects_in_rect(self, x0, y0, x1, y1):
+        """
+        Return a list of the viob_ids of the objects whose bounding
+        boxes overlap the given rectangle, from the bottom of the
+        stack up
+        """
+
+        return self.spatial.query_rect(x0, y0, x1, y1)
+
+    @staticmethod
+    def decode_points(points_str):
+        """
+        Return the coordinates of the points in a freehand drawing
+        message, as a flat list of the form [x0, y0, x1, y1, ...],
+        or None if the points are malformed
+
+        The points are either a string (from the text protocol)
+        or a list of (x, y) points (from the binary protocol)
+        """
+
+        if isinstance(points_str, str):
+            try:
+                points_list = decode_points(points_str)
+            except ValueError as exc:
+                print('ERROR: bad freehand drawing: %s' % str(exc))
+                return None
+        else:
+            points_list = points_str
+
+        return [coord for point in points_list for coord in point]
+
+    def prepare_msg(self, msg):
+        """
+        Convert a message from the remote into an operation to
+        apply to the model, of the form (method, args), or None
+        if the message should be ignored
+
+        All of the work that doesn't depend on the state of the
+        model (converting the fields, and decoding the points of
+        freehand drawings) is done here, so that it can be done
+        on a different thread than the one that owns the model.
+        """
+
+        preparer = getattr(self, 'prepare_' + msg['command'][1:], None)
+        if not preparer:
+            return None
+
+        return preparer(**msg)
+
+    def apply_msg(self, msg):
+        """
+        Apply a message from the remote immediately
+        """
+
+        operation = self.prepare_msg(msg)
+        if operation:
+            operation[0](*operation[1])
+
+    def prepare_join(self, command, board_id):
+        return (self.apply_join, (board_id,))
+
+    def prepare_erase(self, command, viob_id):
+        return (self.apply_erase, (viob_id,))
+
+    def prepare_colupd(self, command, viob_id, color):
+        return (self.apply_colupd, (viob_id, color))
+
+    def prepare_posupd(self, command, viob_id, ll_x, ll_y, ur_x, ur_y):
+        return (self.apply_posupd, (
+                viob_id, int(ll_x), int(ll_y), int(ur_x), int(ur_y)))
+
+    def prepare_newrec(
+            self, command, viob_id, ll_x, ll_y, ur_x, ur_y, color):
+        return (self.apply_newrec, (
+                viob_id, int(ll_x), int(ll_y), int(ur_x), int(ur_y), color))
+
+    def prepare_newtxt(
+            self, command, viob_id, ll_x, ll_y, text,
+            color, font, size, weight):
+        # The size is the only field that isn't checked by the
+        # parser (because it is sent as a string)
+        #
+        try:
+            size = int(size)
+        except ValueError as exc:
+            print('ERROR: bad text size: %s' % str(exc))
+            return None
+
+        return (self.apply_newtxt, (
+                viob_id, int(ll_x), int(ll_y), text,
+                color, (font, size, weight)))
+
+    def prepare_newfre(self, command, viob_id, point_str, lwidth, color):
+        coords = self.decode_points(point_str)
+        if not coords:
+            return None
+        return (self.apply_newfre, (viob_id, coords, int(lwidth), color))
+
+    def prepare_begfre(self, command, viob_id, point_str, lwidth, color):
+        coords = self.decode_points(point_str)
+        if not coords:
+            return None
+        return (self.apply_begfre, (viob_id, coords, int(lwidth), color))
+
+    def prepare_addfre(self, command, viob_id, point_str):
+        coords = self.decode_points(point_str)
+        if not coords:
+            return None
+        return (self.apply_addfre, (viob_id, coords))
+
+    def prepare_endfre(self, command, viob_id):
+        return (self.apply_endfre, (viob_id,))
+
+    def apply_join(self, board_id):
+        """
+        Join a whiteboard
+
+        If there's anything on the default whiteboard (or any
+        other previous whiteboard) then we need to erase it
+        when we join a new whiteboard.  Otherwise our view
+        may be inconsistent with other viewers.
+
+        The server also sends a join for the current whiteboard
+        when it resends the entire whiteboard (e.g. if we have
+        fallen too far behind) so this must also start over
+        from scratch in that case.
+        """
+
+        self.clear(board_id)
+
+    def apply_erase(self, viob_id):
+        """
+        Erase a viob_id
+        """
+
+        self.remove_object(viob_id)
+
+    def apply_colupd(self, viob_id, color):
+        """
+        Apply a color update
+        """
+
+        self.set_color(viob_id, color)
+
+    def apply_posupd(self, viob_id, ll_x, ll_y, ur_x, ur_y):
+        """
+        Apply a position update
+        """
+
+        self.move_object(viob_id, ll_x, ll_y, ur_x, ur_y)
+
+    def apply_newrec(self, viob_id, ll_x, ll_y, ur_x, ur_y, color):
+        """
+        Apply a new rectangle creation
+        """
+
+        self.add_object(
+                viob_id,
+                SnoodsBoardObj(
+                    SnoodsBoardObj.RECT, [ll_x, ll_y, ur_x, ur_y], color))
+
+    def apply_newtxt(self, viob_id, ll_x, ll_y, text, color, font_des):
+        """
+        Apply a new text block creation
+        """
+
+        self.add_object(
+                viob_id,
+                SnoodsBoardObj(
+                    SnoodsBoardObj.TEXT, [ll_x, ll_y], color,
+                    text=text, font=font_des))
+
+    def apply_newfre(self, viob_id, coords, line_width, color):
+        """
+        Apply a new freehand drawing, with its points already
+        decoded by decode_points
+        """
+
+        self.add_object(
+                viob_id,
+                SnoodsBoardObj(
+                    SnoodsBoardObj.LINE, coords, color, line_width))
+
+    def apply_begfre(self, viob_id, coords, line_width, color):
+        """
+        Apply the beginning of a freehand drawing that is
+        still being drawn by another user
+
+        This is ignored for our own drawings, which are
+        added to the board before their <begfre is sent
+        """
+
+        if self.add_object(
+                viob_id,
+                SnoodsBoardObj(
+                    SnoodsBoardObj.LINE, coords, color, line_width)):
+            self.strokes.add(viob_id)
+
+    def apply_addfre(self, viob_id, coords):
+        """
+        Extend a freehand drawing that is still being drawn
+        by another user
+        """
+
+        if viob_id in self.strokes:
+            self.extend_object(viob_id, coords)
+
+    def apply_endfre(self, viob_id):
+        """
+        Finish a freehand drawing that was being drawn by
+        another user
+        """
+
+        self.strokes.discard(viob_id)
@@ -28,8 +28,28 @@
 
 
 import socket
+import time
 import uuid
 
+from codec import CHAR2ESC
+from codec import CMD2SPEC
+from codec import ID
+from codec import INT
+from codec import INTERNED_STRS
+from codec import POINTS
+from codec import STR
+from codec import escape_str
+from codec import format_text
+from codec import parse_text
+from codec import unescape_str
+from framing import SnoodsBinaryFramer
+from framing import SnoodsFramer
+from framing import SnoodsProtocolError
+from framing import decode_varint
+from framing import encode_varint
+from stroke import decode_points
+from stroke import encode_points
+
 
 class SnoodsProtocol(object):
     """
@@ -44,23 +64,52 @@ class SnoodsProtocol(object):
 
     recsep = b'\n'
 
+    # The original text protocol is version 1.  A client that
+    # can use the binary protocol (version 2) asks for it by
+    # sending a <hello message with the highest version it
+    # understands (see negotiate)
+    #
+    # A client that never sends a <hello at all predates the
+    # <hello, and doesn't understand anything that was added to
+    # the text protocol since then (such as the compact form of
+    # freehand strokes), so the server uses LEGACY_VERSION for
+    # it, and translates what it sends to the client into the
+    # original form
+    #
+    LEGACY_VERSION = 0
+    TEXT_VERSION = 1
+    BINARY_VERSION = 2
+    VERSION = BINARY_VERSION
+
+    # How long to wait for the server to reply to a <hello
+    # before assuming that it only understands the text protocol
+    #
+    HELLO_TIMEOUT = 2.0
+
     """
     A map from "special" characters to their escaped form
     """
-    char2esc = {
-            '<': '&lt;',
-            '>': '&gt;',
-            '\n': '&nl;',
-            '\t': '&tab;',
-            '/': '&fs;',
-            # '&' must be last (for unescape_str) because
-            # it is the prefix for all the escaped forms
-            '&': '&amp;'
-            }
+    char2esc = CHAR2ESC
 
     def __init__(self, sock):
         self.sock = sock
-        self.input_buf = b''
+        self.framer = SnoodsFramer(SnoodsProtocol.recsep)
+        self.version = SnoodsProtocol.TEXT_VERSION
+
+        # commands received while waiting for the reply to a <hello
+        #
+        self.pending_cmds = list()
+
+        # whether the other end has closed the connection
+        #
+        self.closed = False
+
+        # If not None, a map from the command and the first field
+        # (the viob_id, for most commands) of each message sent
+        # to the time it was most recently sent, so that the time
+        # for it to make the round trip can be measured
+        #
+        self.sent_times = None
 
     @staticmethod
     def escape_str(text):
@@ -70,8 +119,7 @@ class SnoodsProtocol(object):
         its expansion
         """
 
-        return ''.join(
-                SnoodsProtocol.char2esc.get(char, char) for char in text)
+        return escape_str(text)
 
     @staticmethod
     def unescape_str(text):
@@ -81,9 +129,7 @@ class SnoodsProtocol(object):
         replaced with the original, unescaped character
         """
 
-        for char, e_echar in SnoodsProtocol.char2esc.items():
-            text = text.replace(e_echar, char)
-        return text
+        return unescape_str(text)
 
     @staticmethod
     def split_buf(buf):
@@ -103,6 +149,24 @@ class SnoodsProtocol(object):
         else:
             return pieces[:-1], pieces[-1]
 
+    @staticmethod
+    def format_points(points):
+        """
+        Format a list of (x, y) points for a text freehand message
+        (in the compact form described in stroke.py)
+        """
+
+        return encode_points(points)
+
+    @staticmethod
+    def format_msg(cmd, values):
+        """
+        Format the command, with the given field values (in the
+        order given by the SCHEMA in codec.py), as a text message
+        """
+
+        return format_text(cmd, values)
+
     @staticmethod
     def create_viob_id():
         return str(uuid.uuid4())
@@ -113,7 +177,8 @@ class SnoodsProtocol(object):
         with open(fname) as fin:
             msgs = fin.readlines()
 
-        msgs_text = [msg.encode('utf-8') for msg in msgs]
+        msgs_text = [msg.rstrip('\r\n').encode('utf-8') for msg in msgs]
+        msgs_text = [msg for msg in msgs_text if msg]
 
         return msgs_text
 
@@ -122,171 +187,532 @@ class SnoodsProtocol(object):
         Receive as many messages as are available from self.sock
         (or as many as will fit in a single recv() call, and update
         the local state for this socket.
+
+        Any incomplete message at the end of the input is kept by
+        the framer until the rest of it arrives.
         """
 
         try:
-            new_buf = self.sock.recv(8129)
+            self.framer.recv(self.sock)
         except socket.timeout as _exc:
             return list()
         # TODO: watch for other exceptions
 
-        self.input_buf += new_buf
+        return [msg.strip() for msg in self.framer.msgs()]
 
-        msgs_text = list()
-        msgs, self.input_buf = SnoodsProtocol.split_buf(self.input_buf)
-        if msgs:
-            msgs_text = [msg.strip() for msg in msgs]
+    def set_version(self, version):
+        """
+        Switch to the given protocol version
 
-            # print('msgs_text = %s' % str(msgs_text))
+        Any input that has already been received, but not yet
+        split into messages, is passed to the framer for the new
+        version
+        """
 
-        return msgs_text
+        self.version = version
+
+        if version == SnoodsProtocol.BINARY_VERSION:
+            framer = SnoodsBinaryFramer()
+            framer.feed(self.framer.take_remainder())
+            self.framer = framer
+
+    def negotiate(self, version=VERSION, timeout=HELLO_TIMEOUT):
+        """
+        Ask the server to use the given protocol version, and
+        wait for its reply
+
+        The server replies with the highest version that both ends
+        understand.  Nothing else may be sent until the reply arrives,
+        because the server switches to the new version as soon as
+        it reads the <hello.  Commands that arrive before the reply
+        are kept, and returned by the next call to recv_cmds.
+
+        If there is no reply before the timeout, the server is assumed
+        to be an older server that only understands the text protocol.
+
+        A client that uses the text protocol still sends a <hello,
+        so that the server knows that it isn't a legacy client.
+
+        Returns the version in use.
+        """
+
+        if version < SnoodsProtocol.TEXT_VERSION:
+            return self.version
+
+        self.sock.sendall(b'<hello/%d' % version + SnoodsProtocol.recsep)
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if not self.framer.recv(self.sock):
+                    break
+            except socket.timeout as _exc:
+                continue
+
+            # The input after the reply is in the new version,
+            # so the messages must be taken one at a time
+            #
+            while True:
+                msg = self.framer.next_msg()
+                if msg is None:
+                    break
+
+                cmd = SnoodsProtocol.parse_msg(bytes(msg).strip())
+                if cmd.get('command') == '<hello':
+                    self.set_version(int(cmd['version']))
+                    return self.version
+
+                self.pending_cmds.append(cmd)
+
+        print('WARNING: no reply to hello; using the text protocol')
+        return self.version
+
+    def recv_cmds(self):
+        """
+        Like recv_msgs, but for either protocol version, and
+        returns the parsed commands instead of the messages
+
+        If the server has closed the connection, self.closed
+        is set to True.
+        """
+
+        cmds = self.pending_cmds
+        self.pending_cmds = list()
+
+        try:
+            if not self.framer.recv(self.sock):
+                self.closed = True
+                return cmds
+        except socket.timeout as _exc:
+            return cmds
+
+        if self.version == SnoodsProtocol.BINARY_VERSION:
+            decode_msg = SnoodsBinaryCodec.decode_msg
+            cmds += [decode_msg(msg) for msg in self.framer.msgs()]
+        else:
+            parse_msg = SnoodsProtocol.parse_msg
+            cmds += [parse_msg(msg.strip()) for msg in self.framer.msgs()]
+
+        return cmds
 
     @staticmethod
     def parse_msg(text):
         """
-        Parse a single message into a dictionary that can
+        Parse a single message into a SnoodsMsg that can
         be passed to the handler for the corresponding
-        message type
-        """
-
-        msg = dict()
-        fields = [s.decode('utf-8') for s in text.split(b'/')]
-        # print('text = %s' % str(text))
-        # print('fields = %s' % str(fields))
-
-        if fields[0] == '<colupd':
-            msg['command'] = fields[0]
-            msg['viob_id'] = fields[1]
-            msg['color'] = fields[2]
-
-        elif fields[0] == '<posupd':
-            msg['command'] = fields[0]
-            msg['viob_id'] = fields[1]
-            msg['ll_x'] = fields[2]
-            msg['ll_y'] = fields[3]
-            msg['ur_x'] = fields[4]
-            msg['ur_y'] = fields[5]
-
-        elif fields[0] == '<newrec':
-            msg['command'] = fields[0]
-            msg['viob_id'] = fields[1]
-            msg['ll_x'] = fields[2]
-            msg['ll_y'] = fields[3]
-            msg['ur_x'] = fields[4]
-            msg['ur_y'] = fields[5]
-            msg['color'] = SnoodsProtocol.unescape_str(fields[6])
-
-        elif fields[0] == '<newtxt':
-            msg['command'] = fields[0]
-            msg['viob_id'] = fields[1]
-            msg['ll_x'] = fields[2]
-            msg['ll_y'] = fields[3]
-            msg['text'] = SnoodsProtocol.unescape_str(fields[4])
-            msg['color'] = SnoodsProtocol.unescape_str(fields[5])
-            msg['font'] = SnoodsProtocol.unescape_str(fields[6])
-            msg['size'] = SnoodsProtocol.unescape_str(fields[7])
-            msg['weight'] = SnoodsProtocol.unescape_str(fields[8])
-
-        elif fields[0] == '<newfre':
-            msg['command'] = fields[0]
-            msg['viob_id'] = fields[1]
-            msg['color'] = SnoodsProtocol.unescape_str(fields[2])
-            msg['lwidth'] = fields[3]
-            msg['point_str'] = fields[4]
-
-        elif fields[0] == '<erase':
-            msg['command'] = fields[0]
-            msg['viob_id'] = fields[1]
-
-        elif fields[0] == '<join':
-            msg['command'] = fields[0]
-            msg['board_id'] = SnoodsProtocol.unescape_str(fields[1])
-
-        # print(str(msg))
-        return msg
+        message type (see codec.py)
+        """
+
+        return parse_text(text)
+
+    def send_cmd(self, cmd, values):
+        """
+        Send the command, with the given field values (in the
+        order given by the SCHEMA in codec.py), in the current
+        protocol version
+        """
+
+        if self.version == SnoodsProtocol.BINARY_VERSION:
+            data = SnoodsBinaryCodec.framer.frame(
+                    [SnoodsBinaryCodec.encode(cmd, values)])
+        else:
+            data = SnoodsProtocol.format_msg(cmd, values) + self.recsep
+
+        self.sock.sendall(data)
+
+        if self.sent_times is not None:
+            self.sent_times[(cmd, values[0])] = time.perf_counter()
 
     def push_join(self, board_id):
         """ Send a request to join a specific board, by identifier """
 
-        e_board_id = SnoodsProtocol.escape_str(str(board_id))
-        msg = '<join/%s' % e_board_id
-
-        msg = msg.encode('utf-8')
-        self.sock.send(msg + SnoodsProtocol.recsep)
+        self.send_cmd('<join', (board_id,))
 
     def push_erase(self, viob_id):
         """ Push an erase message """
 
-        e_viob_id = SnoodsProtocol.escape_str(str(viob_id))
-
-        msg = '<erase/%s' % e_viob_id
-        # print(msg)
-        msg = msg.encode('utf-8')
-        self.sock.send(msg + SnoodsProtocol.recsep)
+        self.send_cmd('<erase', (viob_id,))
 
     def push_color_update(self, viob_id, color):
         """ Push a color update message """
 
-        e_viob_id = SnoodsProtocol.escape_str(str(viob_id))
-        e_color = SnoodsProtocol.escape_str(color)
-
-        msg = '<colupd/%s/%s' % (e_viob_id, e_color)
-        # print(msg)
-        msg = msg.encode('utf-8')
-        self.sock.send(msg + SnoodsProtocol.recsep)
+        self.send_cmd('<colupd', (viob_id, color))
 
     def push_position_update(self, viob_id, ll_x, ll_y, ur_x, ur_y):
         """ Push a position update message """
 
-        e_viob_id = SnoodsProtocol.escape_str(str(viob_id))
-
-        msg = '<posupd/%s/%d/%d/%d/%d' % (
-                e_viob_id, ll_x, ll_y, ur_x, ur_y)
-        # print(msg)
-        msg = msg.encode('utf-8')
-        self.sock.send(msg + SnoodsProtocol.recsep)
+        self.send_cmd('<posupd', (viob_id, ll_x, ll_y, ur_x, ur_y))
 
     def push_create_rect(self, viob_id, ll_x, ll_y, ur_x, ur_y, bg_color):
         """ Push a create rectangle message """
 
-        e_viob_id = SnoodsProtocol.escape_str(str(viob_id))
-        e_bg_color = SnoodsProtocol.escape_str(bg_color)
-
-        msg = '<newrec/%s/%d/%d/%d/%d/%s' % (
-                e_viob_id, ll_x, ll_y, ur_x, ur_y, e_bg_color)
-        # print(msg)
-        msg = msg.encode('utf-8')
-        self.sock.send(msg + SnoodsProtocol.recsep)
+        self.send_cmd(
+                '<newrec', (viob_id, ll_x, ll_y, ur_x, ur_y, bg_color))
 
     def push_create_text(
             self, viob_id, ll_x, ll_y, text,
             fg_color, font, size, weight):
         """ Push a create text message """
 
-        e_viob_id = SnoodsProtocol.escape_str(str(viob_id))
-        e_fg_color = SnoodsProtocol.escape_str(fg_color)
-        e_font = SnoodsProtocol.escape_str(font)
-        e_size = SnoodsProtocol.escape_str(str(size))
-        e_weight = SnoodsProtocol.escape_str(weight)
+        self.send_cmd(
+                '<newtxt',
+                (viob_id, ll_x, ll_y, text, fg_color, font, size, weight))
+
+    def push_freehand(self, viob_id, points, fg_color, lwidth):
+        """
+        Push a freehand drawing message, where points is
+        a list of (x, y) points
+        """
+
+        self.send_cmd('<newfre', (viob_id, fg_color, lwidth, points))
 
-        e_text = SnoodsProtocol.escape_str(text)
+    def push_begin_freehand(self, viob_id, points, fg_color, lwidth):
+        """
+        Push the beginning of a freehand drawing that is still
+        being drawn, where points is a list of (x, y) points
+
+        The rest of the points follow in push_add_freehand
+        messages, and then a push_end_freehand.
+        """
 
-        msg = '<newtxt/%s/%d/%d/%s/%s/%s/%s/%s' % (
-                e_viob_id, ll_x, ll_y, e_text,
-                e_fg_color, e_font, e_size, e_weight)
-        # print('SENDING = ' + msg)
-        msg = msg.encode('utf-8')
-        self.sock.send(msg + SnoodsProtocol.recsep)
+        self.send_cmd('<begfre', (viob_id, fg_color, lwidth, points))
 
-    def push_freehand(self, viob_id, point_str, fg_color, lwidth):
+    def push_add_freehand(self, viob_id, points):
         """
-        Push a freehand drawing message
+        Push more points for a freehand drawing that was
+        started with push_begin_freehand
         """
 
-        e_viob_id = SnoodsProtocol.escape_str(str(viob_id))
-        e_fg_color = SnoodsProtocol.escape_str(fg_color)
+        self.send_cmd('<addfre', (viob_id, points))
+
+    def push_end_freehand(self, viob_id):
+        """
+        Push the end of a freehand drawing that was started
+        with push_begin_freehand
+        """
+
+        self.send_cmd('<endfre', (viob_id,))
+
+
+class SnoodsBinaryCodec(object):
+    """
+    Encoding and decoding of messages in the binary protocol
+    (protocol version 2)
+
+    Each message is an opcode byte followed by its fields:
+
+    ID - either a zero byte followed by the 16 bytes of a UUID,
+        or (if the id isn't a UUID in its canonical string form)
+        the length of the UTF-8 encoding of the id plus one,
+        as a varint, followed by the encoding
+
+    INT - a zigzag varint
+
+    STR - a varint n: if n is less than the number of interned
+        strings, then the string is INTERNED_STRS[n], otherwise
+        it is followed by n - len(INTERNED_STRS) bytes of UTF-8
+
+    POINTS - the number of points, as a varint, followed by the
+        x and y of each point minus the x and y of the previous
+        point, as zigzag varints
+
+    The messages are framed by a SnoodsBinaryFramer.
+
+    The server keeps everything in the form of text messages, and
+    translates between the text and binary forms of each message
+    for the clients that use the binary protocol, so the translation
+    must be exact: any text message that can't be translated to
+    binary and back again without changing it is carried as a text
+    message (with opcode 0).
+    """
+
+    RAW = 0
+
+    OPCODE2SPEC = dict(
+            (_spec.opcode, _spec) for _spec in CMD2SPEC.values()
+            if _spec.opcode is not None)
+
+    STR2INDEX = dict(
+            (_text, _ind) for _ind, _text in enumerate(INTERNED_STRS))
+    N_INTERNED = len(INTERNED_STRS)
+
+    framer = SnoodsBinaryFramer()
+
+    @staticmethod
+    def zigzag(value):
+        return (value << 1) if value >= 0 else ((-value << 1) - 1)
+
+    @staticmethod
+    def unzigzag(value):
+        return (value >> 1) if not value & 1 else -((value + 1) >> 1)
+
+    @staticmethod
+    def uuid_bytes(text):
+        """
+        Return the 16 bytes of the UUID represented by text, or None
+        if text is not a UUID in the canonical (lowercase) form
+        """
+
+        if (len(text) != 36 or text[8] != '-' or text[13] != '-' or
+                text[18] != '-' or text[23] != '-' or text != text.lower()):
+            return None
+
+        try:
+            data = bytes.fromhex(text.replace('-', ''))
+        except ValueError as _exc:
+            return None
+
+        # fromhex permits whitespace between the bytes
+        #
+        if len(data) != 16:
+            return None
+
+        return data
+
+    @staticmethod
+    def encode(cmd, values):
+        """
+        Encode the command, with the given field values,
+        as a binary message
+        """
+
+        spec = CMD2SPEC[cmd]
+        zigzag = SnoodsBinaryCodec.zigzag
+
+        out = bytearray()
+        out.append(spec.opcode)
+
+        for kind, value in zip(spec.kinds, values):
+            if kind == INT:
+                encode_varint(zigzag(int(value)), out)
+            elif kind == STR:
+                value = str(value)
+                index = SnoodsBinaryCodec.STR2INDEX.get(value)
+                if index is not None:
+                    encode_varint(index, out)
+                else:
+                    data = value.encode('utf-8')
+                    encode_varint(
+                            SnoodsBinaryCodec.N_INTERNED + len(data), out)
+                    out += data
+            elif kind == ID:
+                value = str(value)
+                uuid_bytes = SnoodsBinaryCodec.uuid_bytes(value)
+                if uuid_bytes:
+                    out.append(0)
+                    out += uuid_bytes
+                else:
+                    data = value.encode('utf-8')
+                    encode_varint(len(data) + 1, out)
+                    out += data
+            elif kind == POINTS:
+                encode_varint(len(value), out)
+                prev_x, prev_y = 0, 0
+                for p_x, p_y in value:
+                    encode_varint(zigzag(p_x - prev_x), out)
+                    encode_varint(zigzag(p_y - prev_y), out)
+                    prev_x, prev_y = p_x, p_y
+
+        return bytes(out)
+
+    @staticmethod
+    def decode(msg):
+        """
+        Decode a binary message, and return the command and the
+        list of the values of its fields
+
+        If the message is a text message, then the command is None
+        and the value is the text message (as bytes)
+
+        Raises SnoodsProtocolError if the message is malformed,
+        including a text message that contains the text protocol's
+        record separator (which would turn into more than one
+        message when it is relayed to the text clients).
+        """
+
+        if not msg:
+            raise SnoodsProtocolError('empty binary message')
+
+        opcode = msg[0]
+        if opcode == SnoodsBinaryCodec.RAW:
+            text = msg[1:]
+            if SnoodsProtocol.recsep in text:
+                raise SnoodsProtocolError(
+                        'text message contains a record separator')
+            return None, text
+
+        spec = SnoodsBinaryCodec.OPCODE2SPEC.get(opcode)
+        if spec is None:
+            raise SnoodsProtocolError('unknown opcode %d' % opcode)
+
+        try:
+            return spec.cmd, SnoodsBinaryCodec.decode_values(msg, spec)
+        except (IndexError, UnicodeDecodeError) as exc:
+            raise SnoodsProtocolError(
+                    'malformed %s message: %s' % (spec.cmd, str(exc)))
+
+    @staticmethod
+    def decode_values(msg, spec):
+        """
+        Decode the fields of a binary message with the given
+        spec, and return the list of their values
+
+        Raises IndexError if the message ends before its fields do,
+        or UnicodeDecodeError if a string field isn't UTF-8.
+        """
+
+        unzigzag = SnoodsBinaryCodec.unzigzag
+        msg_len = len(msg)
+
+        values = list()
+        pos = 1
+        for kind in spec.kinds:
+            if kind == INT:
+                value, pos = decode_varint(msg, pos)
+                values.append(unzigzag(value))
+            elif kind == STR:
+                value, pos = decode_varint(msg, pos)
+                if value < SnoodsBinaryCodec.N_INTERNED:
+                    values.append(INTERNED_STRS[value])
+                else:
+                    end = pos + value - SnoodsBinaryCodec.N_INTERNED
+                    if end > msg_len:
+                        raise IndexError('string past the end')
+                    values.append(msg[pos:end].decode('utf-8'))
+                    pos = end
+            elif kind == ID:
+                value, pos = decode_varint(msg, pos)
+                if value == 0:
+                    if pos + 16 > msg_len:
+                        raise IndexError('id past the end')
+                    hex_id = msg[pos:pos + 16].hex()
+                    values.append('%s-%s-%s-%s-%s' % (
+                            hex_id[:8], hex_id[8:12], hex_id[12:16],
+                            hex_id[16:20], hex_id[20:]))
+                    pos += 16
+                else:
+                    end = pos + value - 1
+                    if end > msg_len:
+                        raise IndexError('id past the end')
+                    values.append(msg[pos:end].decode('utf-8'))
+                    pos = end
+            elif kind == POINTS:
+                n_points, pos = decode_varint(msg, pos)
+                points = list()
+                p_x, p_y = 0, 0
+                for _ind in range(n_points):
+                    # most of the deltas fit in a single byte
+                    #
+                    d_x = msg[pos]
+                    if d_x < 0x80:
+                        pos += 1
+                    else:
+                        d_x, pos = decode_varint(msg, pos)
+                    d_y = msg[pos]
+                    if d_y < 0x80:
+                        pos += 1
+                    else:
+                        d_y, pos = decode_varint(msg, pos)
+
+                    p_x += (d_x >> 1) if not d_x & 1 else -((d_x + 1) >> 1)
+                    p_y += (d_y >> 1) if not d_y & 1 else -((d_y + 1) >> 1)
+                    points.append((p_x, p_y))
+                values.append(points)
+
+        return values
+
+    @staticmethod
+    def decode_msg(msg):
+        """
+        Decode a binary message into the same kind of SnoodsMsg
+        that SnoodsProtocol.parse_msg creates for a text message
+
+        The integer fields are ints (rather than strings) and the
+        point_str of a freehand drawing is a list of points.
+        """
+
+        cmd, values = SnoodsBinaryCodec.decode(msg)
+        if cmd is None:
+            return SnoodsProtocol.parse_msg(values)
+
+        return CMD2SPEC[cmd].msg_class(*values)
+
+    @staticmethod
+    def from_text(text_msg):
+        """
+        Translate a text message to a binary message
+        """
+
+        fields = text_msg.split(b'/')
+        spec = CMD2SPEC.get(fields[0].decode('utf-8', 'replace'))
+        if (spec is None or spec.opcode is None or
+                len(fields) != spec.n_fields + 1):
+            return bytes([SnoodsBinaryCodec.RAW]) + text_msg
+
+        try:
+            values = SnoodsBinaryCodec.text_values(fields[1:], spec.kinds)
+        except ValueError as _exc:
+            values = None
+
+        if values is None:
+            return bytes([SnoodsBinaryCodec.RAW]) + text_msg
+
+        return SnoodsBinaryCodec.encode(spec.cmd, values)
+
+    @staticmethod
+    def text_values(fields, kinds):
+        """
+        Convert the fields of a text message to values, or return
+        None if the text message isn't exactly what format_msg
+        would create from the values
+
+        Raises ValueError if a field can't be converted
+        """
+
+        values = list()
+        for field, kind in zip(fields, kinds):
+            field = field.decode('utf-8')
+            if kind == INT:
+                value = int(field)
+                if str(value) != field:
+                    return None
+            elif kind == STR:
+                value = unescape_str(field)
+                if escape_str(value) != field:
+                    return None
+            elif kind == ID:
+                value = field
+                if escape_str(value) != field:
+                    return None
+            elif kind == POINTS:
+                value = decode_points(field)
+                if encode_points(value) != field:
+                    return None
+            values.append(value)
+
+        return values
+
+    @staticmethod
+    def to_text(msg):
+        """
+        Translate a binary message to a text message
+
+        Raises SnoodsProtocolError if the message is malformed.
+        """
+
+        cmd, values = SnoodsBinaryCodec.decode(msg)
+        if cmd is None:
+            return bytes(values)
+
+        return SnoodsProtocol.format_msg(cmd, values)
+
+    @staticmethod
+    def frame_text(text_msgs):
+        """
+        Translate a list of text messages to a buffer of framed
+        binary messages
+        """
 
-        msg = '<newfre/%s/%s/%d/%s' % (
-                e_viob_id, e_fg_color, lwidth, point_str)
-        msg = msg.encode('utf-8')
-        self.sock.send(msg + SnoodsProtocol.recsep)
+        from_text = SnoodsBinaryCodec.from_text
+        return SnoodsBinaryCodec.framer.frame(
+                [from_text(msg) for msg in text_msgs])
@@ -0,0 +1,257 @@
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Recording of the traffic that arrives at the Snoods server
+
+When the server is recording, every message that it receives from
+a client (in its text form) is appended to a file for the board
+that the message is for, along with the time when it arrived and
+an identifier for the connection that sent it.  The joins are
+recorded too, in the file for the board being joined, and when a
+connection leaves a board (because it joins another board or
+disconnects) a <leave pseudo-message is recorded, so a recording
+shows when each client came and went as well as what it sent.
+See replay.py for a tool that plays a recording back into a server.
+
+Each line of a recording has the form
+
+    TIME CONN MSG
+
+where TIME is the time.time() when the message arrived (with
+microsecond precision), CONN is an integer that identifies the
+connection, and MSG is the message.  Messages never contain a
+newline (see SnoodsProtocol.escape_str), so the files can be read
+a line at a time.
+
+A restarted server appends to the recordings that are already in
+the directory, and numbers its connections starting over from 0,
+so each server begins its part of a recording with a <session
+pseudo-message (with a CONN of -1).  The connection identifiers
+are only unique within a session, so read_events renumbers them
+to be unique within the whole recording, and ends any connection
+that was still on the board when its session ended (because the
+server stopped without recording that it left).
+
+The recordings are written through ordinary buffered files, and
+are flushed at most once every flush_interval seconds, so that
+recording adds very little to the cost of each message.
+"""
+
+import os
+import time
+import urllib.parse
+
+
+class SnoodsRecorder(object):
+    """
+    Records the messages that arrive for each board to a
+    file per board in a directory
+    """
+
+    SUFFIX = '.rec'
+
+    # The pseudo-message that marks a connection leaving a board
+    #
+    LEAVE = b'<leave'
+
+    # The pseudo-message that marks the start of the messages
+    # recorded by a new server
+    #
+    SESSION = b'<session'
+
+    DEFAULT_FLUSH_INTERVAL = 0.5
+
+    def __init__(self, dirname, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.dirname = dirname
+        self.flush_interval = flush_interval
+
+        os.makedirs(dirname, exist_ok=True)
+
+        # The files are opened when the first message for each
+        # board arrives, rather than here, so that a recorder
+        # that is created before the server forks its workers
+        # doesn't share open files between the processes
+        #
+        self.board2file = dict()
+
+        # map from each connection to its identifier
+        #
+        self.conn_ids = dict()
+        self.next_conn_id = 0
+
+        self.last_flush = time.monotonic()
+
+    def board_fname(self, board_id):
+        """
+        Return the path to the recording for the given board_id
+        """
+
+        quoted_id = urllib.parse.quote(board_id, safe='')
+        return os.path.join(self.dirname, quoted_id + self.SUFFIX)
+
+    def conn_id(self, conn):
+        """
+        Return the identifier for a connection, assigning
+        a new one if it doesn't have one yet
+        """
+
+        conn_id = self.conn_ids.get(conn)
+        if conn_id is None:
+            conn_id = self.next_conn_id
+            self.next_conn_id += 1
+            self.conn_ids[conn] = conn_id
+
+        return conn_id
+
+    def record(self, board_id, conn, msg):
+        """
+        Record a message (in its text form) from the given
+        connection for the given board
+        """
+
+        fout = self.board2file.get(board_id)
+        if fout is None:
+            fout = open(self.board_fname(board_id), 'ab')
+            fout.write(b'%.6f -1 %s\n' % (time.time(), self.SESSION))
+            self.board2file[board_id] = fout
+
+        fout.write(b'%.6f %d %s\n' % (time.time(), self.conn_id(conn), msg))
+
+    def leave(self, board_id, conn, closed=False):
+        """
+        Record that a connection has left a board
+
+        If closed is True, then the connection has disconnected,
+        and its identifier is forgotten.
+        """
+
+        self.record(board_id, conn, self.LEAVE)
+
+        if closed:
+            self.conn_ids.pop(conn, None)
+
+    def sync(self, force=False):
+        """
+        Flush the recordings, if it has been at least
+        flush_interval seconds since the last flush (or
+        if force is true)
+        """
+
+        now = time.monotonic()
+        if not force and now - self.last_flush < self.flush_interval:
+            return
+
+        self.last_flush = now
+
+        for fout in self.board2file.values():
+            fout.flush()
+
+    def close(self):
+        """
+        Flush all the recordings, and close them
+        """
+
+        for fout in self.board2file.values():
+            fout.close()
+        self.board2file = dict()
+
+    @staticmethod
+    def read_events(fname):
+        """
+        Read a recording, and return a list of the events in it,
+        as tuples of (time, conn_id, msg)
+
+        The conn_ids are renumbered so that the connections of
+        different sessions don't share an identifier, and each
+        connection that is still on the board when the next
+        session starts is given a <leave event at that time.
+
+        A recording that was cut short may end with an incomplete
+        line; this is ignored.
+        """
+
+        events = list()
+
+        # map from the recorded identifier of each connection in
+        # the current session to its identifier in the events, and
+        # the set of those connections that are on the board
+        #
+        session_ids = dict()
+        present = set()
+        n_conns = 0
+
+        with open(fname, 'rb') as fin:
+            for line in fin:
+                if not line.endswith(b'\n'):
+                    break
+
+                fields = line.rstrip(b'\r\n').split(b' ', 2)
+                try:
+                    when, raw_id, msg = (
+                            float(fields[0]), int(fields[1]), fields[2])
+                except (ValueError, IndexError) as _exc:
+                    continue
+
+                if msg == SnoodsRecorder.SESSION:
+                    for conn_id in sorted(present):
+                        events.append((when, conn_id, SnoodsRecorder.LEAVE))
+                    session_ids = dict()
+                    present = set()
+                    continue
+
+                conn_id = session_ids.get(raw_id)
+                if conn_id is None:
+                    conn_id = n_conns
+                    n_conns += 1
+                    session_ids[raw_id] = conn_id
+
+                if msg == SnoodsRecorder.LEAVE:
+                    present.discard(conn_id)
+                else:
+                    present.add(conn_id)
+
+                events.append((when, conn_id, msg))
+
+        return events
+
+    @staticmethod
+    def board_ids(dirname):
+        """
+        Return a map from the board_id of each recording
+        in the given directory to the path of the recording
+        """
+
+        board2fname = dict()
+        for fname in os.listdir(dirname):
+            if fname.endswith(SnoodsRecorder.SUFFIX):
+                quoted_id = fname[:-len(SnoodsRecorder.SUFFIX)]
+                board2fname[urllib.parse.unquote(quoted_id)] = os.path.join(
+                        dirname, fname)
+
+        return board2fname
@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Replay a recording of the traffic to a server, and measure
+the relay latency and the CPU time used by the server
+
+The recording is a directory of files made by running the server
+with --record (see record.py).  The replayer spawns a new server,
+and then for each recorded connection to each board it opens a
+connection to the server, joins the board, and sends the same
+messages that the original connection sent, at the same relative
+times (or at a multiple of the original speed, or as fast as
+possible), and closes the connection when the original left the
+board.  This reproduces the bursts, the large drawings, and the
+clients coming and going of a real session, which a synthetic
+load (see loadgen.py) doesn't.
+
+Every connection to a board (including the sender) receives every
+message sent to that board, and the time from when each message
+was due to be sent until each connection receives it is measured.
+The deliveries are matched to the messages by their contents, so
+if the board is recreated for a client that joins (or that the
+server resyncs) while an identical message is in flight, that
+delivery may be matched to the wrong copy.  This is rare enough
+to ignore.
+
+For each speed, this reports the number of messages sent, the
+rate at which they were sent and delivered, the p50, p99, p99.9,
+and maximum latency, the CPU time used by the server, and the
+number of connections that the server resynced.  Any arguments
+after -- are passed to the server.  (If the server is run with more
+than one worker, then only the CPU time of the router is counted.)
+"""
+
+import argparse
+import collections
+import os
+import selectors
+import socket
+import sys
+import time
+
+from bench_util import percentile
+from bench_util import raise_fd_limit
+from bench_util import spawn_server
+from bench_util import stop_server
+from protocol import SnoodsBinaryCodec
+from protocol import SnoodsProtocol
+from record import SnoodsRecorder
+
+
+class ReplayClient(object):
+    """
+    A connection that replays the messages that one recorded
+    connection sent to one board, and measures the latency of
+    the messages it receives
+    """
+
+    def __init__(self, port, board_id, version):
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.settimeout(10)
+
+        self.wire = SnoodsProtocol(sock)
+        self.wire.negotiate(version)
+        self.binary = self.wire.version == SnoodsProtocol.BINARY_VERSION
+
+        self.board_id = board_id
+        self.join_msg = SnoodsProtocol.format_msg('<join', (board_id,))
+        self.joined = False
+        self.resynced = False
+        self.closed = False
+
+        # Every new connection starts out on the default board,
+        # so only other boards need to be joined
+        #
+        if board_id != 'default':
+            self.send(self.join_msg)
+
+    def send(self, msg):
+        """
+        Send a message (in its text form) in the protocol
+        version of the connection
+        """
+
+        if self.closed:
+            return
+
+        if self.binary:
+            buf = SnoodsBinaryCodec.frame_text([msg])
+        else:
+            buf = msg + SnoodsProtocol.recsep
+
+        try:
+            self.wire.sock.sendall(buf)
+        except OSError as _exc:
+            self.close()
+
+    def received_form(self, msg):
+        """
+        Return the text form of a message as the connections
+        will receive it
+
+        The text of a message that is sent in the binary protocol
+        is recreated from its binary form, which may differ from
+        the recorded text (for example, in how numbers are written).
+        """
+
+        if self.binary:
+            return SnoodsBinaryCodec.to_text(SnoodsBinaryCodec.from_text(msg))
+        return msg
+
+    def close(self):
+        """
+        Close the connection
+        """
+
+        if not self.closed:
+            self.closed = True
+            self.wire.sock.close()
+
+    def recv(self, pending, latencies):
+        """
+        Receive the messages that are waiting for this connection,
+        and append the latency of each to latencies
+
+        The pending map is from the text of each message sent to
+        the board to a deque of [send_time, n_receivers] for the
+        copies of that message that haven't been received by every
+        connection.  Returns False if the server has closed the
+        connection.
+        """
+
+        try:
+            if not self.wire.framer.recv(self.wire.sock):
+                return False
+        except socket.timeout as _exc:
+            return True
+        except OSError as _exc:
+            return False
+
+        now = time.perf_counter()
+
+        msgs = self.wire.framer.msgs()
+        if self.binary:
+            msgs = [SnoodsBinaryCodec.to_text(msg) for msg in msgs]
+
+        for msg in msgs:
+            msg = msg.strip()
+
+            if msg == self.join_msg:
+                # Any join after the first means that the server
+                # has resynced this connection, and it will receive
+                # the whole board again, so stop counting its
+                # messages
+                #
+                if self.joined:
+                    self.resynced = True
+                self.joined = True
+                continue
+
+            if self.resynced:
+                continue
+
+            copies = pending.get(msg)
+            if not copies:
+                continue
+
+            copy = copies[0]
+            latencies.append(now - copy[0])
+            copy[1] -= 1
+            if not copy[1]:
+                copies.popleft()
+                if not copies:
+                    del pending[msg]
+
+        return True
+
+
+def load_recording(dirname, board_ids=None):
+    """
+    Read the recordings in dirname (or only those for the given
+    board_ids, if any) and return a list of the events, as tuples
+    of (time, board_id, conn_id, msg), in the order they happened
+    """
+
+    events = list()
+    for board_id, fname in SnoodsRecorder.board_ids(dirname).items():
+        if board_ids and board_id not in board_ids:
+            continue
+
+        for when, conn_id, msg in SnoodsRecorder.read_events(fname):
+            events.append((when, board_id, conn_id, msg))
+
+    events.sort(key=lambda event: event[0])
+    return events
+
+
+def run_replay(port, args, events, speed):
+    """
+    Replay the events to the server on the given port, at the
+    given speed (or as fast as possible, if speed is 0), and
+    return a dictionary of the results
+    """
+
+    sel = selectors.DefaultSelector()
+
+    # map from (board_id, conn_id) to the ReplayClient for each
+    # recorded connection that is currently on its board, and from
+    # each board_id to the number of its current connections and
+    # to its pending map (see ReplayClient.recv)
+    #
+    clients = dict()
+    members = collections.defaultdict(int)
+    pending = collections.defaultdict(dict)
+
+    latencies = list()
+    resynced = 0
+    sent = 0
+    ind = 0
+
+    def close_client(key):
+        """
+        Close the connection for the given (board_id, conn_id)
+        """
+
+        nonlocal resynced
+
+        client = clients.pop(key)
+        members[key[0]] -= 1
+        resynced += client.resynced
+        if not client.closed:
+            sel.unregister(client.wire.sock)
+            client.close()
+
+    start = time.perf_counter()
+    first = events[0][0] if events else 0
+    end = None
+    last_recv = start
+
+    while True:
+        now = time.perf_counter()
+
+        # When replaying as fast as possible, stop to read after
+        # every few messages, so that the server doesn't have to
+        # queue everything for the connections
+        #
+        batch_end = ind + args.batch if not speed else len(events)
+
+        while ind < batch_end and ind < len(events):
+            when, board_id, conn_id, msg = events[ind]
+            if speed:
+                due = start + (when - first) / speed
+                if due > now:
+                    break
+            else:
+                due = time.perf_counter()
+            ind += 1
+
+            key = (board_id, conn_id)
+            client = clients.get(key)
+
+            if msg == SnoodsRecorder.LEAVE:
+                if client:
+                    close_client(key)
+                continue
+
+            if client is None:
+                client = ReplayClient(port, board_id, args.protocol)
+                sel.register(client.wire.sock, selectors.EVENT_READ, client)
+                clients[key] = client
+                members[board_id] += 1
+
+                # The join (if any) has already been sent
+                #
+                if msg == client.join_msg:
+                    continue
+
+            if msg.startswith(b'<join'):
+                client.send(msg)
+                continue
+
+            text = client.received_form(msg)
+            copies = pending[board_id].get(text)
+            if copies is None:
+                copies = collections.deque()
+                pending[board_id][text] = copies
+            copies.append([due, members[board_id]])
+
+            client.send(msg)
+            sent += 1
+
+        if ind == len(events) and end is None:
+            end = time.perf_counter()
+
+        if end is not None:
+            # Connections that left before every message reached
+            # them never finish their pending messages, so the
+            # replay is over once the input stops
+            #
+            if (not any(pending.values()) or now > end + args.drain or
+                    now > last_recv + args.idle):
+                break
+            timeout = 0.1
+        elif not speed:
+            timeout = 0
+        else:
+            timeout = max(0, min(0.1, start + (events[ind][0] - first) /
+                                 speed - now))
+
+        for sel_key, _mask in sel.select(timeout):
+            client = sel_key.data
+            last_recv = time.perf_counter()
+            if not client.recv(pending[client.board_id], latencies):
+                sel.unregister(client.wire.sock)
+                client.close()
+
+    finish = time.perf_counter()
+
+    for key in list(clients.keys()):
+        close_client(key)
+
+    latencies.sort()
+
+    return {
+            'speed': speed,
+            'sent': sent,
+            'sent_rate': sent / max(end - start, 1e-6),
+            'delivered_rate': len(latencies) / (finish - start),
+            'p50': percentile(latencies, 50),
+            'p99': percentile(latencies, 99),
+            'p999': percentile(latencies, 99.9),
+            'max': latencies[-1] if latencies else 0,
+            'resynced': resynced
+            }
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(
+            description='Replay a recording of the traffic to a server, '
+            'and measure the relay latency and server CPU time')
+    parser.add_argument(
+            '-d', '--recording', required=True,
+            help='Directory of recordings made by the server with --record')
+    parser.add_argument(
+            '-s', '--speeds', default='1,10,0',
+            help='Comma-separated list of speeds to replay at, as '
+            'multiples of the recorded speed (0 for as fast as '
+            'possible) [default=%(default)s]')
+    parser.add_argument(
+            '-b', '--boards', default=None,
+            help='Comma-separated list of boards to replay '
+            '[default=all]')
+    parser.add_argument(
+            '-P', '--protocol', default=SnoodsProtocol.VERSION, type=int,
+            choices=(SnoodsProtocol.TEXT_VERSION, SnoodsProtocol.VERSION),
+            help='Protocol version for the connections to use '
+            '[default=%(default)d]')
+    parser.add_argument(
+            '--batch', default=50, type=int,
+            help='Messages to send between reads, when replaying as '
+            'fast as possible [default=%(default)d]')
+    parser.add_argument(
+            '--drain', default=5, type=float,
+            help='Seconds to wait, after the last message is sent, for '
+            'the rest of the messages to arrive [default=%(default)g]')
+    parser.add_argument(
+            '--idle', default=1, type=float,
+            help='Seconds without input, after the last message is '
+            'sent, before giving up on the rest [default=%(default)g]')
+    parser.add_argument(
+            'server_args', nargs='*',
+            help='Extra arguments for the server (after --)')
+    args = parser.parse_args(argv[1:])
+
+    if not os.path.isdir(args.recording):
+        print('ERROR: no recording [%s]' % args.recording)
+        return 1
+
+    board_ids = set(args.boards.split(',')) if args.boards else None
+    events = load_recording(args.recording, board_ids)
+    if not events:
+        print('ERROR: nothing to replay in [%s]' % args.recording)
+        return 1
+
+    speeds = [float(speed) for speed in args.speeds.split(',')]
+    raise_fd_limit()
+
+    print('%d events over %.2f seconds' % (
+            len(events), events[-1][0] - events[0][0]))
+    print('%8s %8s %10s %12s %9s %9s %9s %9s %8s %8s' % (
+            'speed', 'msgs', 'sent/sec', 'delivered/sec', 'p50 ms',
+            'p99 ms', 'p999 ms', 'max ms', 'cpu s', 'resyncs'))
+
+    for speed in speeds:
+        proc, port = spawn_server(*args.server_args)
+        try:
+            result = run_replay(port, args, events, speed)
+        finally:
+            rusage = stop_server(proc)
+
+        print('%8s %8d %10.0f %12.0f %9.2f %9.2f %9.2f %9.2f %8.2f %8d' % (
+                '%gx' % speed if speed else 'max', result['sent'],
+                result['sent_rate'], result['delivered_rate'],
+                1000 * result['p50'], 1000 * result['p99'],
+                1000 * result['p999'], 1000 * result['max'],
+                rusage.ru_utime + rusage.ru_stime, result['resynced']))
+        sys.stdout.flush()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
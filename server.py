@@ -30,20 +30,40 @@
 Server class for the Snoods system
 
 The server simply relays messages between clients,
-including sending all message history to any new
-clients when they join.
+including sending the current state of the board to any
+new clients when they join.
 
 There is no error checking on the messages -- nor
 does the server understand the protocol, beyond
-knowing how to find message boundaries.
+knowing how to find message boundaries and which
+object each message refers to.
 """
 
-
-import select
+import selectors
 import socket
 import threading
+import zlib
 
+from board_state import SnoodsBoardState
+from connection import SnoodsConnection
+from handoff import recv_handoff
+from handoff import send_handoff
+from protocol import SnoodsBinaryCodec
 from protocol import SnoodsProtocol
+from protocol import SnoodsProtocolError
+
+
+def board_shard(board_id, n_shards):
+    """
+    Return the index of the shard (i.e. the worker process)
+    that owns the given board_id, when the boards are split
+    among n_shards shards
+
+    This must give the same answer in every process, so it
+    can't use hash(), which is randomized per process
+    """
+
+    return zlib.crc32(board_id.encode('utf-8')) % n_shards
 
 
 class SnoodsServer(threading.Thread):
@@ -51,155 +71,715 @@ class SnoodsServer(threading.Thread):
     Thread that runs a Snoods server on a given socket address.
     """
 
-    def __init__(self, sockaddr):
+    def __init__(
+            self, sockaddr, store=None, init_msgs=None,
+            high_water=SnoodsConnection.DEFAULT_HIGH_WATER,
+            lag_policy=SnoodsConnection.DEFAULT_POLICY,
+            coalesce=False, shard=None, handoff=None, recorder=None):
+        """
+        If store is provided, it is a SnoodsBoardStore that is
+        used to recreate the boards when the server starts and
+        to log all the changes to the boards.
+
+        If init_msgs is provided, it is a list of messages to
+        seed the default board with when the server starts, unless
+        the store already has the default board (the seed is
+        written to the store, so it is only applied once).
+
+        The high_water and lag_policy are used for the output
+        queue of each client; see SnoodsConnection for details.
+
+        If coalesce is True, then whenever several position (or
+        color) updates for the same object arrive during the same
+        tick, only the last one is relayed and kept.
+
+        If shard is provided, then this server is one of several
+        worker processes that split the boards between them (see
+        shard.py).  In this case shard is a tuple (index, n_shards),
+        and handoff is a Unix-domain socket connected to the router,
+        over which new connections arrive and over which connections
+        are sent back when they join a board owned by another worker.
+        For a worker, sockaddr is None, because the router accepts
+        all of the connections.
+
+        If recorder is provided, it is a SnoodsRecorder that is
+        used to record all of the messages that arrive from the
+        clients (see record.py).
+        """
 
         threading.Thread.__init__(self)
 
+        if lag_policy not in SnoodsConnection.POLICIES:
+            raise ValueError('unknown lag policy [%s]' % lag_policy)
+
         self.sockaddr = sockaddr
+        self.store = store
+        self.recorder = recorder
+        self.high_water = high_water
+        self.lag_policy = lag_policy
+        self.coalesce = coalesce
+
+        # the number of messages removed by coalescing
+        #
+        self.coalesced_msgs = 0
 
         self.lock = threading.RLock()
-        self.all_clients = set()
+
+        # map from each client socket to its SnoodsConnection
+        #
+        self.connections = dict()
 
         self.boardid2clients = dict()
         self.boardid2clients['default'] = set()
-        self.sock2board = dict()
 
-        # map from the client sockets to the buffers used
-        # for partial messages.  We cannot assume that every
-        # recv() gets a complete message -- or only one message!
+        # map from each board_id to the SnoodsBoardState
+        # for that board
         #
-        self.client2buf = dict()
-
         self.msg_history = dict()
 
-        self.listener = socket.socket()
-        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.listener.bind(sockaddr)
-        self.listener.listen()
+        # map from the text form of each message that arrived from
+        # a binary client during the current tick to the binary
+        # message as it arrived, so that it can be relayed to the
+        # other binary clients without translating it back again
+        #
+        self.binary_forms = dict()
+
+        # Map from board_id to the list of messages that the server
+        # itself has created for the board (to end the drawings of
+        # clients that have left), to be relayed with the messages
+        # from the clients during the next tick
+        #
+        self.server_msgs = dict()
+
+        self.shard = shard
+        self.handoff = handoff
 
-    def init_new_sock(self, new_sock, board_id):
+        if store:
+            self.msg_history.update(store.load(owns=self.owns))
+            for board_id, state in self.msg_history.items():
+                self.boardid2clients.setdefault(board_id, set())
+
+                # The clients that were drawing when the server
+                # stopped are gone, so end their drawings
+                #
+                end_msgs = [
+                        SnoodsBoardState.END_STROKE_CMD + b'/' + viob_id
+                        for viob_id in state.strokes]
+                if end_msgs:
+                    state.extend(end_msgs)
+                    store.append(board_id, end_msgs)
+
+        # If the default board was loaded from the store, then it
+        # was seeded when the store was created, and the seed may
+        # since have been changed (or erased) by the clients
+        #
+        if (init_msgs and self.owns('default') and
+                'default' not in self.msg_history):
+            self.msg_history['default'] = SnoodsBoardState()
+            self.msg_history['default'].extend(init_msgs)
+            if self.store:
+                self.store.append('default', init_msgs)
+                self.store.sync(self.msg_history, force=True)
+
+        self.selector = selectors.DefaultSelector()
+        self.do_run = True
+
+        if sockaddr is None:
+            self.listener = None
+        else:
+            self.listener = SnoodsServer.make_listener(sockaddr)
+
+    @staticmethod
+    def make_listener(sockaddr):
+        """
+        Create a socket that listens for new clients on sockaddr
+        """
+
+        listener = socket.socket()
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(sockaddr)
+
+        # Use the largest backlog the system allows, so that a
+        # burst of clients connecting at once (e.g. at the start
+        # of a class) isn't turned away while the server is busy
+        #
+        listener.listen(socket.SOMAXCONN)
+
+        return listener
+
+    def owns(self, board_id):
+        """
+        Return True if this server is responsible for the board
+        """
+
+        if not self.shard:
+            return True
+
+        index, n_shards = self.shard
+        return board_shard(board_id, n_shards) == index
+
+    def join_board(self, conn, board_id):
         """
-        Initialize the association between a socket and
-        a board_id.
+        Initialize the association between a connection
+        and a board_id.
 
-        This includes catching up a new sock with the history
-        of messages
+        This includes catching up the connection with the
+        current state of the board
         """
 
-        # If this socket is already bound to a board,
+        # If this connection is already bound to a board,
         # then unbind it
         #
-        if new_sock in self.sock2board:
-            old_board_id = self.sock2board[new_sock]
-            self.boardid2clients[old_board_id].remove(new_sock)
+        if conn.board_id is not None:
+            self.boardid2clients[conn.board_id].discard(conn)
+            if self.recorder:
+                self.recorder.leave(conn.board_id, conn)
+            self.end_strokes(conn)
 
         # If the board_id has never been seen before,
         # then create a msg_history and boardid2clients
         # for it
         #
         if board_id not in self.msg_history:
-            self.msg_history[board_id] = list()
+            self.msg_history[board_id] = SnoodsBoardState()
 
         if board_id not in self.boardid2clients:
             self.boardid2clients[board_id] = set()
 
-        self.sock2board[new_sock] = board_id
-        self.boardid2clients[board_id].add(new_sock)
+        conn.board_id = board_id
+        self.boardid2clients[board_id].add(conn)
 
-        # send the client a board change join message,
-        # to let it know that the board change was
-        # done, and then send it any known history
-        # for the board
-        #
-        msg = '<join/%s' % SnoodsProtocol.escape_str(board_id)
-        msg = msg.encode('utf-8')
-        new_sock.send(msg + SnoodsProtocol.recsep)
+        if self.recorder:
+            self.recorder.record(
+                    board_id, conn,
+                    SnoodsProtocol.format_msg('<join', (board_id,)))
+
+        self.send_board(conn)
+
+    def send_board(self, conn):
+        """
+        Send the client a board change join message, to let it
+        know that the board change was done, and then send it the
+        messages needed to recreate the current state of the board
+
+        This is also used to resync a client that has fallen too
+        far behind: the client starts over from the join.
+
+        The messages for the board are sent from chunks that are
+        shared by every client that joins the board, so this does
+        not depend on the number of messages.
+        """
 
-        for msg in self.msg_history[board_id]:
-            new_sock.send(msg + SnoodsProtocol.recsep)
+        msg = '<join/%s' % SnoodsProtocol.escape_str(conn.board_id)
+        conn.enqueue_msg(msg.encode('utf-8'), is_live=False)
+
+        chunks = self.msg_history[conn.board_id].catchup(
+                binary=conn.version == SnoodsProtocol.BINARY_VERSION,
+                legacy=conn.version == SnoodsProtocol.LEGACY_VERSION)
+        for buf, n_msgs in chunks:
+            if buf:
+                conn.enqueue(buf, n_msgs, is_live=False)
 
     def relay_msgs(self, board_id, msgs):
         """
-        Send all the msgs to all of the current clients
+        Add all the msgs to the output queues of all of the
+        current clients of the board
+
+        The msgs are framed and joined into a single buffer
+        once, and that same buffer is added to the queue of
+        every client.  The queues are not sent until the end
+        of the tick, at which point each client is sent its
+        queue with a single (vectored) write.
+
+        The clients that use the binary protocol share a single
+        buffer of the messages in binary, which is only created if
+        there are any such clients.  The messages that arrived from
+        binary clients are relayed as they arrived; only the others
+        are translated.
+
+        The messages are also folded into the state of the board,
+        and the legacy clients are sent the messages as the state
+        translates them (because the translation depends on the
+        state).
         """
 
-        all_clients = self.boardid2clients[board_id]
+        state = self.msg_history[board_id]
+
+        batch = SnoodsProtocol.recsep.join(msgs) + SnoodsProtocol.recsep
+        binary_batch = None
+        n_msgs = len(msgs)
+
+        legacy_clients = list()
+        for conn in self.boardid2clients[board_id]:
+            if conn.version == SnoodsProtocol.BINARY_VERSION:
+                if binary_batch is None:
+                    binary_batch = self.binary_batch(msgs)
+                conn.enqueue(binary_batch, n_msgs)
+            elif conn.version == SnoodsProtocol.LEGACY_VERSION:
+                legacy_clients.append(conn)
+            else:
+                conn.enqueue(batch, n_msgs)
 
+        legacy_batch = state.extend(
+                msgs, batch=batch, binary_batch=binary_batch,
+                legacy=bool(legacy_clients))
+
+        if legacy_clients and legacy_batch[1]:
+            for conn in legacy_clients:
+                conn.enqueue(*legacy_batch)
+
+    def binary_batch(self, msgs):
+        """
+        Return the msgs (in text form) framed for the binary
+        protocol, using the binary form in which each message
+        arrived, if it arrived from a binary client
+        """
+
+        binary_forms = self.binary_forms
+        from_text = SnoodsBinaryCodec.from_text
+
+        binary_msgs = list()
         for msg in msgs:
-            for sock in all_clients:
-                try:
-                    # print('sending [%s]' % str(msg))
-                    sock.send(msg + SnoodsProtocol.recsep)
-                except BaseException:
-                    pass
+            binary_msg = binary_forms.get(msg)
+            if binary_msg is None:
+                binary_msg = from_text(msg)
+            binary_msgs.append(binary_msg)
 
-    def run(self):
+        return SnoodsBinaryCodec.framer.frame(binary_msgs)
+
+    def check_lag(self, conn):
+        """
+        Apply the lag policy to a connection whose queue of
+        relayed traffic is over its high-water mark
+
+        Returns False if the connection was closed
+        """
+
+        if not conn.is_lagging():
+            return True
+
+        if conn.policy == 'coalesce':
+            conn.coalesce()
+            if not conn.is_lagging():
+                return True
+
+        if conn.policy == 'disconnect':
+            self.drop_client(conn)
+            return False
+
+        conn.clear_queue()
+        conn.resyncs += 1
+        self.send_board(conn)
+        return True
+
+    def flush_client(self, conn):
+        """
+        Send as much of the output queue of the connection as
+        possible without blocking, and update whether the server
+        needs to wait for the socket to become writable
+        """
 
-        all_clients = self.all_clients
-        # all_clients = self.boardid2client[board_id]
+        try:
+            is_empty = conn.flush()
+        except OSError as _exc:
+            self.drop_client(conn)
+            return
+
+        if is_empty == conn.want_write:
+            conn.want_write = not is_empty
+            events = selectors.EVENT_READ
+            if conn.want_write:
+                events |= selectors.EVENT_WRITE
+            self.selector.modify(conn.sock, events, conn)
+
+    def add_client(self, sock):
+        """
+        Create a connection for a new client socket, and register
+        it with the selector
+
+        Returns the new SnoodsConnection
+        """
+
+        sock.setblocking(False)
+
+        # Everything queued for a client during a tick is sent with
+        # one write, so there's nothing to gain from Nagle's
+        # algorithm, and waiting for the client's (delayed) ACK
+        # before sending the next tick's output adds tens of ms.
+        # (This fails harmlessly for sockets that aren't TCP.)
+        #
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError as _exc:
+            pass
+
+        conn = SnoodsConnection(
+                sock, high_water=self.high_water, policy=self.lag_policy)
+
+        self.connections[sock] = conn
+        self.selector.register(sock, selectors.EVENT_READ, conn)
+
+        return conn
+
+    def accept_clients(self):
+        """
+        Accept all of the pending connections on the listener,
+        and register each new socket with the selector
+
+        New clients start out on the default board
+        """
 
         while True:
-            all_msgs = dict()
+            try:
+                new_sock, _conn_addr = self.listener.accept()
+            except (BlockingIOError, InterruptedError) as _exc:
+                return
+
+            conn = self.add_client(new_sock)
+            self.join_board(conn, 'default')
+            self.flush_client(conn)
 
-            r_in = list([self.listener]) + list(all_clients)
-            w_in = list()
-            x_in = list(all_clients)
+    def adopt_client(self, all_msgs):
+        """
+        Receive a connection handed off by the router, join it to
+        its board, and process any input that came with it
+
+        Returns the new connection
+        """
 
-            r_out, _w_out, x_out = select.select(r_in, w_in, x_in, 0.1)
+        sock, header, inbuf, outbuf = recv_handoff(self.handoff)
 
-            for sock in r_out:
-                if sock == self.listener:
-                    board_id = 'default'
+        conn = self.add_client(sock)
+        conn.set_version(header.get('version', SnoodsProtocol.LEGACY_VERSION))
 
-                    new_sock, _conn_addr = self.listener.accept()
-                    self.init_new_sock(new_sock, board_id)
-                    self.boardid2clients[board_id].add(new_sock)
-                    self.all_clients.add(new_sock)
-                    self.sock2board[new_sock] = board_id
-                    self.client2buf[new_sock] = b''
+        # If part of a message was sent to the client by its
+        # previous owner, then the rest must be sent first
+        #
+        if outbuf:
+            conn.enqueue(outbuf, 0, is_live=False)
+
+        self.join_board(conn, header['board_id'])
+
+        conn.framer.feed(inbuf)
+        self.parse_input(conn, all_msgs)
+
+        return conn
+
+    def release_client(self, conn, board_id, inbuf):
+        """
+        Hand a connection back to the router, because it has
+        joined a board owned by another worker, along with
+        the input (inbuf) that follows the join
+        """
+
+        header = {'board_id': board_id, 'version': conn.version}
+        send_handoff(
+                self.handoff, conn.sock, header,
+                inbuf, conn.partial_output())
+        self.drop_client(conn)
+
+    def drop_client(self, conn):
+        """
+        Forget everything about a client whose connection
+        has closed (or that must be disconnected), and close
+        the socket
+        """
+
+        if conn.sock not in self.connections:
+            return
+
+        # make sure that this connection isn't flushed
+        # later in this tick
+        #
+        conn.outq.clear()
+
+        self.selector.unregister(conn.sock)
+        del self.connections[conn.sock]
+
+        if conn.board_id is not None:
+            self.boardid2clients[conn.board_id].discard(conn)
+            if self.recorder:
+                self.recorder.leave(conn.board_id, conn, closed=True)
+
+        self.end_strokes(conn)
+
+        conn.sock.close()
+
+    def end_strokes(self, conn):
+        """
+        End the freehand drawings that the client has begun but
+        not ended, because it has left their board
+
+        Otherwise the drawings would stay unfinished forever: they
+        would be kept as their separate <begfre and <addfre messages,
+        and legacy clients would never see them.
+        """
+
+        for viob_id, board_id in conn.open_strokes.items():
+            msg = SnoodsBoardState.END_STROKE_CMD + b'/' + viob_id
+            self.server_msgs.setdefault(board_id, list()).append(msg)
+
+        conn.open_strokes = dict()
+
+    def unparsed(self, conn, msgs):
+        """
+        Return the input from the client that hasn't been processed:
+        msgs (the text form of the rest of the messages that have been
+        split from the input), encoded as they were received, followed
+        by the input that hasn't been split into messages yet
+        """
+
+        if conn.version == SnoodsProtocol.BINARY_VERSION:
+            data = SnoodsBinaryCodec.frame_text(msgs)
+        else:
+            data = conn.framer.frame(msgs)
+
+        return data + conn.framer.take_remainder()
+
+    def negotiate(self, conn, version):
+        """
+        Reply to a hello from a client with the highest protocol
+        version that both the client and the server understand,
+        and switch the connection to that version
+
+        The reply is always sent in the text protocol, so that
+        the client can read it before it switches.  Any client
+        that sends a hello understands at least the current text
+        protocol, so it is no longer treated as a legacy client.
+        """
+
+        try:
+            version = min(int(version), SnoodsProtocol.VERSION)
+        except ValueError as _exc:
+            version = SnoodsProtocol.TEXT_VERSION
+
+        version = max(version, SnoodsProtocol.TEXT_VERSION)
+
+        conn.enqueue_msg(b'<hello/%d' % version, is_live=False)
+        conn.set_version(version)
+
+    def read_client(self, conn, all_msgs):
+        """
+        Read whatever input is available from a client, and
+        add the complete messages to all_msgs (a map from
+        board_id to the list of messages for that board)
+
+        Returns False if the connection was closed
+        """
+
+        try:
+            n_read = conn.framer.recv(conn.sock)
+        except (BlockingIOError, InterruptedError) as _exc:
+            return True
+        except OSError as _exc:
+            n_read = 0
+
+        if not n_read:
+            self.drop_client(conn)
+            return False
+
+        return self.parse_input(conn, all_msgs)
+
+    def parse_input(self, conn, all_msgs):
+        """
+        Process the complete messages in the input buffer of
+        a client, and add them to all_msgs (a map from board_id
+        to the list of messages for that board)
+
+        Returns False if the connection was handed off, or was
+        closed because the client sent something that isn't a
+        message at all
+        """
+
+        # The server keeps all of the messages in their text form
+        #
+        try:
+            msgs = conn.framer.msgs()
+            if conn.version == SnoodsProtocol.BINARY_VERSION:
+                binary_msgs = msgs
+                msgs = [SnoodsBinaryCodec.to_text(msg) for msg in msgs]
+                self.binary_forms.update(zip(msgs, binary_msgs))
+        except SnoodsProtocolError as exc:
+            print('ERROR: dropping client: %s' % str(exc))
+            self.drop_client(conn)
+            return False
+
+        for ind, msg in enumerate(msgs):
+            cmd = SnoodsProtocol.parse_msg(msg)
+            command = cmd.get('command')
+            if command == '<join':
+                board_id = cmd['board_id']
+                if self.owns(board_id):
+                    self.join_board(conn, board_id)
                 else:
-                    try:
-                        recv_val = sock.recv(8192)
-                    except ConnectionResetError as _exc:
-                        recv_val = 0
-
-                    if recv_val:
-                        self.client2buf[sock] += recv_val
-                        # print('BUF ' + self.client2buf[sock].decode('utf-8'))
-
-                        msgs, remainder = SnoodsProtocol.split_buf(
-                                self.client2buf[sock])
-
-                        self.client2buf[sock] = remainder
-
-                        board_id = self.sock2board[sock]
-                        if board_id not in all_msgs:
-                            all_msgs[board_id] = list()
-
-                        for msg in msgs:
-                            cmd = SnoodsProtocol.parse_msg(msg)
-                            if cmd['command'] == '<join':
-                                new_board_id = cmd['board_id']
-                                self.init_new_sock(sock, new_board_id)
-                            else:
-                                all_msgs[board_id].append(msg)
-                    else:
-                        self.all_clients.remove(sock)
-                        self.client2buf[sock] = b''
-
-            for sock in x_out:
-                print('client exceptional: ' + str(sock))
-
-            for board_id in all_msgs:
-                # relay all of the messages for this board
-                # to all of the current clients of this board
+                    rest = self.unparsed(conn, msgs[ind + 1:])
+                    self.release_client(conn, board_id, rest)
+                    return False
+            elif command == '<hello':
+                # Everything the client sends after the hello is
+                # in the new version, so the rest of the input must
+                # be split into messages again
+                #
+                rest = self.unparsed(conn, msgs[ind + 1:])
+                self.negotiate(conn, cmd['version'])
+                conn.framer.feed(rest)
+                return self.parse_input(conn, all_msgs)
+            else:
+                # Messages that aren't known commands are relayed
+                # as-is, but they must at least be text, or the
+                # client is broken (or hostile)
                 #
-                self.relay_msgs(board_id, all_msgs[board_id])
+                if not cmd and not SnoodsServer.is_text(msg):
+                    print('ERROR: dropping client that sent a '
+                          'message that is not UTF-8')
+                    self.drop_client(conn)
+                    return False
+
+                # Look up the board for each message, because
+                # the client might have changed boards partway
+                # through the buffer
+                #
+                board_id = conn.board_id
+                if board_id not in all_msgs:
+                    all_msgs[board_id] = list()
+                all_msgs[board_id].append(msg)
+
+                if command == '<begfre':
+                    conn.open_strokes[
+                            SnoodsBoardState.msg_key(msg)[1]] = board_id
+                elif command == '<endfre' or command == '<erase':
+                    conn.open_strokes.pop(
+                            SnoodsBoardState.msg_key(msg)[1], None)
+
+                if self.recorder:
+                    self.recorder.record(board_id, conn, msg)
+
+        return True
+
+    @staticmethod
+    def is_text(msg):
+        """
+        Return True if msg (a message from a client) is valid UTF-8
+        """
+
+        try:
+            msg.decode('utf-8')
+        except UnicodeDecodeError as _exc:
+            return False
+
+        return True
+
+    def client_stats(self):
+        """
+        Return a list of the counters for every connection
+        """
+
+        return [conn.stats() for conn in self.connections.values()]
+
+    def stop(self):
+        """ Mark this thread as stopped """
+
+        self.do_run = False
+
+    def run(self):
+
+        # The listener and each client socket are registered
+        # with the selector exactly once (when they're created)
+        # so the cost of each wakeup depends on the number of
+        # sockets that are ready, not the total number of clients
+        #
+        if self.listener:
+            self.listener.setblocking(False)
+            self.selector.register(self.listener, selectors.EVENT_READ)
+
+        # The handoff socket is distinguished from the listener
+        # and the clients by its data
+        #
+        if self.handoff:
+            self.selector.register(
+                    self.handoff, selectors.EVENT_READ, self.handoff)
+
+        while self.do_run:
+            all_msgs = dict()
+
+            # The timeout is only there so that the server
+            # notices when it has been stopped, and flushes
+            # the store periodically
+            #
+            events = self.selector.select(0.1)
+
+            # the connections that have new output or that have
+            # become writable, and therefore need to be flushed
+            #
+            to_flush = set()
 
-                # append the new messages to the message history,
-                # for the benefit of future clients
+            for key, mask in events:
+                conn = key.data
+
+                if conn is None:
+                    self.accept_clients()
+                    continue
+
+                if conn is self.handoff:
+                    try:
+                        to_flush.add(self.adopt_client(all_msgs))
+                    except ConnectionError as _exc:
+                        # the router has exited, so we should too
+                        #
+                        self.stop()
+                    continue
+
+                if mask & selectors.EVENT_READ:
+                    if not self.read_client(conn, all_msgs):
+                        continue
+
+                    # a join adds output to the queue
+                    #
+                    if conn.outq:
+                        to_flush.add(conn)
+
+                if mask & selectors.EVENT_WRITE:
+                    to_flush.add(conn)
+
+            for board_id, msgs in self.server_msgs.items():
+                all_msgs.setdefault(board_id, list()).extend(msgs)
+            self.server_msgs = dict()
+
+            for board_id, msgs in all_msgs.items():
+                # drop the updates that are superseded by later
+                # updates to the same object during this tick
                 #
-                if board_id not in self.msg_history:
-                    self.msg_history[board_id] = list()
+                if self.coalesce:
+                    n_msgs = len(msgs)
+                    msgs = SnoodsBoardState.coalesce_msgs(msgs)
+                    self.coalesced_msgs += n_msgs - len(msgs)
 
-                self.msg_history[board_id] += all_msgs[board_id]
+                # relay all of the messages for this board
+                # to all of the current clients of this board, and
+                # fold them into the state of the board, for the
+                # benefit of future clients
+                #
+                self.relay_msgs(board_id, msgs)
+                to_flush.update(self.boardid2clients[board_id])
+
+                if self.store:
+                    self.store.append(board_id, msgs)
+
+            self.binary_forms.clear()
+
+            for conn in to_flush:
+                if conn.sock in self.connections and self.check_lag(conn):
+                    self.flush_client(conn)
+
+            # make sure that the logs are flushed to disk
+            # periodically, even if no new messages arrive
+            #
+            if self.store:
+                self.store.sync(self.msg_history)
+            if self.recorder:
+                self.recorder.sync()
+
+        if self.store:
+            self.store.close()
+        if self.recorder:
+            self.recorder.close()
@@ -0,0 +1,290 @@
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Running the Snoods server as several processes
+
+Each board is owned by exactly one worker process, chosen by
+hashing the board_id (see board_shard in server.py), and each
+worker is an ordinary SnoodsServer that only handles the clients
+of the boards it owns.  Because the clients of a board only ever
+exchange messages with each other, the workers never need to talk
+to each other, and the boards can be spread across all of the CPUs.
+
+The router accepts all of the connections, waits (briefly) for the
+first message from each new client, and hands the connection to the
+worker that owns the board that the client asks to join, or the
+worker that owns the default board if the client doesn't ask for a
+board.  If a client later joins a board owned by a different worker,
+then that worker hands the connection back to the router, which
+hands it on to the right worker.  The connections are passed between
+the processes as file descriptors (see handoff.py), so the router is
+not involved in relaying any messages.
+"""
+
+import multiprocessing
+import selectors
+import socket
+import threading
+import time
+
+from handoff import recv_handoff
+from handoff import send_handoff
+from protocol import SnoodsProtocol
+from server import SnoodsServer
+from server import board_shard
+
+
+def run_worker(chan, shard, server_args, inherited):
+    """
+    Run one worker process, which is a SnoodsServer that
+    gets its clients from the router via chan
+
+    The inherited sockets belong to the router (the listener,
+    and the router's ends of the channels), and are closed
+    so that the worker sees when the router exits, and the
+    router sees when the worker exits.
+    """
+
+    for sock in inherited:
+        sock.close()
+
+    server = SnoodsServer(None, shard=shard, handoff=chan, **server_args)
+
+    try:
+        server.run()
+    except KeyboardInterrupt as _exc:
+        pass
+
+
+class SnoodsPendingClient(object):
+    """
+    A client that has connected to the router, but which has
+    not been handed to a worker yet
+    """
+
+    def __init__(self, sock, deadline):
+
+        self.sock = sock
+        self.deadline = deadline
+        self.inbuf = b''
+
+
+class SnoodsShardRouter(threading.Thread):
+    """
+    Accepts client connections and hands each one to the
+    worker process that owns the board the client joins
+    """
+
+    def __init__(self, sockaddr, n_workers, route_timeout=0.25, **kwargs):
+        """
+        The kwargs are passed to the SnoodsServer of each worker.
+        Each worker uses only the part of the store (if any) that
+        holds the boards it owns, and the init_msgs (if any) are
+        only used by the worker that owns the default board.
+
+        route_timeout is the longest time to wait for the first
+        message from a new client before assuming that the client
+        wants the default board
+        """
+
+        threading.Thread.__init__(self)
+
+        self.n_workers = n_workers
+        self.route_timeout = route_timeout
+        self.do_run = True
+
+        self.selector = selectors.DefaultSelector()
+        self.pending = dict()
+
+        self.listener = SnoodsServer.make_listener(sockaddr)
+
+        # the router's end of the handoff channel for each worker
+        #
+        self.chans = list()
+        self.workers = list()
+
+        for _index in range(n_workers):
+            self.chans.append(socket.socketpair(socket.AF_UNIX))
+
+        for index in range(n_workers):
+            inherited = [self.listener]
+            inherited += [chan for chan, _worker_chan in self.chans]
+            inherited += [worker_chan for ind, (_chan, worker_chan)
+                          in enumerate(self.chans) if ind != index]
+
+            worker = multiprocessing.Process(
+                    target=run_worker,
+                    args=(self.chans[index][1], (index, n_workers),
+                          kwargs, inherited),
+                    daemon=True)
+            self.workers.append(worker)
+
+    def start(self):
+
+        for worker in self.workers:
+            worker.start()
+
+        # The workers have their own copies of their ends of the
+        # channels, so the router's copies aren't needed anymore
+        #
+        for ind, (chan, worker_chan) in enumerate(self.chans):
+            worker_chan.close()
+            self.chans[ind] = chan
+
+        threading.Thread.start(self)
+
+    def stop(self):
+        self.do_run = False
+
+    def route_client(
+            self, sock, board_id, inbuf=b'', outbuf=b'',
+            version=SnoodsProtocol.LEGACY_VERSION):
+        """
+        Hand a client to the worker that owns board_id
+        """
+
+        chan = self.chans[board_shard(board_id, self.n_workers)]
+        header = {'board_id': board_id, 'version': version}
+        try:
+            send_handoff(chan, sock, header, inbuf, outbuf)
+        except OSError as exc:
+            print('ERROR: cannot hand off client: %s' % str(exc))
+        sock.close()
+
+    def route_pending(self, pending):
+        """
+        Look at the first message from a new client (if any),
+        and hand the client to the worker for its board
+        """
+
+        self.selector.unregister(pending.sock)
+        del self.pending[pending.sock]
+
+        msg, sep, rest = pending.inbuf.partition(SnoodsProtocol.recsep)
+        if sep:
+            cmd = SnoodsProtocol.parse_msg(msg)
+            if cmd.get('command') == '<join':
+                self.route_client(pending.sock, cmd['board_id'], rest)
+                return
+
+        self.route_client(pending.sock, 'default', pending.inbuf)
+
+    def accept_clients(self):
+        """
+        Accept all of the pending connections on the listener,
+        and wait for the first message from each one
+        """
+
+        while True:
+            try:
+                new_sock, _conn_addr = self.listener.accept()
+            except (BlockingIOError, InterruptedError) as _exc:
+                return
+
+            new_sock.setblocking(False)
+            pending = SnoodsPendingClient(
+                    new_sock, time.monotonic() + self.route_timeout)
+            self.pending[new_sock] = pending
+            self.selector.register(new_sock, selectors.EVENT_READ, pending)
+
+    def read_pending(self, pending):
+        """
+        Read the input from a new client, and route it once
+        its first message is complete
+        """
+
+        try:
+            recv_val = pending.sock.recv(8192)
+        except (BlockingIOError, InterruptedError) as _exc:
+            return
+        except OSError as _exc:
+            recv_val = b''
+
+        if not recv_val:
+            self.selector.unregister(pending.sock)
+            del self.pending[pending.sock]
+            pending.sock.close()
+            return
+
+        pending.inbuf += recv_val
+        if SnoodsProtocol.recsep in pending.inbuf:
+            self.route_pending(pending)
+
+    def reroute_client(self, chan):
+        """
+        Receive a client that has been handed back by a worker,
+        and hand it to the worker that owns its new board
+        """
+
+        try:
+            sock, header, inbuf, outbuf = recv_handoff(chan)
+        except ConnectionError as _exc:
+            print('ERROR: lost contact with a worker')
+            self.stop()
+            return
+
+        self.route_client(
+                sock, header['board_id'], inbuf, outbuf,
+                header.get('version', SnoodsProtocol.LEGACY_VERSION))
+
+    def run(self):
+
+        self.listener.setblocking(False)
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        for chan in self.chans:
+            self.selector.register(chan, selectors.EVENT_READ, chan)
+
+        while self.do_run:
+            events = self.selector.select(self.route_timeout / 4)
+
+            for key, _mask in events:
+                if key.data is None:
+                    self.accept_clients()
+                elif isinstance(key.data, SnoodsPendingClient):
+                    self.read_pending(key.data)
+                else:
+                    self.reroute_client(key.data)
+
+            # route the clients that haven't sent a complete
+            # message in time to the default board
+            #
+            now = time.monotonic()
+            for pending in list(self.pending.values()):
+                if pending.deadline <= now:
+                    self.route_pending(pending)
+
+        # Other processes may have inherited copies of the
+        # channels, so shut them down explicitly in order to
+        # make sure that each worker sees that the router is done
+        #
+        for chan in self.chans:
+            chan.shutdown(socket.SHUT_RDWR)
+            chan.close()
+        for worker in self.workers:
+            worker.join()
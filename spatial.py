@@ -0,0 +1,277 @@
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+A spatial index of the objects on a board, for finding the objects
+near a point (when the user clicks on the canvas) or inside a
+rectangle (for selection, or for finding the objects in view)
+without asking the canvas, whose queries look at every item.
+
+The index is a uniform grid: the plane is divided into square
+cells, and each object is listed in every cell that its bounding
+box overlaps.  A query only needs to look at the objects in the
+cells that the query overlaps.  This works well for whiteboards,
+where the objects are spread over the board and most of them are
+small compared to the size of the board.
+
+An object so large that it would be listed in more than
+MAX_OBJ_CELLS cells is instead kept in a separate set of large
+objects, which every query looks at, so that one huge object (such
+as a rectangle from a remote client with enormous coordinates)
+can't fill the grid with millions of cells.
+"""
+
+
+class SnoodsSpatialGrid(object):
+    """
+    A uniform grid of cells, mapping keys (typically viob_ids)
+    to their bounding boxes
+
+    Bounding boxes are (x0, y0, x1, y1), with x0 <= x1 and y0 <= y1,
+    in whatever coordinate system the caller uses.
+
+    The grid also remembers the order in which the keys were first
+    added, which is the stacking order of the objects on the canvas,
+    so that queries can return the topmost object first.
+    """
+
+    DEFAULT_CELL_SIZE = 128
+
+    # The most cells that an object may be listed in before it
+    # is treated as a large object
+    #
+    MAX_OBJ_CELLS = 256
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+
+        # Map from each key to its bounding box, and from each key
+        # to its position in the stacking order
+        #
+        self.bboxes = dict()
+        self.order = dict()
+        self.counter = 0
+
+        # Map from the (column, row) of each non-empty cell
+        # to the set of keys whose bounding boxes overlap it
+        #
+        self.cells = dict()
+
+        # The keys whose bounding boxes are too large to list
+        # in the cells
+        #
+        self.large = set()
+
+    def __len__(self):
+        return len(self.bboxes)
+
+    def __contains__(self, key):
+        return key in self.bboxes
+
+    def bbox(self, key):
+        """
+        Return the bounding box of a key, or None if it isn't
+        in the grid
+        """
+
+        return self.bboxes.get(key)
+
+    def cell_range(self, bbox):
+        """
+        Return the range of the columns and rows of the
+        cells that overlap the bbox, as (col0, row0, col1, row1)
+        (inclusive)
+        """
+
+        size = self.cell_size
+        return (int(bbox[0] // size), int(bbox[1] // size),
+                int(bbox[2] // size), int(bbox[3] // size))
+
+    def is_large(self, cell_range):
+        """
+        Return True if a key whose bbox covers the given range of
+        cells must be kept with the large keys
+        """
+
+        col0, row0, col1, row1 = cell_range
+        return (col1 - col0 + 1) * (row1 - row0 + 1) > self.MAX_OBJ_CELLS
+
+    def set(self, key, bbox):
+        """
+        Add a key to the grid, or move it to a new bbox if
+        it is already in the grid
+
+        Moving a key doesn't change its position in the
+        stacking order.
+        """
+
+        new_range = self.cell_range(bbox)
+
+        old_bbox = self.bboxes.get(key)
+        if old_bbox is None:
+            self.order[key] = self.counter
+            self.counter += 1
+        else:
+            old_range = self.cell_range(old_bbox)
+
+            # If it's still in the same cells, then only the
+            # bbox itself needs to change
+            #
+            if old_range == new_range:
+                self.bboxes[key] = bbox
+                return
+
+            if key in self.large:
+                self.large.discard(key)
+            else:
+                self.remove_cells(key, old_range)
+
+        self.bboxes[key] = bbox
+
+        if self.is_large(new_range):
+            self.large.add(key)
+            return
+
+        cells = self.cells
+        col0, row0, col1, row1 = new_range
+        for col in range(col0, col1 + 1):
+            for row in range(row0, row1 + 1):
+                cell = cells.get((col, row))
+                if cell is None:
+                    cells[(col, row)] = set([key])
+                else:
+                    cell.add(key)
+
+    def remove_cells(self, key, cell_range):
+        """
+        Remove a key from the cells in the given range
+        """
+
+        cells = self.cells
+        col0, row0, col1, row1 = cell_range
+        for col in range(col0, col1 + 1):
+            for row in range(row0, row1 + 1):
+                cell = cells.get((col, row))
+                if cell is not None:
+                    cell.discard(key)
+                    if not cell:
+                        del cells[(col, row)]
+
+    def remove(self, key):
+        """
+        Remove a key from the grid, if it is there
+        """
+
+        bbox = self.bboxes.pop(key, None)
+        if bbox is None:
+            return
+
+        del self.order[key]
+        if key in self.large:
+            self.large.discard(key)
+        else:
+            self.remove_cells(key, self.cell_range(bbox))
+
+    def clear(self):
+        """
+        Remove everything from the grid
+        """
+
+        self.bboxes = dict()
+        self.order = dict()
+        self.cells = dict()
+        self.large = set()
+
+    def candidates(self, bbox):
+        """
+        Return the set of keys listed in the cells that overlap
+        the bbox, plus the large keys (which includes every key
+        whose bbox overlaps it, and possibly others)
+        """
+
+        cells = self.cells
+        col0, row0, col1, row1 = self.cell_range(bbox)
+
+        # The common case is a query that falls within one cell
+        #
+        if col0 == col1 and row0 == row1:
+            found = cells.get((col0, row0), set())
+            if self.large:
+                found = found | self.large
+            return found
+
+        # A query that covers more cells than there are non-empty
+        # cells (such as a view zoomed far out) only needs to look
+        # at the non-empty cells
+        #
+        found = set(self.large)
+        if (col1 - col0 + 1) * (row1 - row0 + 1) > len(cells):
+            for (col, row), cell in cells.items():
+                if col0 <= col <= col1 and row0 <= row <= row1:
+                    found.update(cell)
+            return found
+
+        for col in range(col0, col1 + 1):
+            for row in range(row0, row1 + 1):
+                cell = cells.get((col, row))
+                if cell:
+                    found.update(cell)
+        return found
+
+    def query_rect(self, x0, y0, x1, y1):
+        """
+        Return a list of the keys whose bounding boxes overlap the
+        rectangle from (x0, y0) to (x1, y1), in stacking order
+        (from the bottom up)
+        """
+
+        if x0 > x1:
+            x0, x1 = x1, x0
+        if y0 > y1:
+            y0, y1 = y1, y0
+
+        bboxes = self.bboxes
+        found = list()
+        for key in self.candidates((x0, y0, x1, y1)):
+            bx0, by0, bx1, by1 = bboxes[key]
+            if bx0 <= x1 and x0 <= bx1 and by0 <= y1 and y0 <= by1:
+                found.append(key)
+
+        found.sort(key=self.order.__getitem__)
+        return found
+
+    def query_point(self, x_pos, y_pos, halo=0):
+        """
+        Return a list of the keys whose bounding boxes are within
+        halo of the point (x_pos, y_pos), with the topmost first
+        """
+
+        found = self.query_rect(
+                x_pos - halo, y_pos - halo, x_pos + halo, y_pos + halo)
+        found.reverse()
+        return found
@@ -0,0 +1,291 @@
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Durable storage for the Snoods server
+
+Each board is stored as a pair of files in a data directory:
+a snapshot, which contains the messages needed to recreate the
+board as of some point in time (in the same compacted form that
+is sent to new clients), and a log of every message that has
+been relayed to the board since that snapshot was taken.
+
+Messages are appended to the log as they are relayed, and the
+log is flushed to stable storage at most once every fsync_interval
+seconds, so that the cost of an fsync is shared by all of the
+messages that arrive during that interval.  Once a log holds more
+than snapshot_interval messages, a new snapshot is written and
+the log is truncated.  When the server restarts, each board is
+recreated from its snapshot plus the tail of its log, so the time
+it takes to restart is bounded by the snapshot interval rather
+than by the age of the board.
+
+Note that replaying a log on top of a snapshot that already
+includes some (or all) of the messages in the log is harmless:
+creating an object that already exists is ignored, erasing an
+object that does not exist is ignored, and the updates are
+replayed in order and therefore leave each object with its
+most recent color and position.  This means that the snapshot
+and the log don't need to be updated atomically.
+"""
+
+import os
+import time
+import urllib.parse
+
+from board_state import SnoodsBoardState
+from protocol import SnoodsProtocol
+
+
+class SnoodsBoardStore(object):
+    """
+    Write-ahead log and snapshots for a set of boards,
+    kept in the directory dirname
+    """
+
+    LOG_SUFFIX = '.log'
+    SNAP_SUFFIX = '.snap'
+
+    def __init__(
+            self, dirname, fsync_interval=0.5, snapshot_interval=10000):
+
+        self.dirname = dirname
+        self.fsync_interval = fsync_interval
+        self.snapshot_interval = snapshot_interval
+
+        # map from board_id to the open log file for that board
+        #
+        self.board2log = dict()
+
+        # map from board_id to the number of messages in the log
+        # for that board, i.e. the number of messages that will
+        # need to be replayed after the next restart
+        #
+        self.board2log_len = dict()
+
+        # the set of board_ids whose logs have been written
+        # since the last time the logs were flushed to disk
+        #
+        self.dirty = set()
+
+        self.last_sync = time.monotonic()
+
+        os.makedirs(dirname, exist_ok=True)
+
+    def board_fname(self, board_id, suffix):
+        """
+        Return the path to the file with the given suffix
+        for the given board_id
+
+        The board_id is quoted so that any board_id can be
+        used safely as a file name
+        """
+
+        quoted_id = urllib.parse.quote(board_id, safe='')
+        return os.path.join(self.dirname, quoted_id + suffix)
+
+    @staticmethod
+    def read_msgs(fname):
+        """
+        Read the messages from a log or snapshot file,
+        returning the list of complete messages and the
+        length of the prefix of the file that they occupy
+
+        If the server crashed while writing a message, then
+        the file may end with an incomplete message; this is
+        ignored.
+        """
+
+        try:
+            with open(fname, 'rb') as fin:
+                buf = fin.read()
+        except FileNotFoundError as _exc:
+            return list(), 0
+
+        msgs, remainder = SnoodsProtocol.split_buf(buf)
+        return [msg for msg in msgs if msg], len(buf) - len(remainder)
+
+    def board_ids(self):
+        """
+        Return the set of board_ids that have files in the
+        data directory
+        """
+
+        board_ids = set()
+        for fname in os.listdir(self.dirname):
+            for suffix in (self.LOG_SUFFIX, self.SNAP_SUFFIX):
+                if fname.endswith(suffix):
+                    quoted_id = fname[:-len(suffix)]
+                    board_ids.add(urllib.parse.unquote(quoted_id))
+
+        return board_ids
+
+    def load(self, owns=None):
+        """
+        Recreate the state of every board in the data directory
+        (or only those for which owns(board_id) is true, if owns
+        is provided), and return a map from board_id to the
+        SnoodsBoardState for each board
+        """
+
+        boards = dict()
+
+        for board_id in self.board_ids():
+            if owns and not owns(board_id):
+                continue
+
+            state = SnoodsBoardState()
+
+            snap_msgs, _snap_len = SnoodsBoardStore.read_msgs(
+                    self.board_fname(board_id, self.SNAP_SUFFIX))
+            state.extend(snap_msgs)
+
+            log_fname = self.board_fname(board_id, self.LOG_SUFFIX)
+            log_msgs, log_len = SnoodsBoardStore.read_msgs(log_fname)
+            state.extend(log_msgs)
+
+            # Discard any incomplete message at the end of the log,
+            # so that new messages aren't appended to it
+            #
+            if os.path.exists(log_fname):
+                os.truncate(log_fname, log_len)
+
+            self.board2log_len[board_id] = len(log_msgs)
+            boards[board_id] = state
+
+        return boards
+
+    def append(self, board_id, msgs):
+        """
+        Append messages to the log for the given board
+
+        The messages are not necessarily written to disk
+        until the next time the logs are synced
+        """
+
+        if not msgs:
+            return
+
+        if board_id not in self.board2log:
+            self.board2log[board_id] = open(
+                    self.board_fname(board_id, self.LOG_SUFFIX), 'ab')
+            self.board2log_len.setdefault(board_id, 0)
+
+        self.board2log[board_id].write(
+                SnoodsProtocol.recsep.join(msgs) + SnoodsProtocol.recsep)
+        self.board2log_len[board_id] += len(msgs)
+        self.dirty.add(board_id)
+
+    def sync(self, boards, force=False):
+        """
+        Flush the logs to disk, if it has been at least
+        fsync_interval seconds since the last flush (or
+        if force is true), and then write a new snapshot
+        for each board whose log has grown too long
+
+        The boards parameter is a map from board_id to
+        SnoodsBoardState, as returned by load()
+        """
+
+        now = time.monotonic()
+        if not force and now - self.last_sync < self.fsync_interval:
+            return
+
+        self.last_sync = now
+
+        for board_id in self.dirty:
+            log = self.board2log[board_id]
+            log.flush()
+            os.fsync(log.fileno())
+
+            if self.board2log_len[board_id] >= self.snapshot_interval:
+                self.snapshot(board_id, boards[board_id])
+
+        self.dirty = set()
+
+    def snapshot(self, board_id, state):
+        """
+        Write a new snapshot for the given board, and then
+        truncate the log for the board
+        """
+
+        snap_fname = self.board_fname(board_id, self.SNAP_SUFFIX)
+        tmp_fname = snap_fname + '.tmp'
+
+        with open(tmp_fname, 'wb') as fout:
+            for msg in state:
+                fout.write(msg + SnoodsProtocol.recsep)
+            fout.flush()
+            os.fsync(fout.fileno())
+
+        os.replace(tmp_fname, snap_fname)
+        SnoodsBoardStore.fsync_dir(self.dirname)
+
+        # Now that the snapshot is safely on disk, the
+        # log can be started over
+        #
+        if board_id in self.board2log:
+            self.board2log[board_id].close()
+
+        self.board2log[board_id] = open(
+                self.board_fname(board_id, self.LOG_SUFFIX), 'wb')
+        self.board2log_len[board_id] = 0
+
+    @staticmethod
+    def fsync_dir(dirname):
+        """
+        Flush the directory entries for dirname to disk,
+        on platforms where this is possible
+        """
+
+        try:
+            dir_fd = os.open(dirname, os.O_RDONLY)
+        except OSError as _exc:
+            return
+
+        try:
+            os.fsync(dir_fd)
+        except OSError as _exc:
+            pass
+        finally:
+            os.close(dir_fd)
+
+    def close(self):
+        """
+        Flush all the logs to disk, and close them
+        """
+
+        for board_id in self.dirty:
+            log = self.board2log[board_id]
+            log.flush()
+            os.fsync(log.fileno())
+        self.dirty = set()
+
+        for log in self.board2log.values():
+            log.close()
+        self.board2log = dict()
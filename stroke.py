@@ -0,0 +1,213 @@
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Encoding and simplification of freehand strokes
+
+A stroke is a list of (x, y) integer points.  In the text protocol,
+a stroke used to be sent as a string of absolute hexadecimal "x,y"
+pairs, separated by spaces.  Consecutive points in a stroke are
+usually only a few pixels apart, so the compact form sends the
+difference between each point and the previous one instead, as
+zigzag varints (the same as the binary protocol), encoded with the
+URL-safe base64 alphabet (which contains no characters that need
+to be escaped) and prefixed with a '~' to distinguish it from the
+original form.  Both forms are accepted by decode_points.
+
+The mouse or tablet also reports many more points than are needed
+to draw the stroke; simplify_points removes the points that are
+within a given distance of the line between their neighbors.
+"""
+
+import base64
+
+from framing import decode_varint
+from framing import encode_varint
+
+
+COMPACT_PREFIX = '~'
+
+# The default tolerance (in pixels) for simplifying strokes.
+# Points that are less than a pixel away from the simplified
+# stroke make no visible difference.
+#
+DEFAULT_TOLERANCE = 1.0
+
+
+def encode_points(points):
+    """
+    Encode a list of (x, y) points in the compact form
+    """
+
+    out = bytearray()
+    prev_x, prev_y = 0, 0
+    for p_x, p_y in points:
+        d_x = p_x - prev_x
+        d_y = p_y - prev_y
+        encode_varint((d_x << 1) if d_x >= 0 else ((-d_x << 1) - 1), out)
+        encode_varint((d_y << 1) if d_y >= 0 else ((-d_y << 1) - 1), out)
+        prev_x, prev_y = p_x, p_y
+
+    data = base64.urlsafe_b64encode(out).rstrip(b'=')
+    return COMPACT_PREFIX + data.decode('ascii')
+
+
+def encode_hex_points(points):
+    """
+    Encode a list of (x, y) points in the original (hexadecimal)
+    form, for clients that don't understand the compact form
+    """
+
+    return ' '.join(['%x,%x' % (p_x, p_y) for p_x, p_y in points])
+
+
+def decode_points(point_str):
+    """
+    Decode a stroke in either the compact form or the original
+    (hexadecimal) form, and return the list of (x, y) points
+
+    Raises ValueError if point_str is not a valid stroke.
+    """
+
+    if not point_str.startswith(COMPACT_PREFIX):
+        points = list()
+        for pair in point_str.split():
+            p_x, p_y = pair.split(',')
+            points.append((int(p_x, 16), int(p_y, 16)))
+        return points
+
+    data = point_str[len(COMPACT_PREFIX):]
+    try:
+        data = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+    except (ValueError, TypeError) as exc:
+        raise ValueError('bad stroke: %s' % str(exc))
+
+    points = list()
+    p_x, p_y = 0, 0
+    pos = 0
+    try:
+        while pos < len(data):
+            d_x, pos = decode_varint(data, pos)
+            d_y, pos = decode_varint(data, pos)
+            p_x += (d_x >> 1) if not d_x & 1 else -((d_x + 1) >> 1)
+            p_y += (d_y >> 1) if not d_y & 1 else -((d_y + 1) >> 1)
+            points.append((p_x, p_y))
+    except IndexError as _exc:
+        raise ValueError('truncated stroke')
+
+    return points
+
+
+def simplify_points(points, tolerance=DEFAULT_TOLERANCE):
+    """
+    Return a copy of points with the points that are less than
+    tolerance pixels from the simplified stroke removed, using the
+    Douglas-Peucker algorithm
+
+    The first and last points are always kept.  If tolerance is
+    zero or less, then all of the points are kept.
+    """
+
+    n_points = len(points)
+    if tolerance <= 0 or n_points < 3:
+        return list(points)
+
+    keep = [False] * n_points
+    keep[0] = keep[-1] = True
+
+    tolerance_sq = tolerance * tolerance
+
+    # An explicit stack of the spans to simplify, rather than
+    # recursion, so that long strokes can't exceed the recursion
+    # limit
+    #
+    spans = [(0, n_points - 1)]
+    while spans:
+        first, last = spans.pop()
+        if last - first < 2:
+            continue
+
+        x_1, y_1 = points[first]
+        x_2, y_2 = points[last]
+        d_x = x_2 - x_1
+        d_y = y_2 - y_1
+        len_sq = d_x * d_x + d_y * d_y
+
+        # The distance from each point to the segment is computed
+        # inline (see segment_dist_sq) because this loop is where
+        # nearly all of the time goes
+        #
+        max_dist_sq = -1
+        max_ind = first
+        for ind in range(first + 1, last):
+            p_x, p_y = points[ind]
+            p_x -= x_1
+            p_y -= y_1
+            dot = p_x * d_x + p_y * d_y
+            if dot <= 0 or len_sq == 0:
+                dist_sq = p_x * p_x + p_y * p_y
+            elif dot >= len_sq:
+                e_x = p_x - d_x
+                e_y = p_y - d_y
+                dist_sq = e_x * e_x + e_y * e_y
+            else:
+                cross = p_x * d_y - p_y * d_x
+                dist_sq = cross * cross / len_sq
+
+            if dist_sq > max_dist_sq:
+                max_dist_sq = dist_sq
+                max_ind = ind
+
+        if max_dist_sq > tolerance_sq:
+            keep[max_ind] = True
+            spans.append((first, max_ind))
+            spans.append((max_ind, last))
+
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def segment_dist_sq(p_x, p_y, d_x, d_y, len_sq):
+    """
+    Return the square of the distance from the point (p_x, p_y)
+    to the segment from (0, 0) to (d_x, d_y), where len_sq is
+    the square of the length of the segment
+    """
+
+    if len_sq == 0:
+        return p_x * p_x + p_y * p_y
+
+    frac = (p_x * d_x + p_y * d_y) / len_sq
+    if frac <= 0:
+        return p_x * p_x + p_y * p_y
+    elif frac >= 1:
+        e_x = p_x - d_x
+        e_y = p_y - d_y
+        return e_x * e_x + e_y * e_y
+
+    cross = p_x * d_y - p_y * d_x
+    return cross * cross / len_sq
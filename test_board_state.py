@@ -0,0 +1,366 @@
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Tests for the per-board state kept by the server: the objects,
+and the catch-up buffers (for the text and binary protocols)
+that are extended with each batch of new messages
+
+Run with "python -m unittest" from this directory.
+"""
+
+import random
+import unittest
+
+from board_state import SnoodsBoardState
+from model import SnoodsBoardModel
+from protocol import SnoodsBinaryCodec
+from protocol import SnoodsProtocol
+
+
+def random_points(rng, n_points):
+    return [(rng.randrange(-500, 500), rng.randrange(-500, 500))
+            for _ind in range(n_points)]
+
+
+class MsgGen(object):
+    """
+    Generates a random mix of the messages that change a board,
+    for a small set of objects (so that the same objects are
+    created, updated, and erased many times), including freehand
+    drawings that are streamed over many messages
+    """
+
+    def __init__(self, rng, n_ids=40):
+        self.rng = rng
+        self.ids = ['obj%d' % ind for ind in range(n_ids)]
+
+        # the drawings that have begun but not ended
+        #
+        self.open_strokes = list()
+
+    def msg(self):
+        rng = self.rng
+        viob_id = rng.choice(self.ids)
+        kind = rng.random()
+
+        if self.open_strokes and kind < 0.25:
+            stroke_id = rng.choice(self.open_strokes)
+            if rng.random() < 0.2:
+                self.open_strokes.remove(stroke_id)
+                return SnoodsProtocol.format_msg('<endfre', (stroke_id,))
+            return SnoodsProtocol.format_msg(
+                    '<addfre', (stroke_id, random_points(rng, 5)))
+
+        if kind < 0.35:
+            return SnoodsProtocol.format_msg(
+                    '<newrec', (viob_id, 0, 0, rng.randrange(100), 50, 'red'))
+        elif kind < 0.4:
+            return SnoodsProtocol.format_msg(
+                    '<newtxt', (viob_id, 1, 2, 'a/b\nc', 'blue',
+                                'Times', '12', 'bold'))
+        elif kind < 0.45:
+            return SnoodsProtocol.format_msg(
+                    '<newfre', (viob_id, 'black', 2,
+                                random_points(rng, 20)))
+        elif kind < 0.5:
+            if viob_id not in self.open_strokes:
+                self.open_strokes.append(viob_id)
+            return SnoodsProtocol.format_msg(
+                    '<begfre', (viob_id, 'green', 3, random_points(rng, 3)))
+        elif kind < 0.7:
+            return SnoodsProtocol.format_msg(
+                    '<posupd', (viob_id, rng.randrange(100), 2, 3, 4))
+        elif kind < 0.85:
+            return SnoodsProtocol.format_msg(
+                    '<colupd', (viob_id, rng.choice(['red', 'x y'])))
+        else:
+            if viob_id in self.open_strokes:
+                self.open_strokes.remove(viob_id)
+            return SnoodsProtocol.format_msg('<erase', (viob_id,))
+
+    def batch(self):
+        return [self.msg() for _ind in range(self.rng.randrange(1, 12))]
+
+
+def replay(msgs):
+    """
+    Return a new state made by applying msgs to an empty board
+    """
+
+    state = SnoodsBoardState()
+    for msg in msgs:
+        state.append_msg(msg)
+
+    return state
+
+
+def text_msgs(chunks):
+    return SnoodsProtocol.split_buf(b''.join([
+            chunk for chunk, _n_msgs in chunks]))[0]
+
+
+def binary_msgs(chunks):
+    msgs = SnoodsBinaryCodec.framer.split(b''.join([
+            chunk for chunk, _n_msgs in chunks]))
+    return [SnoodsBinaryCodec.to_text(msg) for msg in msgs]
+
+
+class TestCatchup(unittest.TestCase):
+
+    def check_catchup(self, state, msgs, chunks):
+        """
+        Check that the catch-up chunks (which hold msgs) recreate
+        the objects (and the unfinished drawings) of the state
+        """
+
+        self.assertEqual(len(msgs), sum([n for _chunk, n in chunks]))
+        self.assertLessEqual(len(chunks), state.MAX_CATCHUP_CHUNKS)
+
+        caught_up = replay(msgs)
+        self.assertEqual(caught_up.objects, state.objects)
+        self.assertEqual(caught_up.strokes, state.strokes)
+
+    def run_board(self, seed, n_batches, min_compact_bytes):
+        rng = random.Random(seed)
+        gen = MsgGen(rng)
+
+        state = SnoodsBoardState()
+        state.MIN_COMPACT_BYTES = min_compact_bytes
+
+        for _ind in range(n_batches):
+            msgs = gen.batch()
+
+            # The server only passes the framed batches when
+            # it has made them anyway
+            #
+            batch = None
+            binary_batch = None
+            if rng.random() < 0.5:
+                batch = SnoodsProtocol.recsep.join(msgs) + b'\n'
+                if rng.random() < 0.5:
+                    binary_batch = SnoodsBinaryCodec.frame_text(msgs)
+
+            state.extend(msgs, batch=batch, binary_batch=binary_batch)
+
+            if rng.random() < 0.1:
+                chunks = state.catchup()
+                self.check_catchup(state, text_msgs(chunks), chunks)
+            if rng.random() < 0.1:
+                chunks = state.catchup(binary=True)
+                self.check_catchup(state, binary_msgs(chunks), chunks)
+
+        chunks = state.catchup()
+        self.check_catchup(state, text_msgs(chunks), chunks)
+        chunks = state.catchup(binary=True)
+        self.check_catchup(state, binary_msgs(chunks), chunks)
+
+        self.assertEqual(replay(list(state)).objects, state.objects)
+
+    def test_catchup(self):
+        for seed in range(5):
+            self.run_board(seed, 300, SnoodsBoardState.MIN_COMPACT_BYTES)
+
+    def test_catchup_compacted(self):
+        # With a small threshold, the buffers are rebuilt often
+        #
+        for seed in range(20):
+            self.run_board(seed, 300, 500)
+
+    def test_many_chunks(self):
+        state = SnoodsBoardState()
+        state.extend([b'<newrec/a/0/0/1/1/red'])
+        state.catchup()
+
+        for ind in range(3 * state.MAX_CATCHUP_CHUNKS):
+            state.extend([b'<posupd/a/%d/0/1/1' % ind])
+            chunks = state.catchup()
+            self.assertLessEqual(len(chunks), state.MAX_CATCHUP_CHUNKS)
+            self.check_catchup(state, text_msgs(chunks), chunks)
+
+    def test_shared(self):
+        # Until new messages arrive, every caller gets the same chunks
+        #
+        state = SnoodsBoardState()
+        state.extend([b'<newrec/a/0/0/1/1/red'])
+        self.assertIs(state.catchup(), state.catchup())
+        self.assertIs(state.catchup(binary=True), state.catchup(binary=True))
+
+    def test_stroke(self):
+        state = SnoodsBoardState()
+        state.extend([SnoodsProtocol.format_msg(
+                '<begfre', ('s', 'red', 2, [(1, 2), (3, 4)]))])
+        state.extend([SnoodsProtocol.format_msg(
+                '<addfre', ('s', [(5, 6)]))])
+        self.assertEqual(len(list(state)), 2)
+
+        state.extend([b'<endfre/s'])
+        self.assertEqual(list(state), [SnoodsProtocol.format_msg(
+                '<newfre', ('s', 'red', 2, [(1, 2), (3, 4), (5, 6)]))])
+
+
+def model_objects(msgs, skip_ids=()):
+    """
+    Apply msgs to a client's model of the board, and return
+    a map from the viob_id of each object (except those in
+    skip_ids) to a tuple that describes it
+    """
+
+    model = SnoodsBoardModel()
+    for msg in msgs:
+        model.apply_msg(SnoodsProtocol.parse_msg(msg))
+
+    return dict(
+            (viob_id, (obj.kind, list(obj.coords), obj.color, obj.width,
+                       obj.text, obj.font))
+            for viob_id, obj in model.objects.items()
+            if viob_id not in skip_ids)
+
+
+class TestLegacy(unittest.TestCase):
+
+    def check_legacy_msgs(self, msgs):
+        for msg in msgs:
+            self.assertNotIn(b'~', msg)
+            self.assertNotIn(SnoodsBoardState.msg_key(msg)[0], (
+                    SnoodsBoardState.BEGIN_STROKE_CMD,
+                    SnoodsBoardState.ADD_STROKE_CMD,
+                    SnoodsBoardState.END_STROKE_CMD))
+
+    def check_board(self, state, legacy_msgs):
+        """
+        Check that a legacy client that has received legacy_msgs
+        has the same board as the server, except for the drawings
+        that haven't ended yet (which legacy clients can't see)
+        """
+
+        self.check_legacy_msgs(legacy_msgs)
+
+        open_ids = [viob_id.decode('utf-8') for viob_id in state.strokes]
+        self.assertEqual(
+                model_objects(legacy_msgs),
+                model_objects(list(state), open_ids))
+
+    def test_legacy(self):
+        for seed in range(20):
+            rng = random.Random(seed)
+            gen = MsgGen(rng)
+
+            state = SnoodsBoardState()
+            state.MIN_COMPACT_BYTES = rng.choice([500, 64 * 1024])
+
+            for _ind in range(rng.randrange(100)):
+                state.extend(gen.batch())
+
+            # The legacy client joins, and is sent the catch-up,
+            # and then the batches that arrive after it
+            #
+            legacy_msgs = text_msgs(state.catchup(legacy=True))
+            self.check_board(state, legacy_msgs)
+
+            for ind in range(200):
+                legacy_batch, n_msgs = state.extend(
+                        gen.batch(), legacy=True)
+                msgs = SnoodsProtocol.split_buf(legacy_batch)[0]
+                self.assertEqual(len(msgs), n_msgs)
+                legacy_msgs += msgs
+
+                if ind % 20 == 0:
+                    self.check_board(state, legacy_msgs)
+
+                    # and another legacy client joins
+                    #
+                    self.check_board(
+                            state, text_msgs(state.catchup(legacy=True)))
+
+            self.check_board(state, legacy_msgs)
+
+    def test_stroke(self):
+        state = SnoodsBoardState()
+        begin = SnoodsProtocol.format_msg(
+                '<begfre', ('s', 'red', 2, [(1, 2), (-3, 4)]))
+        add = SnoodsProtocol.format_msg('<addfre', ('s', [(5, -6)]))
+
+        self.assertEqual(state.extend([begin], legacy=True), (b'', 0))
+        self.assertEqual(
+                state.extend([add, b'<colupd/s/blue'], legacy=True),
+                (b'<colupd/s/blue\n', 1))
+        self.assertEqual(
+                state.extend([b'<endfre/s'], legacy=True),
+                (b'<newfre/s/red/2/1,2 -3,4 5,-6\n<colupd/s/blue\n', 2))
+
+    def test_newfre(self):
+        state = SnoodsBoardState()
+        msg = SnoodsProtocol.format_msg(
+                '<newfre', ('f', 'red', 2, [(16, 17), (0, -1)]))
+        self.assertEqual(
+                state.extend([msg, b'<newfre/g/red/2/a,b'], legacy=True),
+                (b'<newfre/f/red/2/10,11 0,-1\n<newfre/g/red/2/a,b\n', 2))
+
+        # A compact stroke that can't be decoded is dropped
+        #
+        self.assertEqual(
+                state.extend([b'<newfre/h/red/2/~gA'], legacy=True),
+                (b'', 0))
+
+
+class TestCoalesce(unittest.TestCase):
+
+    def test_coalesce(self):
+        msgs = [
+                b'<newrec/a/0/0/1/1/red',
+                b'<posupd/a/1/1/2/2',
+                b'<colupd/a/blue',
+                b'<posupd/a/3/3/4/4',
+                b'<colupd/b/green',
+                b'<colupd/a/red']
+        self.assertEqual(SnoodsBoardState.coalesce_msgs(msgs), [
+                b'<newrec/a/0/0/1/1/red',
+                b'<posupd/a/3/3/4/4',
+                b'<colupd/b/green',
+                b'<colupd/a/red'])
+
+    def test_not_across_erase(self):
+        msgs = [
+                b'<posupd/a/1/1/2/2',
+                b'<erase/a',
+                b'<newrec/a/0/0/1/1/red',
+                b'<posupd/a/3/3/4/4']
+        self.assertEqual(SnoodsBoardState.coalesce_msgs(msgs), msgs)
+
+    def test_same_state(self):
+        for seed in range(20):
+            gen = MsgGen(random.Random(seed))
+            msgs = [gen.msg() for _ind in range(500)]
+            self.assertEqual(
+                    replay(SnoodsBoardState.coalesce_msgs(msgs)).objects,
+                    replay(msgs).objects)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Tests for the framing of the text and binary protocols, and for
+the decoding of binary messages
+
+Run with "python -m unittest" from this directory.
+"""
+
+import socket
+import unittest
+
+from framing import SnoodsBinaryFramer
+from framing import SnoodsFramer
+from framing import SnoodsProtocolError
+from framing import decode_varint
+from framing import encode_varint
+from protocol import SnoodsBinaryCodec
+
+
+def varint(value):
+    out = bytearray()
+    encode_varint(value, out)
+    return bytes(out)
+
+
+class TestVarint(unittest.TestCase):
+
+    def test_round_trip(self):
+        for value in (0, 1, 0x7f, 0x80, 300, 0x3fff, 0x4000, 1 << 40):
+            data = varint(value)
+            self.assertEqual(decode_varint(data, 0), (value, len(data)))
+
+    def test_partial(self):
+        data = varint(1 << 20)
+        for ind in range(len(data)):
+            with self.assertRaises(IndexError):
+                decode_varint(data[:ind], 0)
+
+
+class TestFramer(unittest.TestCase):
+
+    def test_split_message(self):
+        framer = SnoodsFramer(b'\n')
+        framer.feed(b'<abc/1')
+        self.assertEqual(framer.msgs(), [])
+        framer.feed(b'23\n<de')
+        self.assertEqual(framer.msgs(), [b'<abc/123'])
+        framer.feed(b'f\n<g\n')
+        self.assertEqual(framer.msgs(), [b'<def', b'<g'])
+        self.assertEqual(len(framer), 0)
+
+    def test_split_recsep(self):
+        framer = SnoodsFramer(b'\r\n')
+        framer.feed(b'<abc\r')
+        self.assertIsNone(framer.next_msg())
+        framer.feed(b'\n<def\r\n')
+        self.assertEqual([bytes(msg) for msg in framer], [b'<abc', b'<def'])
+
+    def test_one_byte_at_a_time(self):
+        data = b'<a/1\n\n<bb/22\n<ccc/333\n'
+        framer = SnoodsFramer(b'\n')
+        msgs = list()
+        for ind in range(len(data)):
+            framer.feed(data[ind:ind + 1])
+            msgs += [bytes(msg) for msg in framer]
+        self.assertEqual(msgs, framer.split(data))
+
+    def test_too_long(self):
+        framer = SnoodsFramer(b'\n', max_msg_len=100)
+        framer.feed(b'x' * 100 + b'\n')
+        self.assertEqual(framer.msgs(), [b'x' * 100])
+        framer.feed(b'x' * 200)
+        with self.assertRaises(SnoodsProtocolError):
+            framer.msgs()
+
+    def test_recv_grows(self):
+        data = b''.join(b'<msg/%d\n' % ind for ind in range(50000))
+        framer = SnoodsFramer(b'\n')
+        start_len = len(framer.buf)
+        self.assertLess(start_len, framer.recv_size)
+
+        sock0, sock1 = socket.socketpair()
+        try:
+            sock0.sendall(data[:200000])
+            msgs = list()
+            n_read = 0
+            while n_read < 200000:
+                n_read += framer.recv(sock1)
+                msgs += framer.msgs()
+        finally:
+            sock0.close()
+            sock1.close()
+
+        last = data.rfind(b'\n', 0, 200000) + 1
+        self.assertEqual(msgs, framer.split(data[:last]))
+        self.assertGreater(framer.recv_chunk, start_len)
+        self.assertLessEqual(framer.recv_chunk, framer.recv_size)
+
+
+class TestBinaryFramer(unittest.TestCase):
+
+    def test_split_message(self):
+        framer = SnoodsBinaryFramer()
+        data = framer.frame([b'abc', b'', b'x' * 1000, b'defg'])
+        for split in range(len(data) + 1):
+            framer = SnoodsBinaryFramer()
+            framer.feed(data[:split])
+            msgs = framer.msgs()
+            framer.feed(data[split:])
+            msgs += framer.msgs()
+            self.assertEqual(msgs, [b'abc', b'', b'x' * 1000, b'defg'])
+
+    def test_partial_varint(self):
+        framer = SnoodsBinaryFramer()
+        data = framer.frame([b'y' * 20000])
+        self.assertEqual(len(varint(20000)), 3)
+
+        framer.feed(data[:1])
+        self.assertIsNone(framer.next_msg())
+        framer.feed(data[1:2])
+        self.assertEqual(framer.msgs(), [])
+        framer.feed(data[2:3])
+        self.assertIsNone(framer.next_msg())
+        framer.feed(data[3:])
+        self.assertEqual(bytes(framer.next_msg()), b'y' * 20000)
+
+    def test_too_long(self):
+        framer = SnoodsBinaryFramer(max_msg_len=100)
+        framer.feed(framer.frame([b'z' * 100]))
+        self.assertEqual(framer.msgs(), [b'z' * 100])
+
+        framer.feed(varint(101))
+        with self.assertRaises(SnoodsProtocolError):
+            framer.msgs()
+
+        framer = SnoodsBinaryFramer(max_msg_len=100)
+        framer.feed(varint(1 << 30))
+        with self.assertRaises(SnoodsProtocolError):
+            framer.next_msg()
+
+    def test_endless_varint(self):
+        framer = SnoodsBinaryFramer(max_msg_len=100)
+        framer.feed(b'\xff' * 200)
+        with self.assertRaises(SnoodsProtocolError):
+            framer.msgs()
+
+
+class TestBinaryDecode(unittest.TestCase):
+
+    POSUPD = b'<posupd/3f1c9a52-8a9e-4d3b-9c5e-2f0d7b1e6a44/100/200/140/260'
+
+    def test_round_trip(self):
+        msg = SnoodsBinaryCodec.from_text(self.POSUPD)
+        self.assertEqual(SnoodsBinaryCodec.to_text(msg), self.POSUPD)
+
+    def test_empty(self):
+        with self.assertRaises(SnoodsProtocolError):
+            SnoodsBinaryCodec.decode(b'')
+
+    def test_unknown_opcode(self):
+        with self.assertRaises(SnoodsProtocolError):
+            SnoodsBinaryCodec.decode(b'\xfe\x01\x02')
+
+    def test_raw_with_recsep(self):
+        # A text message carried in a binary message must not
+        # contain the record separator, or it would become two
+        # messages when it is relayed to the text clients
+        #
+        msg = b'\x00<erase/zzz\n<join/evil'
+        with self.assertRaises(SnoodsProtocolError):
+            SnoodsBinaryCodec.decode(msg)
+        with self.assertRaises(SnoodsProtocolError):
+            SnoodsBinaryCodec.to_text(msg)
+
+        self.assertEqual(
+                SnoodsBinaryCodec.to_text(b'\x00<erase/zzz'), b'<erase/zzz')
+
+    def test_truncated(self):
+        msg = SnoodsBinaryCodec.from_text(self.POSUPD)
+        for ind in range(1, len(msg)):
+            with self.assertRaises(SnoodsProtocolError):
+                SnoodsBinaryCodec.decode(msg[:ind])
+
+
+if __name__ == '__main__':
+    unittest.main()
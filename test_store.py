@@ -0,0 +1,175 @@
+# Copyright 2020 - Daniel Ellard <ellard@gmail.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Tests for the durable storage of boards: the state recreated
+from the snapshot and log of each board must match the state
+that was live when the server stopped
+
+Run with "python -m unittest" from this directory.
+"""
+
+import os
+import random
+import tempfile
+import unittest
+
+from board_state import SnoodsBoardState
+from protocol import SnoodsProtocol
+from store import SnoodsBoardStore
+from test_board_state import MsgGen
+
+
+class TestStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dirname = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def check_boards(self, live, loaded):
+        self.assertEqual(sorted(live), sorted(loaded))
+        for board_id in live:
+            self.assertEqual(
+                    live[board_id].objects, loaded[board_id].objects)
+            self.assertEqual(
+                    live[board_id].strokes, loaded[board_id].strokes)
+
+    def run_store(self, rng, store, live, n_batches):
+        """
+        Relay n_batches random batches to random boards, updating
+        both the store and the live boards the way the server does
+        """
+
+        gens = dict()
+        for _ind in range(n_batches):
+            board_id = rng.choice(sorted(live))
+            if board_id not in gens:
+                gens[board_id] = MsgGen(rng)
+
+            msgs = gens[board_id].batch()
+            live[board_id].extend(msgs)
+            store.append(board_id, msgs)
+            store.sync(live, force=rng.random() < 0.2)
+
+    def test_round_trip(self):
+        """
+        Appending, taking snapshots, appending more, and then
+        reloading recreates the live boards (including a board
+        whose board_id isn't a safe file name)
+        """
+
+        rng = random.Random(1)
+        live = dict([(board_id, SnoodsBoardState())
+                     for board_id in ('default', 'a/b c', '..')])
+
+        store = SnoodsBoardStore(self.dirname, snapshot_interval=100)
+        self.run_store(rng, store, live, 200)
+        store.close()
+
+        fnames = os.listdir(self.dirname)
+        self.assertIn('a%2Fb%20c.snap', fnames)
+        self.assertFalse([fname for fname in fnames
+                          if fname.endswith('.tmp')])
+
+        store = SnoodsBoardStore(self.dirname, snapshot_interval=100)
+        self.check_boards(live, store.load())
+
+        # A restarted store keeps appending to the same logs,
+        # and the next restart sees both runs
+        #
+        self.run_store(rng, store, live, 200)
+        store.close()
+
+        store = SnoodsBoardStore(self.dirname, snapshot_interval=100)
+        self.check_boards(live, store.load())
+        store.close()
+
+    def test_log_only(self):
+        """
+        A board that has never reached a snapshot is recreated
+        from its log alone
+        """
+
+        rng = random.Random(2)
+        live = dict(default=SnoodsBoardState())
+
+        store = SnoodsBoardStore(self.dirname)
+        self.run_store(rng, store, live, 20)
+        store.close()
+
+        self.assertEqual(os.listdir(self.dirname), ['default.log'])
+
+        store = SnoodsBoardStore(self.dirname)
+        self.check_boards(live, store.load())
+        store.close()
+
+    def test_truncated(self):
+        """
+        An incomplete message at the end of a log (as left by a
+        crash in the middle of a write) is ignored, and is removed
+        so that the messages appended after the restart are intact
+        """
+
+        rng = random.Random(3)
+        live = dict(default=SnoodsBoardState())
+
+        store = SnoodsBoardStore(self.dirname, snapshot_interval=50)
+        self.run_store(rng, store, live, 30)
+        store.close()
+
+        log_fname = store.board_fname('default', store.LOG_SUFFIX)
+        log_len = os.path.getsize(log_fname)
+        partial = SnoodsProtocol.format_msg(
+                '<newrec', ('partial', 0, 0, 10, 10, 'red'))
+        with open(log_fname, 'ab') as fout:
+            fout.write(partial[:-3])
+
+        store = SnoodsBoardStore(self.dirname, snapshot_interval=50)
+        loaded = store.load()
+        self.check_boards(live, loaded)
+        self.assertNotIn(b'partial', loaded['default'].objects)
+        self.assertEqual(os.path.getsize(log_fname), log_len)
+
+        msgs = [SnoodsProtocol.format_msg(
+                '<newrec', ('after', 1, 2, 3, 4, 'blue'))]
+        live['default'].extend(msgs)
+        store.append('default', msgs)
+        store.close()
+
+        store = SnoodsBoardStore(self.dirname, snapshot_interval=50)
+        loaded = store.load()
+        self.check_boards(live, loaded)
+        self.assertIn(b'after', loaded['default'].objects)
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()